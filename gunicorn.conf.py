@@ -0,0 +1,30 @@
+"""
+Gunicorn settings, read automatically from the working directory.
+
+``SERVER_PROFILE`` selects how Django is served:
+
+- ``wsgi`` (default): sync workers, one request at a time per worker.
+- ``asgi``: uvicorn workers running the ASGI application, so a worker keeps
+  serving other requests while an async view waits on the database.
+  Connections are closed after each request (see
+  route_handoff_project/database.py); set ``DATABASE_POOL=True`` to reuse them.
+
+``WEB_CONCURRENCY`` sets the number of worker processes (default 2); gunicorn
+binds to ``$PORT`` when it is set.
+"""
+import os
+
+profile = os.environ.get('SERVER_PROFILE', 'wsgi')
+if profile == 'asgi':
+    wsgi_app = 'route_handoff_project.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+elif profile == 'wsgi':
+    wsgi_app = 'route_handoff_project.wsgi:application'
+else:
+    raise RuntimeError(f'Unknown SERVER_PROFILE {profile!r}; use wsgi or asgi.')
+
+# Exported for settings, which trust a process-local cache only with one worker
+os.environ.setdefault('WEB_CONCURRENCY', '2')
+workers = int(os.environ['WEB_CONCURRENCY'])
+accesslog = '-'
+errorlog = '-'
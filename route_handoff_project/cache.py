@@ -0,0 +1,49 @@
+"""
+Build ``settings.CACHES`` from the environment.
+
+``CACHE_URL`` selects the backend of the default cache:
+
+- ``redis://[:password@]host:6379/0`` (also ``rediss://``): Redis, shared by
+  every worker and replica (needs the ``redis`` package)
+- ``file:///absolute/path``: files in a directory, shared by the workers of
+  one machine
+- ``locmem://`` (default): memory of each worker process
+
+The routes app keeps version counters in this cache (routes.versions). With
+a process-local cache they are only trusted when ``WEB_CONCURRENCY`` is 1.
+This module is imported by settings, so it must not import Django models.
+"""
+from urllib.parse import unquote, urlsplit
+
+from django.core.exceptions import ImproperlyConfigured
+
+BACKENDS = {
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'rediss': 'django.core.cache.backends.redis.RedisCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+}
+
+
+def parse_cache_url(url):
+    """Turn ``url`` into a ``CACHES`` entry."""
+    parts = urlsplit(url)
+    backend = BACKENDS.get(parts.scheme)
+    if backend is None:
+        raise ImproperlyConfigured(f'Unsupported CACHE_URL scheme {parts.scheme!r}.')
+
+    config = {'BACKEND': backend}
+    if backend == BACKENDS['redis']:
+        config['LOCATION'] = url
+    elif backend == BACKENDS['file']:
+        if not parts.path.startswith('/'):
+            raise ImproperlyConfigured('CACHE_URL file:// paths must be absolute.')
+        config['LOCATION'] = unquote(parts.path)
+    else:
+        config['LOCATION'] = parts.netloc or 'routes'
+    return config
+
+
+def caches_from_env(environ):
+    """Build ``CACHES`` from ``CACHE_URL`` (default ``locmem://``)."""
+    return {'default': parse_cache_url(environ.get('CACHE_URL') or 'locmem://')}
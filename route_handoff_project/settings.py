@@ -5,6 +5,9 @@ Django settings for route_handoff_project project.
 import os
 from pathlib import Path
 
+from .cache import caches_from_env
+from .database import database_from_env
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -35,9 +38,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'routes.middleware.InstrumentationMiddleware',  # Opt-in, see ROUTES_INSTRUMENTATION_SAMPLE_RATE
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # For serving static files
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'routes.middleware.StaticFilesMiddleware',  # WhiteNoise static files, sync and async
+    'routes.middleware.SessionMiddleware',  # Django's, with the session save timed
+    'routes.middleware.NavigationSessionMiddleware',  # Writes back NavigationSession changes once
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -69,11 +74,48 @@ WSGI_APPLICATION = 'route_handoff_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Configured from DATABASE_URL (default: SQLite in BASE_DIR), CONN_MAX_AGE,
+# CONN_HEALTH_CHECKS and DATABASE_POOL; see route_handoff_project/database.py
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_from_env(os.environ, default_url=f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
+}
+
+# Configured from CACHE_URL (default: memory of each process); see route_handoff_project/cache.py
+CACHES = caches_from_env(os.environ)
+
+# One Django process serves the site (runserver, tests, WEB_CONCURRENCY=1), so a
+# process-local cache still holds the routes version counters (routes/versions.py)
+ROUTES_SINGLE_PROCESS = os.environ.get('WEB_CONCURRENCY', '1') == '1'
+
+# Share of requests timed by InstrumentationMiddleware (0 disables it, 1 times every request)
+ROUTES_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 0))
+
+# Sampled request timings (JSON lines), session cleanups and failed batched writes are logged to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'routes.instrumentation': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'routes.cleanup': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'routes.batching': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Seconds between in-process stale NavigationSession cleanups (routes/cleanup.py); unset disables them
+ROUTES_SESSION_GC_INTERVAL = int(os.environ.get('SESSION_GC_INTERVAL', 0)) or None
+
+# Append navigation state transitions to the NavigationEvent log, inserted in batches (routes/eventlog.py)
+ROUTES_EVENT_LOG = os.environ.get('EVENT_LOG', 'False') == 'True'
+
+# PRAGMAs applied to every new SQLite connection (routes/db.py): WAL lets
+# readers proceed during writes, and writers wait instead of failing at once
+ROUTES_SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
 }
 
 
@@ -1,24 +1,175 @@
-from django.contrib import admin
-from .models import PickUpLocation, DropOffLocation, NavigationSession
+"""
+Admin for the routes models, tuned for tables of millions of rows.
+
+- Changelists of unfiltered large tables show an estimated row count from
+  the database statistics instead of running ``COUNT(*)`` (``EstimatedCountPaginator``),
+  and never count the whole table a second time for the "show all" link.
+- Session keys are searched by prefix (a range on SQLite, ``LIKE 'prefix%'``
+  elsewhere), which the ``session_key`` indexes answer, instead of a
+  leading-wildcard ``LIKE``.
+- Bulk actions on navigation sessions are single ``UPDATE`` statements.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import (
+    DropOffLocation, Location, NavigationEvent, NavigationSession, PickUpLocation, RouteStop, TransitionRollup,
+)
+from .stores import DatabaseNavigationStore, get_navigation_store
+
+
+def estimated_count(model, using='default'):
+    """
+    Estimate the rows of ``model``'s table from the database statistics.
+
+    PostgreSQL keeps them up to date with (auto)vacuum; SQLite only has them
+    after ``ANALYZE`` (run by the session cleanup's ``--vacuum``). Returns None
+    when there are none.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+            # -1 until the table is first analyzed
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            # The first number of a table's stat is its row count
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s ORDER BY idx IS NOT NULL LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that estimates the count of unfiltered querysets over large tables.
+
+    A queryset is unfiltered when its only conditions are those of the
+    model's default manager, such as the location proxies' role filter. The
+    estimate is of the whole table, so for a proxy it also counts the
+    locations that only have the other role.
+    """
+    # Tables estimated below this size are counted exactly
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where == queryset.model._default_manager.all().query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """ModelAdmin for tables too large to count on every changelist page."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+def _prefix_upper_bound(prefix):
+    # The smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class SessionKeyPrefixSearchMixin:
+    """
+    Search ``session_key`` by prefix, answered by an index.
+
+    SQLite compares text by code point, so the prefix is a range on the plain
+    index. Locale collations (e.g. PostgreSQL's en_US.UTF-8) ignore
+    punctuation such as the ``:`` of driver keys, so there the prefix is a
+    ``LIKE 'prefix%'``, answered by the ``varchar_pattern_ops`` indexes.
+    """
+    search_fields = ['session_key']
+    search_help_text = 'Session keys starting with the search term.'
+
+    def get_search_results(self, request, queryset, search_term):
+        prefix = search_term.strip()
+        if not prefix:
+            return queryset, False
+        if connections[queryset.db].vendor == 'sqlite':
+            return queryset.filter(session_key__gte=prefix, session_key__lt=_prefix_upper_bound(prefix)), False
+        return queryset.filter(session_key__startswith=prefix), False
+
+
+@admin.register(Location)
+class LocationAdmin(LargeTableAdmin):
+    list_display = ['name', 'latitude', 'longitude', 'role', 'created_at']
+    list_filter = ['role', 'created_at']
+    search_fields = ['name']
 
 
 @admin.register(PickUpLocation)
-class PickUpLocationAdmin(admin.ModelAdmin):
+class PickUpLocationAdmin(LargeTableAdmin):
     list_display = ['name', 'latitude', 'longitude', 'created_at']
     list_filter = ['created_at']
     search_fields = ['name']
 
 
 @admin.register(DropOffLocation)
-class DropOffLocationAdmin(admin.ModelAdmin):
+class DropOffLocationAdmin(LargeTableAdmin):
     list_display = ['name', 'latitude', 'longitude', 'created_at']
     list_filter = ['created_at']
     search_fields = ['name']
 
 
 @admin.register(NavigationSession)
-class NavigationSessionAdmin(admin.ModelAdmin):
+class NavigationSessionAdmin(SessionKeyPrefixSearchMixin, LargeTableAdmin):
     list_display = ['session_key', 'pickup', 'dropoff', 'state', 'created_at', 'updated_at']
     list_filter = ['state', 'created_at']
-    search_fields = ['session_key']
+    list_select_related = ['pickup', 'dropoff']
+    date_hierarchy = 'created_at'
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['reset_sessions', 'expire_sessions']
+
+    def _forget_cached(self, queryset):
+        # Stores keeping copies outside the database would keep serving them
+        store = get_navigation_store()
+        if not isinstance(store, DatabaseNavigationStore):
+            store.invalidate(list(queryset.values_list('session_key', flat=True)))
+
+    @admin.action(description='Reset selected sessions to no selection')
+    def reset_sessions(self, request, queryset):
+        self._forget_cached(queryset)
+        count = queryset.update(state='no_selection', pickup=None, dropoff=None, updated_at=timezone.now())
+        self.message_user(request, f'Reset {count} navigation sessions.', messages.SUCCESS)
+
+    @admin.action(description='Expire selected sessions (deleted by the next cleanup)')
+    def expire_sessions(self, request, queryset):
+        self._forget_cached(queryset)
+        # Idle for longer than the cleanup's idle TTL (routes.cleanup)
+        idle_ttl = getattr(settings, 'ROUTES_SESSION_IDLE_TTL', settings.SESSION_COOKIE_AGE)
+        count = queryset.update(updated_at=timezone.now() - timedelta(seconds=idle_ttl + 1))
+        self.message_user(request, f'Expired {count} navigation sessions.', messages.SUCCESS)
+
+
+@admin.register(RouteStop)
+class RouteStopAdmin(SessionKeyPrefixSearchMixin, LargeTableAdmin):
+    list_display = ['session_key', 'position', 'kind', 'parcel', 'location', 'completed_at']
+    list_filter = ['kind']
+    list_select_related = ['location']
+
+
+@admin.register(NavigationEvent)
+class NavigationEventAdmin(SessionKeyPrefixSearchMixin, LargeTableAdmin):
+    list_display = ['session_key', 'event', 'state', 'pickup_id', 'dropoff_id', 'at']
+    list_filter = ['event', 'state']
+
+
+@admin.register(TransitionRollup)
+class TransitionRollupAdmin(admin.ModelAdmin):
+    list_display = ['hour', 'pickup_id', 'from_state', 'to_state', 'count', 'total_seconds', 'max_seconds']
+    list_filter = ['from_state', 'to_state']
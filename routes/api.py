@@ -0,0 +1,364 @@
+"""
+JSON endpoints for the navigation flow.
+
+Each endpoint performs its transition and returns the resulting state, so a
+navigate tap is a single request: the page opens Maps immediately and the
+response tells it what the button does next. Nothing is stashed in the
+Django session.
+"""
+import json
+import os
+
+import numpy as np
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+
+from .deeplinks import DEFAULT_TRAVEL_MODE, TRAVEL_MODES
+from .dispatch import AssignmentError, assign
+from .distances import eta_minutes, location_snapshot
+from .events import EventStream
+from .geo import NEAREST_LIMIT, parse_coordinates
+from .instrumentation import histograms
+from .models import DropOffLocation, Location, PickUpLocation, RouteStop
+from .routing import MAX_STOPS, distance_matrix, plan_route, route_length
+from .state_machine import (
+    NAVIGATE, RESET, SELECT_DROPOFF, SELECT_PICKUP, VIEW,
+    apply_transition, apply_transitions, resolve, transition_target,
+)
+from .utils import detect_platform, generate_maps_url, get_or_create_navigation_session
+
+
+def _request_data(request):
+    """Read parameters from a JSON body or a form-encoded POST."""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+    return request.POST
+
+
+def _get_location(model, location_id):
+    try:
+        return model.objects.get(id=int(location_id))
+    except (TypeError, ValueError, model.DoesNotExist):
+        return None
+
+
+def _location_payload(location):
+    if location is None:
+        return None
+    return {
+        'id': location.id,
+        'name': location.name,
+        'latitude': str(location.latitude),
+        'longitude': str(location.longitude),
+    }
+
+
+def _link_payload(location, transition, platform):
+    urls = generate_maps_url(location, platform=platform)
+    return {
+        'target': transition.target,
+        'open_url': urls['deep_link'],
+        'web_fallback': urls['web_fallback'],
+    }
+
+
+def _state_payload(request, nav_session):
+    """Describe the session and what the navigate button currently does."""
+    payload = {
+        'state': nav_session.state,
+        'state_display': nav_session.get_state_display(),
+        'pickup': _location_payload(nav_session.pickup),
+        'dropoff': _location_payload(nav_session.dropoff),
+        'button': None,
+    }
+    if nav_session.pickup_id is not None:
+        upcoming = resolve(nav_session.state, VIEW, nav_session.dropoff_id is not None)
+        payload['button'] = {
+            'label': upcoming.button_label,
+            **_link_payload(transition_target(nav_session, upcoming), upcoming, detect_platform(request)),
+        }
+    return payload
+
+
+def _pickup_required():
+    return JsonResponse({
+        'error': 'Please select a pickup location first.',
+        'redirect': reverse('routes:select_locations'),
+    }, status=409)
+
+
+@require_GET
+def state(request):
+    """Return the current navigation state."""
+    nav_session = get_or_create_navigation_session(request)
+    return JsonResponse(_state_payload(request, nav_session))
+
+
+@require_POST
+def select(request):
+    """Select a pickup and/or dropoff (``pickup_id``, ``dropoff_id``)."""
+    data = _request_data(request)
+    steps = []
+    selections = (
+        ('pickup_id', 'pickup', PickUpLocation, SELECT_PICKUP),
+        ('dropoff_id', 'dropoff', DropOffLocation, SELECT_DROPOFF),
+    )
+    for param, field, model, event in selections:
+        if not data.get(param):
+            continue
+        location = _get_location(model, data[param])
+        if location is None:
+            return JsonResponse({'error': f'Unknown {param}.'}, status=404)
+        steps.append((event, {field: location}))
+    if not steps:
+        return JsonResponse({'error': 'Provide pickup_id and/or dropoff_id.'}, status=400)
+
+    nav_session, _transition = apply_transitions(request, steps)
+    return JsonResponse(_state_payload(request, nav_session))
+
+
+@require_POST
+def navigate(request):
+    """Advance the flow and return the Maps link to open for this tap."""
+    nav_session = get_or_create_navigation_session(request)
+    if not nav_session.pickup:
+        return _pickup_required()
+
+    nav_session, transition = apply_transition(request, NAVIGATE)
+    payload = _state_payload(request, nav_session)
+    payload['opened'] = _link_payload(
+        transition_target(nav_session, transition), transition, detect_platform(request)
+    )
+    return JsonResponse(payload)
+
+
+@require_POST
+def reset(request):
+    """Reset the navigation session to its initial state."""
+    nav_session, _transition = apply_transition(request, RESET)
+    return JsonResponse(_state_payload(request, nav_session))
+
+
+def _route_payload(request, session_key):
+    """Describe the session's multi-stop route and the next stop to drive to."""
+    stops = list(RouteStop.objects.filter(session_key=session_key).select_related('location'))
+    next_stop = next((stop for stop in stops if stop.completed_at is None), None)
+    distance_km = route_length(distance_matrix(
+        [float(stop.location.latitude) for stop in stops],
+        [float(stop.location.longitude) for stop in stops],
+    ), range(len(stops))) if stops else 0.0
+    payload = {
+        'stops': [{
+            'position': stop.position,
+            'parcel': stop.parcel,
+            'kind': stop.kind,
+            'completed': stop.completed_at is not None,
+            'location': _location_payload(stop.location),
+        } for stop in stops],
+        'distance_km': round(distance_km, 3),
+        'eta_minutes': round(float(eta_minutes(distance_km)), 1),
+        'next': None,
+    }
+    if next_stop is not None:
+        urls = generate_maps_url(next_stop.location, platform=detect_platform(request))
+        payload['next'] = {
+            'position': next_stop.position,
+            'kind': next_stop.kind,
+            'open_url': urls['deep_link'],
+            'web_fallback': urls['web_fallback'],
+        }
+    return payload
+
+
+@require_http_methods(['GET', 'POST'])
+def route(request):
+    """
+    Return the multi-stop route, or plan a new one.
+
+    POST a JSON body ``{"parcels": [{"pickup_id": 1, "dropoff_id": 2}, ...]}``
+    with optional driver ``lat``/``lng``; the stops are ordered so every
+    pickup comes before its dropoff and the total drive is short.
+    """
+    nav_session = get_or_create_navigation_session(request)
+    if request.method == 'GET':
+        return JsonResponse(_route_payload(request, nav_session.session_key))
+
+    data = _request_data(request)
+    parcels = data.get('parcels')
+    if not isinstance(parcels, list) or not parcels:
+        return JsonResponse({'error': 'Provide a non-empty parcels list.'}, status=400)
+    if 2 * len(parcels) > MAX_STOPS:
+        return JsonResponse({'error': f'A route can have at most {MAX_STOPS} stops.'}, status=400)
+    try:
+        ids = [(int(parcel['pickup_id']), int(parcel['dropoff_id'])) for parcel in parcels]
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Each parcel needs a pickup_id and a dropoff_id.'}, status=400)
+
+    pickups = PickUpLocation.objects.in_bulk({pickup_id for pickup_id, _dropoff_id in ids})
+    dropoffs = DropOffLocation.objects.in_bulk({dropoff_id for _pickup_id, dropoff_id in ids})
+    missing = ({pickup_id for pickup_id, _dropoff_id in ids if pickup_id not in pickups}
+               | {dropoff_id for _pickup_id, dropoff_id in ids if dropoff_id not in dropoffs})
+    if missing:
+        return JsonResponse({'error': f'Unknown locations: {sorted(missing)}.'}, status=404)
+
+    plan_route(
+        nav_session.session_key,
+        [(pickups[pickup_id], dropoffs[dropoff_id]) for pickup_id, dropoff_id in ids],
+        origin=parse_coordinates(data),
+    )
+    return JsonResponse(_route_payload(request, nav_session.session_key))
+
+
+@require_POST
+def route_next(request):
+    """Mark the next stop of the route as done and return the one after it."""
+    nav_session = get_or_create_navigation_session(request)
+    next_stop = (
+        RouteStop.objects.filter(session_key=nav_session.session_key, completed_at__isnull=True)
+        .order_by('position').first()
+    )
+    if next_stop is None:
+        return JsonResponse({'error': 'No remaining stops.'}, status=409)
+    # Conditional so a double tap cannot complete two stops
+    RouteStop.objects.filter(pk=next_stop.pk, completed_at__isnull=True).update(completed_at=timezone.now())
+    return JsonResponse(_route_payload(request, nav_session.session_key))
+
+
+# Largest distance matrix (origins x destinations) served in one request
+MAX_MATRIX_CELLS = 100_000
+ROLES = {'pickup': Location.PICKUP, 'dropoff': Location.DROPOFF}
+
+
+def _id_list(value):
+    return [int(pk) for pk in value.split(',') if pk.strip()]
+
+
+@require_GET
+def distances(request):
+    """
+    Distance (km) and ETA (minutes) matrix over stored locations.
+
+    Origins are ``from`` (comma-separated location ids) or the point
+    ``lat``/``lng``. Destinations are ``to`` (ids), or with a point origin,
+    the ``limit`` nearest locations of ``role`` (pickup or dropoff; any role
+    if omitted). ``mode`` selects the travel mode used for ETAs.
+    """
+    params = request.GET
+    mode = params.get('mode', DEFAULT_TRAVEL_MODE)
+    if mode not in TRAVEL_MODES:
+        return JsonResponse({'error': f'Unknown mode {mode!r}.'}, status=400)
+    try:
+        origin_ids = _id_list(params.get('from', ''))
+        destination_ids = _id_list(params.get('to', ''))
+        limit = int(params.get('limit', NEAREST_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'Ids and limit must be integers.'}, status=400)
+    point = parse_coordinates(params)
+    role = params.get('role')
+    if role is not None and role not in ROLES:
+        return JsonResponse({'error': f'Unknown role {role!r}.'}, status=400)
+    if not origin_ids and point is None:
+        return JsonResponse({'error': 'Provide from=<ids> or lat and lng.'}, status=400)
+    if not destination_ids and (origin_ids or limit < 1):
+        return JsonResponse({'error': 'Provide to=<ids>, or lat and lng with a positive limit.'}, status=400)
+
+    snapshot = location_snapshot()
+    origins = origin_ids or [{'lat': point[0], 'lng': point[1]}]
+    try:
+        if origin_ids:
+            if len(origin_ids) * len(destination_ids) > MAX_MATRIX_CELLS:
+                return JsonResponse({'error': 'Matrix too large.'}, status=400)
+            matrix = snapshot.matrix(origin_ids, destination_ids)
+        elif destination_ids:
+            matrix = snapshot.distances_from(*point, ids=destination_ids)[None, :]
+        else:
+            destination_ids, row = snapshot.nearest(*point, role=ROLES.get(role), limit=limit)
+            destination_ids = destination_ids.tolist()
+            matrix = row[None, :]
+    except KeyError as exc:
+        return JsonResponse({'error': f'Unknown location {exc.args[0]}.'}, status=404)
+
+    return JsonResponse({
+        'mode': mode,
+        'origins': origins,
+        'destinations': destination_ids,
+        'distance_km': np.round(matrix, 3).tolist(),
+        'eta_minutes': np.round(eta_minutes(matrix, mode), 1).tolist(),
+    })
+
+
+@staff_member_required
+@require_POST
+def dispatch(request):
+    """
+    Create or update many drivers' sessions in one transaction.
+
+    POST a JSON body ``{"assignments": [{"driver": "<token>", "pickup_id": 1,
+    "dropoff_id": 2, "state": "pickup_selected"}, ...]}``; ``driver``,
+    ``dropoff_id`` and ``state`` are optional. Returns each driver's token and
+    the link that opens their navigate page.
+    """
+    data = _request_data(request)
+    try:
+        result = assign(data.get('assignments'))
+    except AssignmentError as exc:
+        return JsonResponse({'error': 'Invalid assignments.', 'errors': exc.errors}, status=400)
+    return JsonResponse({
+        'created': result.created,
+        'updated': result.updated,
+        'drivers': [{
+            'driver': token,
+            'state': nav_session.state,
+            'url': request.build_absolute_uri(reverse('routes:driver_link', args=[token])),
+        } for token, nav_session in result.sessions],
+    })
+
+
+@staff_member_required
+@require_GET
+async def events(request):
+    """
+    Stream navigation state changes to staff as Server-Sent Events.
+
+    ``?session=<label>`` follows one session. Browsers resume after a
+    reconnect from their ``Last-Event-ID``. Needs the ASGI server: a sync
+    worker would be held for as long as the stream is open.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Event streams need the ASGI server (SERVER_PROFILE=asgi).'}, status=501)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    response = StreamingHttpResponse(
+        EventStream(last_event_id, request.GET.get('session')), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Tells nginx-style proxies not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@staff_member_required
+@require_GET
+def metrics(request):
+    """
+    Timing histograms per URL name of the requests sampled by this worker process.
+
+    Each process keeps its own; with several workers, repeated requests may
+    land on different ones (compare ``pid``).
+    """
+    return JsonResponse({
+        'pid': os.getpid(),
+        'sample_rate': getattr(settings, 'ROUTES_INSTRUMENTATION_SAMPLE_RATE', 0),
+        'views': histograms.snapshot(),
+    })
@@ -0,0 +1,111 @@
+"""
+Background batching of database writes.
+
+A BatchedWriter queues items in process; a daemon thread writes them in
+batches every ``interval`` seconds, or as soon as ``batch_size`` items are
+pending, and once more at interpreter exit. Used by the write-behind
+navigation stores (routes.stores) and the event log (routes.eventlog).
+
+A batch that fails to write (e.g. the database is locked or down) is put
+back in front of the queue and retried by the next flush. The thread logs
+the error and keeps running; while writes keep failing, the queue is capped
+at ``MAX_PENDING_BATCHES`` batches, dropping the oldest items.
+"""
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING_BATCHES = 100
+
+
+class BatchedWriter:
+    """Queue of items keyed for deduplication, written in batches by a daemon thread."""
+    thread_name = 'batched-writer'
+
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        atexit.register(self.flush)
+
+    def write(self, batch):
+        """
+        Write ``batch``, a dict of pending items in queue order.
+
+        Returns:
+            int: number of items written
+        """
+        raise NotImplementedError
+
+    def add(self, key, item):
+        """Queue ``item``, replacing any pending item with the same key."""
+        with self._lock:
+            self._pending[key] = item
+            pending = len(self._pending)
+        self._ensure_worker()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def discard(self, keys):
+        """Drop the pending items with these keys."""
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self._flush_logged()
+
+    def _flush_logged(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('%s: batched write failed; retrying at the next flush.', self.thread_name)
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        """
+        Write every pending item.
+
+        On failure the items are queued again, unless newer items with the
+        same keys were queued meanwhile, and the error is raised.
+
+        Returns:
+            int: number of items written
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            return self.write(batch)
+        except Exception:
+            self._requeue(batch)
+            raise
+
+    def _requeue(self, batch):
+        with self._lock:
+            # Failed items go first; items queued since then win for their keys
+            batch.update(self._pending)
+            limit = self.batch_size * MAX_PENDING_BATCHES
+            if len(batch) > limit:
+                dropped = len(batch) - limit
+                for key in list(batch)[:dropped]:
+                    del batch[key]
+                logger.error('%s: dropped %d queued items that could not be written.', self.thread_name, dropped)
+            self._pending = batch
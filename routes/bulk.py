@@ -0,0 +1,330 @@
+"""
+Streaming bulk import and export of locations.
+
+Imports read CSV or GeoJSON row by row, validate coordinates with the same
+rules as LocationForm (without building a form per row) and insert with
+``bulk_create`` in batches. Exports are generators meant for
+``StreamingHttpResponse``, so a dump never holds the whole table in memory.
+
+Supported formats:
+
+- CSV with ``name``, ``latitude`` and ``longitude`` columns (``lat``/``lng``
+  and ``lon`` are accepted as aliases).
+- GeoJSON: a FeatureCollection, or newline-delimited features (GeoJSON
+  text sequences, RFC 8142) which are parsed one line at a time. Features
+  must be Points; the name is read from ``properties.name``.
+"""
+import csv
+import json
+from collections import namedtuple
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+
+from django import forms
+from django.db import transaction
+
+from .forms import validate_latitude, validate_longitude
+from .distances import locations_changed
+from .geo import encode_geohash
+
+CSV = 'csv'
+GEOJSON = 'geojson'
+FORMATS = (CSV, GEOJSON)
+
+BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+# Error messages kept per import; further errors are only counted
+MAX_REPORTED_ERRORS = 50
+
+_COORDINATE_QUANTUM = Decimal('0.000001')
+_NAME_MAX_LENGTH = 200
+_CSV_ALIASES = {
+    'lat': 'latitude',
+    'lng': 'longitude',
+    'lon': 'longitude',
+}
+
+ImportResult = namedtuple('ImportResult', ['created', 'failed', 'errors'])
+
+# One input record; ``error`` is set when the record could not even be parsed
+Row = namedtuple('Row', ['number', 'name', 'latitude', 'longitude', 'error'], defaults=[None])
+
+
+class RowError(ValueError):
+    """A row that cannot be imported."""
+
+
+class ImportFileError(ValueError):
+    """
+    Raised when the file cannot be read to the end (bad encoding or CSV).
+
+    Rows before the unreadable part were imported; ``result`` counts them.
+    """
+
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
+
+def detect_format(filename):
+    """Guess the import format from a file name."""
+    name = (filename or '').lower()
+    if name.endswith(('.geojson', '.geojsonl', '.geojsons', '.json', '.ndjson')):
+        return GEOJSON
+    return CSV
+
+
+def _coordinate(value, validator, label):
+    try:
+        number = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        raise RowError(f'{label} is not a number.')
+    if not number.is_finite():
+        raise RowError(f'{label} is not a number.')
+    try:
+        validator(number)
+    except forms.ValidationError as exc:
+        raise RowError(exc.messages[0])
+    return number.quantize(_COORDINATE_QUANTUM, rounding=ROUND_HALF_EVEN)
+
+
+def clean_row(name, latitude, longitude):
+    """
+    Validate one row.
+
+    Returns:
+        tuple: (name, latitude, longitude) with coordinates as Decimals
+        rounded to the model's six decimal places
+    """
+    name = (name or '').strip()
+    if not name:
+        raise RowError('Name is required.')
+    if len(name) > _NAME_MAX_LENGTH:
+        raise RowError(f'Name is longer than {_NAME_MAX_LENGTH} characters.')
+    return (
+        name,
+        _coordinate(latitude, validate_latitude, 'Latitude'),
+        _coordinate(longitude, validate_longitude, 'Longitude'),
+    )
+
+
+def iter_csv_rows(lines):
+    """Yield a Row per record of CSV text lines."""
+    reader = csv.DictReader(lines)
+    if reader.fieldnames:
+        reader.fieldnames = [
+            _CSV_ALIASES.get(field.strip().lower(), field.strip().lower())
+            for field in reader.fieldnames
+        ]
+    for row_number, row in enumerate(reader, start=2):
+        yield Row(row_number, row.get('name'), row.get('latitude'), row.get('longitude'))
+
+
+def _feature_row(row_number, feature):
+    if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+        raise RowError('Not a GeoJSON Feature.')
+    geometry = feature.get('geometry') or {}
+    coordinates = geometry.get('coordinates')
+    if geometry.get('type') != 'Point' or not isinstance(coordinates, list) or len(coordinates) < 2:
+        raise RowError('Geometry must be a Point.')
+    properties = feature.get('properties') or {}
+    # GeoJSON positions are [longitude, latitude]
+    return Row(row_number, properties.get('name'), coordinates[1], coordinates[0])
+
+
+def iter_geojson_rows(lines):
+    """Yield a Row per feature of GeoJSON text lines."""
+    lines = iter(lines)
+    first = next(lines, '').strip().lstrip('\x1e')
+    try:
+        first_object = json.loads(first) if first else None
+    except ValueError:
+        first_object = None
+
+    if isinstance(first_object, dict) and first_object.get('type') == 'Feature':
+        # Newline-delimited features: parse line by line
+        yield from _safe_feature(1, first_object)
+        for row_number, line in enumerate(lines, start=2):
+            line = line.strip().lstrip('\x1e')
+            if not line:
+                continue
+            try:
+                feature = json.loads(line)
+            except ValueError:
+                yield _error_row(row_number, 'Invalid JSON.')
+                continue
+            yield from _safe_feature(row_number, feature)
+        return
+
+    document = first_object
+    if document is None:
+        try:
+            document = json.loads(first + ''.join(lines))
+        except ValueError:
+            yield _error_row(1, 'Invalid GeoJSON document.')
+            return
+    if not isinstance(document, dict) or document.get('type') != 'FeatureCollection':
+        yield _error_row(1, 'Expected a FeatureCollection or one Feature per line.')
+        return
+    for row_number, feature in enumerate(document.get('features') or [], start=1):
+        yield from _safe_feature(row_number, feature)
+
+
+def _error_row(row_number, message):
+    return Row(row_number, None, None, None, message)
+
+
+def _safe_feature(row_number, feature):
+    try:
+        yield _feature_row(row_number, feature)
+    except RowError as exc:
+        yield _error_row(row_number, str(exc))
+
+
+def iter_rows(lines, file_format):
+    if file_format == GEOJSON:
+        return iter_geojson_rows(lines)
+    return iter_csv_rows(lines)
+
+
+def import_locations(model, rows, batch_size=BATCH_SIZE):
+    """
+    Validate ``rows`` and insert them into ``model`` in batches.
+
+    Rows are Row tuples, e.g. from ``iter_rows``. Invalid rows are skipped
+    and reported; valid rows are committed batch by batch. ImportFileError is
+    raised, after committing the rows read so far, if the file turns out not
+    to be UTF-8 or valid CSV.
+
+    Returns:
+        ImportResult: (created count, failed count, list of (row, message))
+    """
+    created = failed = 0
+    errors = []
+    batch = []
+
+    def flush():
+        nonlocal created
+        with transaction.atomic():
+            model.objects.bulk_create(batch, batch_size=batch_size)
+        created += len(batch)
+        batch.clear()
+
+    file_error = None
+    try:
+        for row in rows:
+            try:
+                if row.error:
+                    raise RowError(row.error)
+                name, latitude, longitude = clean_row(row.name, row.latitude, row.longitude)
+            except RowError as exc:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append((row.number, str(exc)))
+                continue
+
+            # bulk_create skips save(), so the geohash is computed here
+            batch.append(model(
+                name=name,
+                latitude=latitude,
+                longitude=longitude,
+                geohash=encode_geohash(latitude, longitude),
+            ))
+            if len(batch) >= batch_size:
+                flush()
+    except UnicodeDecodeError as exc:
+        # Files are decoded in chunks as they are read, so this surfaces mid-import
+        file_error = exc, 'The file is not UTF-8 encoded.'
+    except csv.Error as exc:
+        file_error = exc, f'Invalid CSV: {exc}.'
+    if batch:
+        flush()
+    if created:
+        # bulk_create sends no signals; snapshots reload instead
+        locations_changed()
+    result = ImportResult(created, failed, errors)
+    if file_error is not None:
+        raise ImportFileError(file_error[1], result) from file_error[0]
+    return result
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+_EXPORT_FIELDS = ['id', 'name', 'latitude', 'longitude']
+
+
+def _export_rows(queryset):
+    # Iterated with .iterator() or, under ASGI, .aiterator(), in chunks. Dicts
+    # rather than tuples: values_list().aiterator() queries outside a thread
+    return queryset.order_by('id').values(*_EXPORT_FIELDS)
+
+
+_GEOJSON_START = '{"type": "FeatureCollection", "features": [\n'
+_GEOJSON_END = '\n]}\n'
+
+
+def _geojson_feature(row):
+    return json.dumps({
+        'type': 'Feature',
+        'id': row['id'],
+        'geometry': {'type': 'Point', 'coordinates': [float(row['longitude']), float(row['latitude'])]},
+        'properties': {'name': row['name']},
+    })
+
+
+def iter_csv_export(queryset):
+    """Yield the locations of ``queryset`` as CSV lines."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(_EXPORT_FIELDS)
+    for row in _export_rows(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield writer.writerow(row.values())
+
+
+def iter_geojson_export(queryset):
+    """Yield the locations of ``queryset`` as a GeoJSON FeatureCollection, in pieces."""
+    yield _GEOJSON_START
+    separator = ''
+    for row in _export_rows(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield separator + _geojson_feature(row)
+        separator = ',\n'
+    yield _GEOJSON_END
+
+
+def iter_export(queryset, file_format):
+    if file_format == GEOJSON:
+        return iter_geojson_export(queryset)
+    return iter_csv_export(queryset)
+
+
+async def aiter_csv_export(queryset):
+    """Async version of ``iter_csv_export``."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(_EXPORT_FIELDS)
+    async for row in _export_rows(queryset).aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield writer.writerow(row.values())
+
+
+async def aiter_geojson_export(queryset):
+    """Async version of ``iter_geojson_export``."""
+    yield _GEOJSON_START
+    separator = ''
+    async for row in _export_rows(queryset).aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield separator + _geojson_feature(row)
+        separator = ',\n'
+    yield _GEOJSON_END
+
+
+def aiter_export(queryset, file_format):
+    """
+    Async version of ``iter_export``, for the ASGI server.
+
+    ASGI handlers would read a sync iterator into a list before sending it,
+    buffering the whole export; an async iterator is sent chunk by chunk.
+    """
+    if file_format == GEOJSON:
+        return aiter_geojson_export(queryset)
+    return aiter_csv_export(queryset)
@@ -0,0 +1,175 @@
+"""
+Garbage collection of stale NavigationSession rows.
+
+A row is stale when any of these holds:
+
+- orphaned: sessions are stored in the database and the row's Django
+  session is gone or expired (not with a stateless navigation store, whose
+  rows have no Django session, nor for dispatched drivers' sessions)
+- completed: the route finished (``completed`` or ``navigated_to_dropoff``)
+  and the row was last written ``ROUTES_SESSION_COMPLETED_TTL`` seconds ago
+  (default one day)
+- idle: the row was last written ``ROUTES_SESSION_IDLE_TTL`` seconds ago
+  (default ``SESSION_COOKIE_AGE``)
+
+Rows are deleted with their RouteStops in small batches, one short
+transaction each, with a pause in between so request writes are never held
+up for long. ``start_periodic_cleanup`` runs the same collection from a
+daemon thread every ``ROUTES_SESSION_GC_INTERVAL`` seconds.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .dispatch import DRIVER_KEY_PREFIX
+from .models import NavigationSession, RouteStop
+from .stores import get_navigation_store
+
+BATCH_SIZE = 500
+# Seconds between batches
+BATCH_PAUSE = 0.05
+COMPLETED_STATES = ('completed', 'navigated_to_dropoff')
+DEFAULT_COMPLETED_TTL = 24 * 60 * 60
+
+_DATABASE_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+_LOCK_KEY = 'routes:session-gc'
+
+logger = logging.getLogger('routes.cleanup')
+
+CleanupResult = namedtuple('CleanupResult', ['sessions', 'route_stops', 'bytes_reclaimed'])
+
+
+def stale_condition(now=None):
+    """Q matching stale NavigationSession rows."""
+    now = now or timezone.now()
+    idle_ttl = getattr(settings, 'ROUTES_SESSION_IDLE_TTL', settings.SESSION_COOKIE_AGE)
+    completed_ttl = getattr(settings, 'ROUTES_SESSION_COMPLETED_TTL', DEFAULT_COMPLETED_TTL)
+    condition = (
+        Q(updated_at__lt=now - timedelta(seconds=idle_ttl))
+        | Q(state__in=COMPLETED_STATES, updated_at__lt=now - timedelta(seconds=completed_ttl))
+    )
+    if settings.SESSION_ENGINE in _DATABASE_SESSION_ENGINES and not get_navigation_store().stateless:
+        live = Session.objects.filter(session_key=OuterRef('session_key'), expire_date__gt=now)
+        condition |= ~Exists(live) & ~Q(session_key__startswith=DRIVER_KEY_PREFIX)
+    return condition
+
+
+def used_bytes():
+    """
+    Bytes in use, or None if the database cannot tell.
+
+    On SQLite this is the database file minus its free pages, where deleted
+    rows end up; on PostgreSQL the size of the NavigationSession and
+    RouteStop tables with their indexes.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA page_count')
+            page_count = cursor.fetchone()[0]
+            cursor.execute('PRAGMA freelist_count')
+            free_pages = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            return (page_count - free_pages) * cursor.fetchone()[0]
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT pg_total_relation_size(%s) + pg_total_relation_size(%s)',
+                [NavigationSession._meta.db_table, RouteStop._meta.db_table],
+            )
+            return cursor.fetchone()[0]
+    return None
+
+
+def delete_stale_sessions(batch_size=BATCH_SIZE, pause=BATCH_PAUSE, max_batches=None, now=None):
+    """
+    Delete stale sessions batch by batch.
+
+    Returns:
+        CleanupResult: sessions and route stops deleted, and bytes freed
+        (None when the database cannot tell)
+    """
+    condition = stale_condition(now)
+    size_before = used_bytes()
+    sessions = route_stops = batches = 0
+    while max_batches is None or batches < max_batches:
+        # Unordered, so each branch of the condition is searched in its index
+        batch = list(NavigationSession.objects.filter(condition).order_by().values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            # Re-checked: a session may have been used since it was selected
+            stale = NavigationSession.objects.filter(condition, pk__in=batch)
+            route_stops += RouteStop.objects.filter(session_key__in=stale.values('session_key')).delete()[0]
+            sessions += stale.delete()[0]
+        batches += 1
+        if len(batch) < batch_size:
+            break
+        time.sleep(pause)
+
+    size_after = used_bytes()
+    reclaimed = size_before - size_after if size_before is not None and size_after is not None else None
+    return CleanupResult(sessions, route_stops, reclaimed)
+
+
+def compact():
+    """
+    Return freed space to the operating system and refresh table statistics.
+
+    SQLite runs ``VACUUM``, which locks the database while it rewrites the
+    file, then ``ANALYZE``; PostgreSQL runs a plain ``VACUUM ANALYZE`` of the
+    two tables, which takes no exclusive lock but only makes the space
+    reusable. The admin estimates row counts from these statistics.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('VACUUM')
+            cursor.execute('ANALYZE')
+        elif connection.vendor == 'postgresql':
+            for model in (NavigationSession, RouteStop):
+                cursor.execute(f'VACUUM ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+
+_periodic_lock = threading.Lock()
+_periodic_thread = None
+
+
+def start_periodic_cleanup():
+    """Start the cleanup thread if ``ROUTES_SESSION_GC_INTERVAL`` is set; idempotent."""
+    global _periodic_thread
+    interval = getattr(settings, 'ROUTES_SESSION_GC_INTERVAL', None)
+    if not interval:
+        return None
+    with _periodic_lock:
+        if _periodic_thread is None or not _periodic_thread.is_alive():
+            _periodic_thread = threading.Thread(
+                target=_run_periodic, args=(interval,), name='navigation-session-gc', daemon=True
+            )
+            _periodic_thread.start()
+    return _periodic_thread
+
+
+def _run_periodic(interval):
+    cache = caches[getattr(settings, 'ROUTES_VERSION_CACHE', 'default')]
+    while True:
+        time.sleep(interval)
+        # With a shared cache only one worker process collects per interval
+        if not cache.add(_LOCK_KEY, 1, interval):
+            continue
+        try:
+            result = delete_stale_sessions()
+            logger.info('Deleted %d stale navigation sessions.', result.sessions)
+        except Exception:
+            logger.exception('Navigation session cleanup failed.')
+        finally:
+            close_old_connections()
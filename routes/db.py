@@ -0,0 +1,35 @@
+"""
+Per-connection database tuning.
+
+SQLite connections get the PRAGMAs from ``ROUTES_SQLITE_PRAGMAS`` as soon as
+they are opened (see ``DEFAULT_SQLITE_PRAGMAS``). Other backends are left
+untouched.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+}
+
+
+def sqlite_pragmas():
+    pragmas = getattr(settings, 'ROUTES_SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+    for name, value in pragmas.items():
+        # PRAGMA arguments cannot be bound as parameters
+        if not name.isidentifier() or not str(value).replace('-', '').isalnum():
+            raise ValueError(f'Invalid SQLite PRAGMA {name}={value!r}.')
+        yield f'PRAGMA {name} = {value}'
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply the SQLite PRAGMAs to a newly opened connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in sqlite_pragmas():
+            cursor.execute(statement)
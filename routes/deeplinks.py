@@ -0,0 +1,84 @@
+"""
+Google Maps deep-link builder.
+
+Links for a location are built once per (location, coordinates, platform,
+travel mode) and kept in a bounded LRU cache. The coordinates are part of
+the key, so a location moved by another process never hits a stale bundle;
+unused entries are evicted. Origin is never specified, so Google Maps always
+routes from the device's current GPS position.
+"""
+from django.conf import settings
+
+from .lru import LRUCache
+
+ANDROID = 'android'
+IOS = 'ios'
+DESKTOP = 'desktop'
+PLATFORMS = (ANDROID, IOS, DESKTOP)
+
+TRAVEL_MODES = ('driving', 'walking', 'bicycling', 'transit')
+DEFAULT_TRAVEL_MODE = 'driving'
+
+# google.navigation only understands these single-letter modes
+ANDROID_MODES = {'driving': 'd', 'walking': 'w', 'bicycling': 'b'}
+
+WEB_TEMPLATE = 'https://www.google.com/maps/dir/?api=1&destination={lat},{lng}&travelmode={mode}'
+IOS_TEMPLATE = 'comgooglemaps://?daddr={lat},{lng}&directionsmode={mode}'
+ANDROID_TEMPLATE = 'google.navigation:q={lat},{lng}'
+
+_links = LRUCache(getattr(settings, 'ROUTES_DEEPLINK_CACHE_SIZE', 4096))
+
+
+def _cache_key(location, platform, travel_mode):
+    return (
+        location._meta.concrete_model._meta.label_lower, location.pk,
+        str(location.latitude), str(location.longitude), platform, travel_mode,
+    )
+
+
+def _build(location, platform, travel_mode):
+    lat = str(location.latitude)
+    lng = str(location.longitude)
+
+    # Web fallback URL (works on all devices)
+    web = WEB_TEMPLATE.format(lat=lat, lng=lng, mode=travel_mode)
+    # iOS: comgooglemaps scheme uses current location if saddr is not specified
+    ios = IOS_TEMPLATE.format(lat=lat, lng=lng, mode=travel_mode)
+    # Android: google.navigation always starts turn-by-turn from current location
+    android = ANDROID_TEMPLATE.format(lat=lat, lng=lng)
+    if travel_mode in ANDROID_MODES:
+        android += '&mode=' + ANDROID_MODES[travel_mode]
+
+    deep_link = {ANDROID: android, IOS: ios}.get(platform, web)
+    return {
+        'deep_link': deep_link,
+        'web_fallback': web,
+        'android': android,
+        'ios': ios,
+    }
+
+
+def build_links(location, platform=DESKTOP, travel_mode=DEFAULT_TRAVEL_MODE):
+    """
+    Return the Maps link bundle for ``location`` on ``platform``.
+
+    Returns:
+        dict: {'deep_link': str, 'web_fallback': str, 'android': str, 'ios': str}
+        where ``deep_link`` is the variant to open on ``platform`` (the web
+        URL on desktop).
+    """
+    if travel_mode not in TRAVEL_MODES:
+        raise ValueError(f'Unknown travel mode: {travel_mode!r}')
+    if location.pk is None:
+        return _build(location, platform, travel_mode)
+
+    key = _cache_key(location, platform, travel_mode)
+    links = _links.get(key)
+    if links is None:
+        links = _build(location, platform, travel_mode)
+        _links.set(key, links)
+    return links
+
+
+def clear_cache():
+    _links.clear()
@@ -0,0 +1,80 @@
+"""
+User-Agent classification.
+
+Token families are looked up as substrings of the lowercased User-Agent,
+most decisive first, and each lookup stops at the first token found: an
+iPhone is settled without looking for Android or mobile tokens. Results for
+recently seen User-Agents are kept in a bounded LRU cache, since a fleet of
+drivers sends only a handful of distinct strings.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+
+from .deeplinks import ANDROID, DESKTOP, IOS
+from .lru import LRUCache
+
+WEBVIEW = 'webview'
+
+# Only the first part of a User-Agent is used; longer strings are padding or abuse
+MAX_USER_AGENT_LENGTH = 512
+
+# Substrings of the lowercased User-Agent, most common first in each family
+_IOS_TOKENS = ('iphone', 'ipad', 'ipod')
+_MOBILE_TOKENS = ('android', 'mobile', 'blackberry', 'windows phone', 'opera mini')
+_WEBVIEW_TOKENS = ('fban', 'fbav', 'instagram', 'line/', 'micromessenger', 'gsa/', '; wv)')
+
+_results = LRUCache(getattr(settings, 'ROUTES_USER_AGENT_CACHE_SIZE', 1024))
+
+
+class DeviceInfo(namedtuple('DeviceInfo', ['platform', 'is_mobile', 'is_webview'])):
+    """
+    Classification of a User-Agent.
+
+    ``platform`` is the deep-link platform (android, ios or desktop); mobile
+    devices that are neither iOS nor Android use the Android link, as the
+    generic ``google.navigation:`` intent is the most widely handled.
+    """
+    __slots__ = ()
+
+    @property
+    def kind(self):
+        """android, ios, desktop or webview (an in-app browser)."""
+        return WEBVIEW if self.is_webview else self.platform
+
+
+def _contains_any(user_agent, tokens):
+    # A loop rather than any(): no generator per call
+    for token in tokens:
+        if token in user_agent:
+            return True
+    return False
+
+
+def _classify(user_agent):
+    user_agent = user_agent.lower()
+    if _contains_any(user_agent, _IOS_TOKENS):
+        # iOS in-app browsers (WKWebView) omit the Safari token
+        is_webview = 'safari' not in user_agent or _contains_any(user_agent, _WEBVIEW_TOKENS)
+        return DeviceInfo(IOS, True, is_webview)
+    is_mobile = _contains_any(user_agent, _MOBILE_TOKENS)
+    return DeviceInfo(ANDROID if is_mobile else DESKTOP, is_mobile, _contains_any(user_agent, _WEBVIEW_TOKENS))
+
+
+def classify_user_agent(user_agent):
+    """Classify a User-Agent string, using the LRU cache."""
+    user_agent = (user_agent or '')[:MAX_USER_AGENT_LENGTH]
+    info = _results.get(user_agent)
+    if info is None:
+        info = _classify(user_agent)
+        _results.set(user_agent, info)
+    return info
+
+
+def classify_request(request):
+    """Classify the User-Agent of ``request``."""
+    return classify_user_agent(request.META.get('HTTP_USER_AGENT', ''))
+
+
+def clear_cache():
+    _results.clear()
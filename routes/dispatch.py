@@ -0,0 +1,159 @@
+"""
+Bulk assignment of navigation sessions to drivers.
+
+A dispatcher stages a fleet's work in one request (``api/dispatch/``): each
+assignment gives a driver token and the pickup, dropoff and initial state of
+that driver's NavigationSession. All rows are validated first and then
+written in one transaction with ``bulk_create``/``bulk_update``.
+
+Driver sessions are keyed by ``driver:<token>`` instead of a Django session
+key. Opening ``/drive/<token>/`` binds the browser to that session with a
+signed cookie (or, with a stateless navigation store, the state cookie) and
+lands on the navigate page, so no selection round trip is needed.
+"""
+import re
+import secrets
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .eventlog import record
+from .models import DropOffLocation, NavigationSession, PickUpLocation
+from .stores import get_navigation_store
+
+DRIVER_KEY_PREFIX = 'driver:'
+DRIVER_COOKIE = 'routes_driver'
+DRIVER_COOKIE_SALT = 'routes.dispatch'
+TOKEN_RE = re.compile(r'^[A-Za-z0-9_-]{8,32}$')
+
+MAX_ASSIGNMENTS = 1000
+BATCH_SIZE = 500
+
+# Initial states a dispatcher may assign, and whether they need a dropoff
+ASSIGNABLE_STATES = {
+    'pickup_selected': False,
+    'navigated_to_pickup': False,
+    'dropoff_selected': True,
+    'navigated_to_dropoff': True,
+}
+
+AssignResult = namedtuple('AssignResult', ['created', 'updated', 'sessions'])
+
+
+class AssignmentError(ValueError):
+    """Raised when a batch of assignments is invalid; nothing is written."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def new_driver_token():
+    """Return a random, URL-safe driver token."""
+    return secrets.token_urlsafe(16)
+
+
+def driver_session_key(token):
+    """Return the NavigationSession key of a driver token; ValueError if malformed."""
+    if not isinstance(token, str) or not TOKEN_RE.match(token):
+        raise ValueError(f'Invalid driver token {token!r}.')
+    return DRIVER_KEY_PREFIX + token
+
+
+def _location_id(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, bool):
+        raise ValueError
+    return int(value)
+
+
+def _parse(assignments):
+    """Validate assignments; returns (token, pickup id, dropoff id, state) rows."""
+    if not isinstance(assignments, list) or not assignments:
+        raise AssignmentError(['Provide a non-empty assignments list.'])
+    if len(assignments) > MAX_ASSIGNMENTS:
+        raise AssignmentError([f'At most {MAX_ASSIGNMENTS} assignments per request.'])
+
+    rows, errors, seen = [], [], set()
+    for index, assignment in enumerate(assignments):
+        if not isinstance(assignment, dict):
+            errors.append(f'row {index}: expected an object')
+            continue
+        token = assignment.get('driver') or new_driver_token()
+        state = assignment.get('state') or 'pickup_selected'
+        try:
+            driver_session_key(token)
+            pickup_id = _location_id(assignment.get('pickup_id'))
+            dropoff_id = _location_id(assignment.get('dropoff_id'))
+        except (TypeError, ValueError):
+            errors.append(f'row {index}: invalid driver token or location id')
+            continue
+        if token in seen:
+            errors.append(f'row {index}: driver {token} is assigned twice')
+        elif pickup_id is None:
+            errors.append(f'row {index}: pickup_id is required')
+        elif state not in ASSIGNABLE_STATES:
+            errors.append(f'row {index}: state must be one of {", ".join(ASSIGNABLE_STATES)}')
+        elif ASSIGNABLE_STATES[state] and dropoff_id is None:
+            errors.append(f'row {index}: state {state} needs a dropoff_id')
+        else:
+            rows.append((token, pickup_id, dropoff_id, state))
+        seen.add(token)
+
+    pickups = PickUpLocation.objects.in_bulk({row[1] for row in rows})
+    dropoffs = DropOffLocation.objects.in_bulk({row[2] for row in rows} - {None})
+    missing = ({row[1] for row in rows} - pickups.keys()) | ({row[2] for row in rows} - dropoffs.keys() - {None})
+    if missing:
+        errors.append(f'Unknown locations: {sorted(missing)}.')
+    if errors:
+        raise AssignmentError(errors)
+    return rows
+
+
+def assign(assignments):
+    """
+    Create or update the NavigationSession of every assigned driver.
+
+    ``assignments`` is a list of dicts with ``pickup_id`` and optional
+    ``dropoff_id``, ``state`` (default ``pickup_selected``) and ``driver``
+    (a token; one is generated when missing). Either every row is written or,
+    if any is invalid, none.
+
+    Returns:
+        AssignResult: counts created and updated, and (token, NavigationSession) pairs
+    """
+    rows = _parse(assignments)
+    keys = [driver_session_key(token) for token, *_fields in rows]
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            nav_session.session_key: nav_session
+            for nav_session in NavigationSession.objects.select_for_update().filter(session_key__in=keys)
+        }
+        to_update, to_create, sessions = [], [], []
+        for key, (token, pickup_id, dropoff_id, state) in zip(keys, rows):
+            nav_session = existing.get(key) or NavigationSession(session_key=key, created_at=now)
+            nav_session.pickup_id = pickup_id
+            nav_session.dropoff_id = dropoff_id
+            nav_session.state = state
+            nav_session.updated_at = now
+            (to_update if nav_session.pk else to_create).append(nav_session)
+            sessions.append((token, nav_session))
+        fields = ['pickup', 'dropoff', 'state', 'updated_at']
+        NavigationSession.objects.bulk_update(to_update, fields, batch_size=BATCH_SIZE)
+        # A concurrent dispatch may have created one of the rows since they were locked
+        NavigationSession.objects.bulk_create(
+            to_create, batch_size=BATCH_SIZE,
+            update_conflicts=True, unique_fields=['session_key'], update_fields=fields,
+        )
+    # Cache-backed stores would otherwise keep serving the previous state
+    get_navigation_store().invalidate(keys)
+
+    # Imported here: routes.events imports this module
+    from .events import publish
+    for _token, nav_session in sessions:
+        publish(nav_session, 'dispatch')
+        record(nav_session, 'dispatch')
+    return AssignResult(len(to_create), len(to_update), sessions)
@@ -0,0 +1,219 @@
+"""
+Array-backed distance and ETA service over stored locations.
+
+``location_snapshot()`` returns a per-process snapshot of every Location's
+id, role and coordinates held in float64 NumPy arrays, so distances from a
+point or between sets of locations are computed in bulk rather than per row
+on Decimal fields.
+
+The snapshot is refreshed incrementally from the location save/delete
+signals (see routes.signals) once the change commits. It is reloaded in
+full when the shared ``locations`` version counter (routes.versions) shows
+a change it did not apply, e.g. from another process or a bulk import.
+When the counter is not shared between processes (routes.versions), the
+snapshot is reloaded on every use instead.
+
+ETAs are rough estimates: great-circle distance times ``ROUTES_DETOUR_FACTOR``
+(default 1.3), divided by a per-travel-mode speed from
+``ROUTES_ETA_SPEEDS_KMH``.
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .deeplinks import DEFAULT_TRAVEL_MODE
+from .geo import EARTH_RADIUS_KM
+from .models import Location
+from .versions import LOCATIONS, bump_version, bump_version_on_commit, get_version, is_shared
+
+DEFAULT_ETA_SPEEDS_KMH = {
+    'driving': 30.0,
+    'walking': 5.0,
+    'bicycling': 15.0,
+    'transit': 20.0,
+}
+DEFAULT_DETOUR_FACTOR = 1.3
+
+
+def haversine_matrix(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distances (km) between two sets of points given in degrees.
+
+    Returns an array of shape ``(len(lat1), len(lat2))``.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))[:, None]
+    lng1 = np.radians(np.asarray(lng1, dtype=np.float64))[:, None]
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))[None, :]
+    lng2 = np.radians(np.asarray(lng2, dtype=np.float64))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def eta_minutes(distance_km, travel_mode=DEFAULT_TRAVEL_MODE):
+    """Estimate travel time in minutes for great-circle ``distance_km``."""
+    speeds = getattr(settings, 'ROUTES_ETA_SPEEDS_KMH', DEFAULT_ETA_SPEEDS_KMH)
+    detour = getattr(settings, 'ROUTES_DETOUR_FACTOR', DEFAULT_DETOUR_FACTOR)
+    try:
+        speed = speeds[travel_mode]
+    except KeyError:
+        raise ValueError(f'Unknown travel mode {travel_mode!r}.')
+    return np.asarray(distance_km, dtype=np.float64) * detour / speed * 60.0
+
+
+def with_etas(locations, travel_mode=DEFAULT_TRAVEL_MODE):
+    """Set ``eta_minutes`` on locations annotated with ``distance_km``; returns them."""
+    etas = eta_minutes([location.distance_km for location in locations], travel_mode)
+    for location, eta in zip(locations, etas.tolist()):
+        location.eta_minutes = eta
+    return locations
+
+
+class _Arrays:
+    """One immutable generation of snapshot arrays (replaced, never mutated)."""
+
+    def __init__(self, ids, roles, latitudes, longitudes):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.roles = np.asarray(roles, dtype=np.int64)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.rows = {int(pk): row for row, pk in enumerate(self.ids)}
+
+
+class LocationSnapshot:
+    """
+    Coordinates of every Location in parallel NumPy arrays.
+
+    Changes build a new generation of arrays and swap it in with a single
+    assignment, so readers never see a half-applied update.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self.data = _Arrays([], [], [], [])
+
+    def __len__(self):
+        return len(self.data.ids)
+
+    @property
+    def ids(self):
+        return self.data.ids
+
+    def load(self, version=None):
+        """Read every location from the database."""
+        rows = list(Location.objects.order_by().values_list('id', 'role', 'latitude', 'longitude'))
+        ids, roles, latitudes, longitudes = zip(*rows) if rows else ((), (), (), ())
+        with self._lock:
+            self.data = _Arrays(ids, roles, [float(v) for v in latitudes], [float(v) for v in longitudes])
+            self.version = version
+
+    def ensure_fresh(self):
+        """Reload if locations changed since the snapshot was taken."""
+        if not is_shared():
+            # Changes made by other processes are not counted here
+            with self._lock:
+                self.load()
+            return self
+        current = get_version(LOCATIONS)
+        if self.version != current:
+            with self._lock:
+                if self.version != current:
+                    self.load(current)
+        return self
+
+    def apply(self, change, staged, version):
+        """
+        Apply one committed save or deletion.
+
+        ``change`` is ``(pk, role, latitude, longitude)``, with role None for a
+        deletion. Each change bumps the shared version twice: ``staged`` when
+        it was made and ``version`` when it committed. It is applied in place
+        only if nothing else changed in between; otherwise the snapshot is
+        reloaded on next use.
+        """
+        pk, role, latitude, longitude = change
+        with self._lock:
+            if self.version not in (staged - 1, staged) or version != staged + 1:
+                self.version = None
+                return
+            data = self.data
+            keep = data.ids != pk
+            ids, roles = data.ids[keep], data.roles[keep]
+            latitudes, longitudes = data.latitudes[keep], data.longitudes[keep]
+            if role is not None:
+                ids, roles = np.append(ids, pk), np.append(roles, role)
+                latitudes = np.append(latitudes, float(latitude))
+                longitudes = np.append(longitudes, float(longitude))
+            self.data = _Arrays(ids, roles, latitudes, longitudes)
+            self.version = version
+
+    @staticmethod
+    def _rows(data, ids):
+        return np.fromiter((data.rows[int(pk)] for pk in ids), dtype=np.int64, count=len(ids))
+
+    def distances_from(self, latitude, longitude, ids=None):
+        """
+        Distances (km) from a point to the locations ``ids`` (all by default).
+
+        Raises KeyError for ids missing from the snapshot.
+        """
+        data = self.data
+        rows = slice(None) if ids is None else self._rows(data, ids)
+        return haversine_matrix([latitude], [longitude], data.latitudes[rows], data.longitudes[rows])[0]
+
+    def matrix(self, origin_ids, destination_ids):
+        """Distance matrix (km) between two lists of location ids."""
+        data = self.data
+        origins = self._rows(data, origin_ids)
+        destinations = self._rows(data, destination_ids)
+        return haversine_matrix(
+            data.latitudes[origins], data.longitudes[origins],
+            data.latitudes[destinations], data.longitudes[destinations],
+        )
+
+    def nearest(self, latitude, longitude, role=None, limit=20):
+        """
+        Return the ids and distances of the ``limit`` nearest locations.
+
+        Returns:
+            tuple: (ids array, distances array), nearest first
+        """
+        data = self.data
+        rows = np.arange(len(data.ids)) if role is None else np.flatnonzero(data.roles & role)
+        distances = haversine_matrix([latitude], [longitude], data.latitudes[rows], data.longitudes[rows])[0]
+        if len(rows) > limit:
+            # argpartition is O(n); only the selected ``limit`` are sorted
+            picked = np.argpartition(distances, limit)[:limit]
+        else:
+            picked = np.arange(len(rows))
+        picked = picked[np.argsort(distances[picked], kind='stable')]
+        return data.ids[rows[picked]], distances[picked]
+
+
+_snapshot = LocationSnapshot()
+
+
+def location_snapshot():
+    """Return the process-wide snapshot, reloaded if it is out of date."""
+    return _snapshot.ensure_fresh()
+
+
+def location_changed(location, deleted=False):
+    """
+    Record a saved or deleted location.
+
+    The version is bumped at once, so caches in this process and transaction
+    notice the change, and again on commit, so other processes cannot keep
+    data they read before the commit.
+    """
+    # Captured now: the instance may change (or lose its pk) before commit
+    change = (location.pk, None if deleted else location.role, location.latitude, location.longitude)
+    staged = bump_version(LOCATIONS)
+    bump_version_on_commit(LOCATIONS, lambda version: _snapshot.apply(change, staged, version))
+
+
+def locations_changed():
+    """Record a bulk change (e.g. an import); snapshots reload on next use."""
+    bump_version(LOCATIONS)
+    bump_version_on_commit(LOCATIONS)
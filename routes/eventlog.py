@@ -0,0 +1,226 @@
+"""
+Append-only log of navigation state transitions, and hourly rollups of it.
+
+With ``ROUTES_EVENT_LOG`` on, every applied transition and dispatcher
+assignment is queued in process as a NavigationEvent and inserted in
+batches: a daemon thread flushes the queue every
+``ROUTES_EVENT_LOG_INTERVAL`` seconds (default 5), or as soon as
+``ROUTES_EVENT_LOG_BATCH_SIZE`` events (default 500) are pending, and once
+more at interpreter exit (routes.batching). Requests never wait on the
+insert, and a failed insert is retried by the next flush.
+
+``rollup`` turns the raw events into TransitionRollup rows: for each
+``SEGMENTS`` pair, the time a session took from entering the first state to
+entering the second, counted per hour and pickup location in a histogram.
+Analytics read the small rollup table; neither the raw events nor the
+NavigationSession table are scanned or locked to answer them.
+"""
+import functools
+import itertools
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .batching import BatchedWriter
+from .models import NavigationEvent, TransitionRollup
+
+# (start state, end state) pairs whose durations are rolled up
+SEGMENTS = (
+    ('pickup_selected', 'navigated_to_pickup'),
+    ('navigated_to_pickup', 'navigated_to_dropoff'),
+)
+# Histogram bucket upper bounds (seconds); a last, open bucket holds longer durations
+DURATION_BUCKETS = (60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200)
+# Segments are looked up to this far before the rolled-up hours
+DEFAULT_LOOKBACK = 24 * 60 * 60
+BATCH_SIZE = 500
+
+RollupResult = namedtuple('RollupResult', ['hours', 'events', 'rollups'])
+DurationStats = namedtuple('DurationStats', ['count', 'mean_seconds', 'max_seconds', 'p50_seconds', 'p95_seconds'])
+
+
+class EventLog(BatchedWriter):
+    """Queue of NavigationEvent rows, inserted in batches by a daemon thread."""
+    thread_name = 'navigation-event-log'
+
+    def __init__(self):
+        super().__init__(
+            batch_size=getattr(settings, 'ROUTES_EVENT_LOG_BATCH_SIZE', BATCH_SIZE),
+            interval=getattr(settings, 'ROUTES_EVENT_LOG_INTERVAL', 5.0),
+        )
+        # Events are never deduplicated: each gets its own key
+        self._sequence = itertools.count()
+
+    def record(self, nav_session, event):
+        """Queue the transition ``event`` that left ``nav_session`` in its current state."""
+        self.add(next(self._sequence), NavigationEvent(
+            session_key=nav_session.session_key,
+            event=NavigationEvent.EVENTS.index(event),
+            state=NavigationEvent.STATES.index(nav_session.state),
+            pickup_id=nav_session.pickup_id,
+            dropoff_id=nav_session.dropoff_id,
+            at=timezone.now(),
+        ))
+
+    def write(self, batch):
+        NavigationEvent.objects.bulk_create(batch.values(), batch_size=self.batch_size)
+        return len(batch)
+
+
+@functools.lru_cache(maxsize=None)
+def get_event_log():
+    """Return the process's EventLog, or None when ``ROUTES_EVENT_LOG`` is off."""
+    return EventLog() if getattr(settings, 'ROUTES_EVENT_LOG', False) else None
+
+
+def _reset_event_log(*, setting, **kwargs):
+    if setting.startswith('ROUTES_EVENT_LOG'):
+        get_event_log.cache_clear()
+
+
+setting_changed.connect(_reset_event_log)
+
+
+def record(nav_session, event):
+    """Log the transition ``event`` that left ``nav_session`` in its current state."""
+    event_log = get_event_log()
+    if event_log is not None:
+        event_log.record(nav_session, event)
+
+
+def _hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _bucket(seconds):
+    for index, bound in enumerate(DURATION_BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(DURATION_BUCKETS)
+
+
+def _segment_codes():
+    # End state code -> start state codes of the segments ending there
+    ends = {}
+    for start, end in SEGMENTS:
+        ends.setdefault(NavigationEvent.STATES.index(end), []).append(NavigationEvent.STATES.index(start))
+    return ends
+
+
+def rollup(start=None, end=None, lookback=None, batch_size=BATCH_SIZE):
+    """
+    Recompute the TransitionRollup rows of the hours from ``start`` to ``end``.
+
+    ``end`` defaults to the start of the current hour, so only complete hours
+    are rolled up. ``start`` defaults to the last hour rolled up before (redone,
+    as late-flushed events may have landed in it) or else the first event.
+    Segments may begin up to ``lookback`` seconds (``ROUTES_ROLLUP_LOOKBACK``,
+    default one day) before ``start``. The hours' rows are replaced in one
+    transaction on the rollup table, so running it again is harmless.
+
+    Returns:
+        RollupResult: hours rolled up, events read and rollup rows written
+    """
+    end = _hour(end or timezone.now())
+    if start is None:
+        start = TransitionRollup.objects.aggregate(last=Max('hour'))['last']
+        start = start or NavigationEvent.objects.aggregate(first=Min('at'))['first']
+    if start is None:
+        return RollupResult(0, 0, 0)
+    start = _hour(start)
+    if start >= end:
+        return RollupResult(0, 0, 0)
+    if lookback is None:
+        lookback = getattr(settings, 'ROUTES_ROLLUP_LOOKBACK', DEFAULT_LOOKBACK)
+
+    ends = _segment_codes()
+    reset = NavigationEvent.STATES.index('no_selection')
+    buckets = {}
+    events = 0
+    session_key, entered = None, {}
+    rows = (
+        NavigationEvent.objects
+        .filter(at__gte=start - timedelta(seconds=lookback), at__lt=end)
+        .order_by('session_key', 'at', 'pk')
+        .values_list('session_key', 'state', 'pickup_id', 'at')
+    )
+    for key, state, pickup_id, at in rows.iterator(chunk_size=2000):
+        events += 1
+        if key != session_key or state == reset:
+            session_key, entered = key, {}
+        if at >= start:
+            for from_state in ends.get(state, ()):
+                if from_state not in entered:
+                    continue
+                seconds = (at - entered[from_state]).total_seconds()
+                summary = buckets.setdefault((_hour(at), pickup_id, from_state, state), {
+                    'count': 0, 'total': 0.0, 'max': 0.0, 'histogram': [0] * (len(DURATION_BUCKETS) + 1),
+                })
+                summary['count'] += 1
+                summary['total'] += seconds
+                summary['max'] = max(summary['max'], seconds)
+                summary['histogram'][_bucket(seconds)] += 1
+        entered[state] = at
+
+    with transaction.atomic():
+        TransitionRollup.objects.filter(hour__gte=start, hour__lt=end).delete()
+        TransitionRollup.objects.bulk_create([
+            TransitionRollup(
+                hour=hour, pickup_id=pickup_id, from_state=from_state, to_state=to_state,
+                count=summary['count'], total_seconds=summary['total'], max_seconds=summary['max'],
+                histogram=summary['histogram'],
+            )
+            for (hour, pickup_id, from_state, to_state), summary in buckets.items()
+        ], batch_size=batch_size)
+    return RollupResult(int((end - start).total_seconds() // 3600), events, len(buckets))
+
+
+def duration_stats(from_state, to_state, since=None, until=None, pickup_id=None):
+    """
+    Summarize rolled-up durations from ``from_state`` to ``to_state``.
+
+    Percentiles are bucket upper bounds, capped at the longest duration.
+
+    Returns:
+        DurationStats: or None if no durations were rolled up
+    """
+    rollups = TransitionRollup.objects.filter(
+        from_state=NavigationEvent.STATES.index(from_state), to_state=NavigationEvent.STATES.index(to_state),
+    )
+    if since is not None:
+        rollups = rollups.filter(hour__gte=since)
+    if until is not None:
+        rollups = rollups.filter(hour__lt=until)
+    if pickup_id is not None:
+        rollups = rollups.filter(pickup_id=pickup_id)
+
+    count, total, longest = 0, 0.0, 0.0
+    histogram = [0] * (len(DURATION_BUCKETS) + 1)
+    for row_count, row_total, row_max, row_histogram in rollups.values_list(
+        'count', 'total_seconds', 'max_seconds', 'histogram'
+    ):
+        count += row_count
+        total += row_total
+        longest = max(longest, row_max)
+        histogram = [seen + added for seen, added in zip(histogram, row_histogram)]
+    if not count:
+        return None
+    return DurationStats(
+        count, total / count, longest, _percentile(histogram, count, 50, longest),
+        _percentile(histogram, count, 95, longest),
+    )
+
+
+def _percentile(histogram, count, pct, longest):
+    rank = pct / 100 * count
+    seen = 0
+    for index, bucket_count in enumerate(histogram):
+        seen += bucket_count
+        if seen >= rank:
+            return min(DURATION_BUCKETS[index], longest) if index < len(DURATION_BUCKETS) else longest
+    return longest
@@ -0,0 +1,217 @@
+"""
+Live navigation state events.
+
+Every applied state transition (routes.state_machine) and dispatcher
+assignment (routes.dispatch) is published to the broker chosen with
+``ROUTES_EVENT_BROKER``. ``api/events/`` streams the events to staff as
+Server-Sent Events, so a dashboard holds one connection instead of polling.
+
+The default ``LocalBroker`` delivers within one process. With several
+worker processes each viewer sees the transitions served by its own worker;
+a broker backed by a shared service (e.g. Redis pub/sub) implements the same
+two methods.
+"""
+import asyncio
+import functools
+import itertools
+import json
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from django.utils.module_loading import import_string
+
+from .dispatch import DRIVER_KEY_PREFIX
+
+DEFAULT_EVENT_BROKER = 'routes.events.LocalBroker'
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT = 15
+# Milliseconds a disconnected browser waits before reconnecting
+RETRY_MS = 3000
+
+
+def session_label(session_key):
+    """
+    Name a session in events.
+
+    Dispatched drivers are named by their ``driver:<token>`` key; other
+    sessions by a keyed hash, as their key would let anyone take them over.
+    """
+    if session_key.startswith(DRIVER_KEY_PREFIX):
+        return session_key
+    return 'session:' + salted_hmac('routes.events', session_key).hexdigest()[:12]
+
+
+def state_event(nav_session, event):
+    """The event published when ``event`` left ``nav_session`` in its current state."""
+    return {
+        'session': session_label(nav_session.session_key),
+        'event': event,
+        'state': nav_session.state,
+        'state_display': nav_session.get_state_display(),
+        'pickup_id': nav_session.pickup_id,
+        'dropoff_id': nav_session.dropoff_id,
+        'at': timezone.now().isoformat(),
+    }
+
+
+class BaseBroker:
+    """Interface for publishing events to stream subscribers."""
+
+    def publish(self, event):
+        """Deliver ``event`` (a JSON-serializable dict) to every subscriber; callable from any thread."""
+        raise NotImplementedError
+
+    def subscribe(self, last_event_id=None):
+        """
+        Subscribe from a running event loop; returns a Subscription.
+
+        Its ``asyncio.Queue`` of ``(id, event)`` receives events published
+        until it is closed and, with ``last_event_id``, recent events after
+        that id that a reconnecting client missed.
+        """
+        raise NotImplementedError
+
+
+class Subscription:
+    """
+    An open subscription: an async context manager giving its queue.
+
+    ``close()`` is synchronous and idempotent, so a subscription is also
+    released by a response's ``close()`` or when it is garbage collected;
+    there is no generator left to finalize.
+    """
+
+    def __init__(self, queue, unsubscribe):
+        self.queue = queue
+        self._unsubscribe = unsubscribe
+
+    async def __aenter__(self):
+        return self.queue
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._unsubscribe is None
+
+    def close(self):
+        unsubscribe, self._unsubscribe = self._unsubscribe, None
+        if unsubscribe is not None:
+            unsubscribe()
+
+    __del__ = close
+
+
+def _deliver(queue, item):
+    # A subscriber that cannot keep up loses its oldest events
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+class LocalBroker(BaseBroker):
+    """In-process broker; keeps the last ``backlog`` events for reconnecting clients."""
+    backlog = 100
+    queue_size = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._recent = deque(maxlen=self.backlog)
+        self._ids = itertools.count(1)
+
+    def publish(self, event):
+        with self._lock:
+            item = (next(self._ids), event)
+            self._recent.append(item)
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                # Publishers run in request threads; queues belong to event loops
+                loop.call_soon_threadsafe(_deliver, queue, item)
+            except RuntimeError:
+                # The subscriber's loop has closed
+                with self._lock:
+                    self._subscribers.discard((loop, queue))
+        return item[0]
+
+    def subscribe(self, last_event_id=None):
+        queue = asyncio.Queue(self.queue_size)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            missed = [item for item in self._recent if last_event_id is not None and item[0] > last_event_id]
+        for item in missed:
+            _deliver(queue, item)
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers.discard(subscriber)
+        return Subscription(queue, unsubscribe)
+
+
+@functools.lru_cache(maxsize=None)
+def get_event_broker():
+    """Return the configured event broker instance (one per process)."""
+    return import_string(getattr(settings, 'ROUTES_EVENT_BROKER', DEFAULT_EVENT_BROKER))()
+
+
+def _reset_event_broker(*, setting, **kwargs):
+    if setting == 'ROUTES_EVENT_BROKER':
+        get_event_broker.cache_clear()
+
+
+setting_changed.connect(_reset_event_broker)
+
+
+def publish(nav_session, event):
+    """Publish the state ``event`` left ``nav_session`` in."""
+    return get_event_broker().publish(state_event(nav_session, event))
+
+
+def _format(event_id, event):
+    return f'id: {event_id}\nevent: state\ndata: {json.dumps(event)}\n\n'.encode()
+
+
+class EventStream:
+    """
+    Async iterator of Server-Sent Events for published events, forever.
+
+    ``session`` limits the stream to one session label. Idle streams get a
+    comment every ``HEARTBEAT`` seconds so proxies keep them open. Not an
+    async generator: Django closes streaming content through ``close()``
+    once the client is gone, which releases the subscription at once.
+    """
+
+    def __init__(self, last_event_id=None, session=None):
+        self.session = session
+        self._subscription = get_event_broker().subscribe(last_event_id)
+        self._started = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._subscription.closed:
+            raise StopAsyncIteration
+        if not self._started:
+            self._started = True
+            return f'retry: {RETRY_MS}\n\n'.encode()
+        while True:
+            try:
+                event_id, event = await asyncio.wait_for(self._subscription.queue.get(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                return b': keep-alive\n\n'
+            if self.session is None or event['session'] == self.session:
+                return _format(event_id, event)
+
+    def close(self):
+        self._subscription.close()
+
+    async def aclose(self):
+        self.close()
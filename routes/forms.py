@@ -2,6 +2,16 @@ from django import forms
 from .models import PickUpLocation, DropOffLocation
 
 
+def validate_latitude(latitude):
+    if latitude < -90 or latitude > 90:
+        raise forms.ValidationError('Latitude must be between -90 and 90.')
+
+
+def validate_longitude(longitude):
+    if longitude < -180 or longitude > 180:
+        raise forms.ValidationError('Longitude must be between -180 and 180.')
+
+
 class LocationForm(forms.ModelForm):
     """Base form for creating pickup or dropoff locations."""
     latitude = forms.DecimalField(
@@ -23,15 +33,13 @@ class LocationForm(forms.ModelForm):
     def clean_latitude(self):
         latitude = self.cleaned_data.get('latitude')
         if latitude is not None:
-            if latitude < -90 or latitude > 90:
-                raise forms.ValidationError('Latitude must be between -90 and 90.')
+            validate_latitude(latitude)
         return latitude
 
     def clean_longitude(self):
         longitude = self.cleaned_data.get('longitude')
         if longitude is not None:
-            if longitude < -180 or longitude > 180:
-                raise forms.ValidationError('Longitude must be between -180 and 180.')
+            validate_longitude(longitude)
         return longitude
 
 
@@ -45,3 +53,14 @@ class DropOffLocationForm(LocationForm):
     """Form for creating dropoff locations."""
     class Meta(LocationForm.Meta):
         model = DropOffLocation
+
+
+class LocationImportForm(forms.Form):
+    """Form for uploading a CSV or GeoJSON file of locations."""
+    file = forms.FileField(
+        help_text='CSV with name, latitude, longitude columns, or GeoJSON Point features'
+    )
+    format = forms.ChoiceField(
+        choices=[('', 'Detect from file name'), ('csv', 'CSV'), ('geojson', 'GeoJSON')],
+        required=False
+    )
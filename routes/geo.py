@@ -0,0 +1,177 @@
+"""
+Geohash spatial index helpers for nearest-location search.
+
+Every location stores the geohash of its coordinates in an indexed column.
+Cells sharing a prefix are contiguous in the index, so a geohash cell maps to
+a single B-tree range scan (``geohash >= prefix AND geohash < prefix + '~'``)
+on any database backend.
+"""
+import math
+
+from django.db.models import Q
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+
+# Default number of locations returned by a nearest search
+NEAREST_LIMIT = 20
+
+# Precisions tried from finest to coarsest when widening a nearest search
+SEARCH_PRECISIONS = (7, 6, 5, 4, 3, 2, 1)
+
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a coordinate pair as a geohash string."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    latitude = float(latitude)
+    longitude = float(longitude)
+
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lng_range[0] = mid
+            else:
+                bits <<= 1
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Return (lat_degrees, lng_degrees) covered by a geohash cell."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def neighbourhood(latitude, longitude, precision):
+    """
+    Return the geohash of the cell containing the point and its 8 neighbours.
+
+    Neighbours are computed by re-encoding the point shifted by one cell in
+    each direction, wrapping longitude across the antimeridian and dropping
+    cells beyond the poles.
+    """
+    lat_step, lng_step = cell_size(precision)
+    latitude = float(latitude)
+    longitude = float(longitude)
+    cells = []
+    for d_lat in (-1, 0, 1):
+        lat = latitude + d_lat * lat_step
+        if lat < -90 or lat > 90:
+            continue
+        for d_lng in (-1, 0, 1):
+            lng = (longitude + d_lng * lng_step + 180) % 360 - 180
+            cell = encode_geohash(lat, lng, precision)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def prefix_q(cells, field='geohash'):
+    """Build a Q matching any of the geohash cells as an index range scan."""
+    query = Q()
+    for cell in cells:
+        query |= Q(**{f'{field}__gte': cell, f'{field}__lt': cell + '~'})
+    return query
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in kilometres between two coordinates."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (float(lat1), float(lng1), float(lat2), float(lng2)))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _covered_radius_km(latitude, precision):
+    """
+    Distance from the query point that the 3x3 neighbourhood fully covers.
+
+    The point lies inside the centre cell, so anything closer than one cell
+    height/width is guaranteed to fall inside the neighbourhood. Width shrinks
+    with latitude, so it is measured at the edge nearest the pole.
+    """
+    lat_step, lng_step = cell_size(precision)
+    edge_lat = min(90.0, abs(float(latitude)) + 2 * lat_step)
+    width_km = lng_step * _KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+    return min(lat_step * _KM_PER_DEGREE, width_km)
+
+
+def _with_distances(locations, latitude, longitude):
+    # Imported here: routes.distances imports the models, which import this module
+    from .distances import haversine_matrix
+
+    if not locations:
+        return locations
+    distances = haversine_matrix(
+        [latitude], [longitude],
+        [float(location.latitude) for location in locations],
+        [float(location.longitude) for location in locations],
+    )[0]
+    for location, distance in zip(locations, distances.tolist()):
+        location.distance_km = distance
+    return sorted(locations, key=lambda location: location.distance_km)
+
+
+def nearest_locations(queryset, latitude, longitude, limit=NEAREST_LIMIT):
+    """
+    Return the ``limit`` locations of ``queryset`` nearest to the coordinate.
+
+    Searches the geohash neighbourhood of the point, widening the cell size
+    until at least ``limit`` candidates are found whose ``limit``-th distance
+    lies inside the radius the neighbourhood is guaranteed to cover. Each
+    returned instance has a ``distance_km`` attribute.
+    """
+    for precision in SEARCH_PRECISIONS:
+        cells = neighbourhood(latitude, longitude, precision)
+        candidates = list(queryset.filter(prefix_q(cells)))
+        if len(candidates) < limit:
+            continue
+        candidates = _with_distances(candidates, latitude, longitude)
+        if candidates[limit - 1].distance_km <= _covered_radius_km(latitude, precision):
+            return candidates[:limit]
+
+    # Sparse table or huge radius: every row is a candidate
+    return _with_distances(list(queryset), latitude, longitude)[:limit]
+
+
+def parse_coordinates(params):
+    """
+    Read ``lat``/``lng`` from a QueryDict.
+
+    Returns a (latitude, longitude) float pair, or None when either value is
+    missing, malformed or out of range.
+    """
+    try:
+        latitude = float(params['lat'])
+        longitude = float(params['lng'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
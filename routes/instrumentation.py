@@ -0,0 +1,206 @@
+"""
+Opt-in per-request instrumentation.
+
+``InstrumentationMiddleware`` (routes.middleware) samples a share of requests
+(``ROUTES_INSTRUMENTATION_SAMPLE_RATE``, 0 disables it) and measures for each:
+
+- ``total``: wall time through the middleware stack
+- ``db``: time and number of database queries, including session saves
+- ``template``: time spent rendering templates
+- ``session``: time spent saving the Django session and the NavigationSession
+
+Sampled requests get a ``Server-Timing`` header and a JSON line on the
+``routes.instrumentation`` logger, and are added to per-process histograms
+keyed by URL name, served to staff at ``api/metrics/``. Unsampled requests
+only pay for one random number.
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+logger = logging.getLogger('routes.instrumentation')
+
+METRICS = ('total', 'db', 'template', 'session')
+# Histogram bucket upper bounds (ms); a last, open bucket holds slower requests
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# The sampled request being handled; copied into sync_to_async threads, so
+# queries of async views are attributed too
+_current = ContextVar('routes_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Timings (seconds) and query count of one sampled request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.timings = dict.fromkeys(METRICS, 0.0)
+
+    def finish(self):
+        self.timings['total'] = time.perf_counter() - self.started
+        return {name: seconds * 1000 for name, seconds in self.timings.items()}
+
+
+@contextlib.contextmanager
+def sampled():
+    """Collect metrics for the code run in the block; yields the RequestMetrics."""
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def measure(name):
+    """Add the block's wall time to ``name`` if the current request is sampled."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] += time.perf_counter() - start
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.timings['db'] += time.perf_counter() - start
+
+
+def _instrument_connection(sender=None, connection=None, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def install():
+    """Hook query and template timing into Django; idempotent."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        # New connections (other threads, reconnects) are hooked as they open
+        connection_created.connect(_instrument_connection, weak=False)
+        for connection in connections.all(initialized_only=True):
+            _instrument_connection(connection=connection)
+
+        render = Template.render
+
+        def timed_render(self, *args, **kwargs):
+            with measure('template'):
+                return render(self, *args, **kwargs)
+
+        Template.render = timed_render
+        _installed = True
+
+
+def server_timing(timings_ms, queries):
+    """Format timings as a ``Server-Timing`` header value."""
+    entries = []
+    for name in METRICS:
+        entry = f'{name};dur={timings_ms[name]:.1f}'
+        if name == 'db':
+            entry += f';desc="{queries} queries"'
+        entries.append(entry)
+    return ', '.join(entries)
+
+
+def log_request(request, view_name, status, timings_ms, queries):
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'view': view_name,
+        'status': status,
+        'queries': queries,
+        **{f'{name}_ms': round(timings_ms[name], 2) for name in METRICS},
+    }))
+
+
+class Histograms:
+    """Thread-safe per-view latency histograms of sampled requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, timings_ms, queries):
+        with self._lock:
+            view = self._views.get(view_name)
+            if view is None:
+                view = self._views[view_name] = {
+                    'count': 0,
+                    'queries': 0,
+                    'metrics': {name: {'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(BUCKETS_MS) + 1)}
+                                for name in METRICS},
+                }
+            view['count'] += 1
+            view['queries'] += queries
+            for name, value in timings_ms.items():
+                metric = view['metrics'][name]
+                metric['sum'] += value
+                metric['max'] = max(metric['max'], value)
+                metric['buckets'][_bucket(value)] += 1
+
+    def snapshot(self):
+        """Summaries per view; percentiles are bucket upper bounds (ms)."""
+        with self._lock:
+            return {view_name: _summarize(view) for view_name, view in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+def _bucket(value):
+    for index, bound in enumerate(BUCKETS_MS):
+        if value <= bound:
+            return index
+    return len(BUCKETS_MS)
+
+
+def _summarize(view):
+    count = view['count']
+    labels = [f'<={bound}' for bound in BUCKETS_MS] + [f'>{BUCKETS_MS[-1]}']
+    metrics = {}
+    for name, metric in view['metrics'].items():
+        summary = {'mean_ms': metric['sum'] / count, 'max_ms': metric['max']}
+        for pct in (50, 95, 99):
+            summary[f'p{pct}_ms'] = _percentile(metric, count, pct)
+        summary['buckets'] = dict(zip(labels, metric['buckets']))
+        metrics[name] = summary
+    return {'count': count, 'queries_per_request': view['queries'] / count, 'metrics': metrics}
+
+
+def _percentile(metric, count, pct):
+    rank = pct / 100 * count
+    seen = 0
+    for index, bucket_count in enumerate(metric['buckets']):
+        seen += bucket_count
+        if seen >= rank:
+            return BUCKETS_MS[index] if index < len(BUCKETS_MS) else metric['max']
+    return metric['max']
+
+
+histograms = Histograms()
@@ -0,0 +1,130 @@
+"""
+Shared helpers for the ``bench_*`` management commands.
+
+Benchmarks run against a throwaway test database (created and destroyed
+like ``manage.py test`` does), never against the configured database.
+"""
+import contextlib
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+def percentile(samples, pct):
+    """Return the ``pct`` percentile of ``samples`` (nearest-rank)."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Summarize per-operation timings (seconds) in microseconds."""
+    return {
+        'ops': len(samples),
+        'mean_us': statistics.fmean(samples) * 1e6,
+        'p50_us': percentile(samples, 50) * 1e6,
+        'p95_us': percentile(samples, 95) * 1e6,
+        'p99_us': percentile(samples, 99) * 1e6,
+    }
+
+
+def time_calls(func, iterations):
+    """Call ``func`` ``iterations`` times and return the per-call timings."""
+    samples = []
+    clock = time.perf_counter
+    for _ in range(iterations):
+        start = clock()
+        func()
+        samples.append(clock() - start)
+    return samples
+
+
+@contextlib.contextmanager
+def test_database(verbosity=0, name=None):
+    """
+    Run the block against a fresh test database.
+
+    ``name`` overrides the test database name, e.g. to benchmark SQLite on a
+    file instead of in memory.
+    """
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if name is not None:
+        test_settings['NAME'] = name
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        test_settings['NAME'] = old_test_name
+        teardown_test_environment()
+
+
+def _change(before, after):
+    if not before:
+        return 'n/a'
+    return f'{(after - before) / before:+.1%}'
+
+
+class BenchmarkCommand(BaseCommand):
+    """Base command: runs ``run_benchmarks`` on a test database and reports results."""
+
+    default_iterations = 1000
+    # Benchmarks that never touch the ORM skip creating a test database
+    uses_database = True
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=self.default_iterations,
+                            help='Operations timed per case.')
+        parser.add_argument('--json', dest='json_path',
+                            help='Also write results as JSON to this path.')
+        parser.add_argument('--compare', dest='baseline_path',
+                            help='JSON results of an earlier run to compare against.')
+
+    def handle(self, *args, **options):
+        if self.uses_database:
+            with test_database():
+                results = self.run_benchmarks(**options)
+        else:
+            results = self.run_benchmarks(**options)
+
+        for name, stats in results.items():
+            line = (
+                f"{name:<40} {stats['ops']:>8} ops  mean {stats['mean_us']:>10.2f} us"
+                f"  p50 {stats['p50_us']:>10.2f}  p95 {stats['p95_us']:>10.2f}  p99 {stats['p99_us']:>10.2f}"
+            )
+            if 'ops_per_s' in stats:
+                line += f"  {stats['ops_per_s']:>8.1f} ops/s  {stats['errors']} errors"
+            if stats.get('queries_per_op') is not None:
+                line += f"  {stats['queries_per_op']:.1f} queries/op"
+            self.stdout.write(line)
+        if options['baseline_path']:
+            self.compare(results, options['baseline_path'])
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2, sort_keys=True)
+
+    def compare(self, results, baseline_path):
+        """Print the change of each case's p95 (and throughput) against a baseline run."""
+        with open(baseline_path) as fh:
+            baseline = json.load(fh)
+        self.stdout.write(f'Compared with {baseline_path}:')
+        for name, stats in results.items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write(f'{name:<40} (new)')
+                continue
+            line = f"{name:<40} p95 {_change(before['p95_us'], stats['p95_us'])}"
+            if 'ops_per_s' in stats and 'ops_per_s' in before:
+                line += f"  ops/s {_change(before['ops_per_s'], stats['ops_per_s'])}"
+            self.stdout.write(line)
+
+    def run_benchmarks(self, **options):
+        """Return a mapping of case name to ``summarize()`` output."""
+        raise NotImplementedError
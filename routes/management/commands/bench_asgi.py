@@ -0,0 +1,111 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from routes.models import DropOffLocation, PickUpLocation
+
+from ._benchmark import BenchmarkCommand, summarize, test_database
+
+
+class Command(BenchmarkCommand):
+    help = ('Compare the navigation flow served by one WSGI worker and one ASGI worker '
+            'under the same number of concurrent clients.')
+
+    default_iterations = 50
+    uses_database = False
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Concurrent clients, each with its own session.')
+
+    def run_benchmarks(self, iterations, concurrency, **options):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                test_database(name=os.path.join(tmpdir, 'bench.sqlite3')):
+            pickup = PickUpLocation.objects.create(name='Bench Pickup', latitude=37.7749, longitude=-122.4194)
+            dropoff = DropOffLocation.objects.create(name='Bench Dropoff', latitude=37.7849, longitude=-122.4094)
+            self.flow = [
+                ('post', reverse('routes:select_locations'), {'pickup_id': pickup.id, 'dropoff_id': dropoff.id}),
+                ('post', reverse('routes:navigate_action'), None),
+                ('get', reverse('routes:navigate_view'), None),
+                ('post', reverse('routes:navigate_action'), None),
+                ('get', reverse('routes:navigate_view'), None),
+                ('get', reverse('routes:state_view'), None),
+            ]
+            return {
+                f'navigation flow (wsgi, 1 worker, {concurrency} clients)': self.run_wsgi(iterations, concurrency),
+                f'navigation flow (asgi, 1 worker, {concurrency} clients)': self.run_asgi(iterations, concurrency),
+            }
+
+    def run_wsgi(self, iterations, concurrency):
+        # A sync worker serves one request at a time; the lock stands in for it,
+        # so latency includes the time a request waits for the worker
+        worker = threading.Lock()
+        samples = []
+        errors = []
+        barrier = threading.Barrier(concurrency)
+
+        def client_loop():
+            client = Client()
+            local_samples, local_errors = [], 0
+            clock = time.perf_counter
+            try:
+                barrier.wait()
+                for _ in range(iterations):
+                    for method, url, data in self.flow:
+                        start = clock()
+                        with worker:
+                            response = getattr(client, method)(url, data)
+                        local_samples.append(clock() - start)
+                        local_errors += response.status_code >= 400
+            finally:
+                connection.close()
+                samples.extend(local_samples)
+                errors.append(local_errors)
+
+        threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.stats(samples, sum(errors), time.perf_counter() - started)
+
+    def run_asgi(self, iterations, concurrency):
+        # One event loop is one uvicorn worker
+        async def client_loop():
+            client = AsyncClient()
+            samples, errors = [], 0
+            clock = time.perf_counter
+            for _ in range(iterations):
+                for method, url, data in self.flow:
+                    start = clock()
+                    response = await getattr(client, method)(url, data)
+                    samples.append(clock() - start)
+                    errors += response.status_code >= 400
+            return samples, errors
+
+        async def run():
+            return await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+        started = time.perf_counter()
+        results = asyncio.run(run())
+        elapsed = time.perf_counter() - started
+        return self.stats(
+            [sample for samples, _errors in results for sample in samples],
+            sum(errors for _samples, errors in results),
+            elapsed,
+        )
+
+    @staticmethod
+    def stats(samples, errors, elapsed):
+        stats = summarize(samples or [0.0])
+        stats['ops_per_s'] = len(samples) / elapsed
+        stats['errors'] = errors
+        return stats
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.db import OperationalError, connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from routes.db import DEFAULT_SQLITE_PRAGMAS
+from routes.models import DropOffLocation, PickUpLocation
+
+from ._benchmark import BenchmarkCommand, summarize, test_database
+
+# SQLite profiles compared on a file database
+SQLITE_PROFILES = {
+    # SQLite's own defaults (rollback journal, full fsync, 5s driver timeout)
+    'rollback': {'journal_mode': 'delete', 'synchronous': 'full', 'busy_timeout': 5000},
+    'wal': DEFAULT_SQLITE_PRAGMAS,
+}
+
+
+class Command(BenchmarkCommand):
+    help = ('Load-test the navigate_action write path with concurrent clients, '
+            'comparing SQLite journal profiles (or the configured database).')
+
+    default_iterations = 200
+    uses_database = False
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Concurrent clients, each with its own session and connection.')
+        parser.add_argument('--profiles', nargs='+', choices=sorted(SQLITE_PROFILES),
+                            default=sorted(SQLITE_PROFILES),
+                            help='SQLite PRAGMA profiles to compare.')
+
+    def run_benchmarks(self, iterations, threads, profiles, **options):
+        if connection.vendor != 'sqlite':
+            with test_database():
+                return {f'navigate_action ({connection.vendor}, {threads} threads)':
+                        self.load_test(iterations, threads)}
+
+        results = {}
+        for profile in profiles:
+            # In-memory databases have no journal, so each profile gets a file
+            with tempfile.TemporaryDirectory() as tmpdir, \
+                    override_settings(ROUTES_SQLITE_PRAGMAS=SQLITE_PROFILES[profile]), \
+                    test_database(name=os.path.join(tmpdir, 'bench.sqlite3')):
+                results[f'navigate_action (sqlite {profile}, {threads} threads)'] = (
+                    self.load_test(iterations, threads)
+                )
+        return results
+
+    def load_test(self, iterations, threads):
+        pickup = PickUpLocation.objects.create(name='Bench Pickup', latitude=37.7749, longitude=-122.4194)
+        dropoff = DropOffLocation.objects.create(name='Bench Dropoff', latitude=37.7849, longitude=-122.4094)
+        select_url = reverse('routes:select_locations')
+        navigate_url = reverse('routes:navigate_action')
+
+        samples = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def client_loop():
+            client = Client()
+            local_samples, local_errors = [], 0
+            try:
+                client.post(select_url, {'pickup_id': pickup.id, 'dropoff_id': dropoff.id})
+                barrier.wait()
+                clock = time.perf_counter
+                for _ in range(iterations):
+                    start = clock()
+                    try:
+                        client.post(navigate_url)
+                    except OperationalError:
+                        # "database is locked": the write waited out busy_timeout
+                        local_errors += 1
+                        continue
+                    local_samples.append(clock() - start)
+            finally:
+                connection.close()
+                with lock:
+                    samples.extend(local_samples)
+                    errors.append(local_errors)
+
+        workers = [threading.Thread(target=client_loop) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        stats = summarize(samples or [0.0])
+        stats['ops_per_s'] = len(samples) / elapsed
+        stats['errors'] = sum(errors)
+        return stats
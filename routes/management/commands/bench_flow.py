@@ -0,0 +1,238 @@
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from routes.distances import locations_changed
+from routes.geo import encode_geohash
+from routes.models import DropOffLocation, PickUpLocation
+
+from ._benchmark import BenchmarkCommand, summarize, test_database
+
+# Seeded locations are spread over roughly 20 x 20 km
+SEED_CENTER = (37.7749, -122.4194)
+SEED_SPREAD = 0.1
+
+SERVER_START_TIMEOUT = 30
+
+
+class ClientDriver:
+    """Sends requests through the Django test client, counting queries."""
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(path, data or {})
+        return response.status_code, len(ctx.captured_queries)
+
+
+class HttpDriver:
+    """Sends requests to a running server over HTTP, keeping cookies and the CSRF token."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, data=None):
+        headers = {'Host': f'{self.host}:{self.port}'}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{key}={morsel.value}' for key, morsel in self.cookies.items())
+        body = None
+        if method == 'post':
+            body = urlencode(data or {})
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            if 'csrftoken' in self.cookies:
+                headers['X-CSRFToken'] = self.cookies['csrftoken'].value
+        conn = HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            conn.request(method.upper(), path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            for header in response.headers.get_all('Set-Cookie') or ():
+                self.cookies.load(header)
+            return response.status, None
+        finally:
+            conn.close()
+
+
+class Command(BenchmarkCommand):
+    help = ('Load-test the select -> navigate -> navigate -> start over flow with seeded locations '
+            'and sessions, through the test client or a local gunicorn server.')
+
+    default_iterations = 3
+    uses_database = False
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--locations', type=int, default=1000,
+                            help='Locations seeded, half pickups and half dropoffs.')
+        parser.add_argument('--sessions', type=int, default=20,
+                            help='Driver sessions, each running the flow --iterations times.')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Sessions running at the same time.')
+        parser.add_argument('--target', choices=['client', 'wsgi', 'asgi'], default='client',
+                            help='Django test client, or a gunicorn server with that SERVER_PROFILE.')
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Gunicorn worker processes for the wsgi and asgi targets.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the data.')
+
+    def run_benchmarks(self, iterations, locations, sessions, concurrency, target, workers, seed, **options):
+        # The server runs in another process, so the database must be a file
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'bench.sqlite3') if connection.vendor == 'sqlite' else None
+            with test_database(name=path):
+                rng = random.Random(seed)
+                pickup_ids, dropoff_ids = self.seed_locations(locations, rng)
+                plans = [(rng.choice(pickup_ids), rng.choice(dropoff_ids)) for _ in range(sessions)]
+                if target == 'client':
+                    return self.load_test(plans, iterations, concurrency, ClientDriver, target)
+                with self.server(target, workers) as (host, port):
+                    return self.load_test(plans, iterations, concurrency, lambda: HttpDriver(host, port), target)
+
+    def seed_locations(self, count, rng):
+        created = {}
+        for model, share in ((PickUpLocation, (count + 1) // 2), (DropOffLocation, count // 2)):
+            rows = []
+            for index in range(max(share, 1)):
+                latitude = round(SEED_CENTER[0] + rng.uniform(-SEED_SPREAD, SEED_SPREAD), 6)
+                longitude = round(SEED_CENTER[1] + rng.uniform(-SEED_SPREAD, SEED_SPREAD), 6)
+                rows.append(model(name=f'{model.__name__} {index}', latitude=latitude, longitude=longitude,
+                                  geohash=encode_geohash(latitude, longitude)))
+            created[model] = [location.pk for location in model.objects.bulk_create(rows, batch_size=500)]
+        locations_changed()
+        return created[PickUpLocation], created[DropOffLocation]
+
+    def flow(self, pickup_id, dropoff_id):
+        """(step name, method, path, data) of one pass through the handoff flow."""
+        select = reverse('routes:select_locations')
+        navigate = reverse('routes:navigate_view')
+        action = reverse('routes:navigate_action')
+        return [
+            ('select page', 'get', select, None),
+            ('select', 'post', select, {'pickup_id': pickup_id, 'dropoff_id': dropoff_id}),
+            ('navigate page', 'get', navigate, None),
+            ('navigate to pickup', 'post', action, None),
+            ('navigate page', 'get', navigate, None),
+            ('navigate to dropoff', 'post', action, None),
+            ('navigate page', 'get', navigate, None),
+            ('start over', 'post', reverse('routes:start_over'), None),
+        ]
+
+    def load_test(self, plans, iterations, concurrency, make_driver, target):
+        samples = defaultdict(list)
+        queries = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        pending = list(plans)
+
+        def worker():
+            clock = time.perf_counter
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        pickup_id, dropoff_id = pending.pop()
+                    driver = make_driver()
+                    for _ in range(iterations):
+                        for step, method, path, data in self.flow(pickup_id, dropoff_id):
+                            start = clock()
+                            status, query_count = driver.request(method, path, data)
+                            elapsed = clock() - start
+                            with lock:
+                                samples[step].append(elapsed)
+                                if query_count is not None:
+                                    queries[step].append(query_count)
+                                errors[step] += status >= 400
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        results = {}
+        all_samples = [sample for step_samples in samples.values() for sample in step_samples]
+        all_queries = [count for step_queries in queries.values() for count in step_queries]
+        for step, step_samples in [('all requests', all_samples), *samples.items()]:
+            step_queries = all_queries if step == 'all requests' else queries[step]
+            stats = summarize(step_samples)
+            stats['ops_per_s'] = len(step_samples) / elapsed
+            stats['errors'] = sum(errors.values()) if step == 'all requests' else errors[step]
+            stats['queries_per_op'] = sum(step_queries) / len(step_queries) if step_queries else None
+            results[f'flow {target}: {step}'] = stats
+        return results
+
+    def server(self, profile, workers):
+        return _Server(profile, workers, connection.settings_dict)
+
+
+class _Server:
+    """A gunicorn process serving the benchmark database on a free local port."""
+
+    def __init__(self, profile, workers, database):
+        self.profile = profile
+        self.workers = workers
+        self.database = database
+        self.process = None
+
+    def __enter__(self):
+        if self.database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Server targets need the SQLite test database; use --target client.')
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        env = {
+            **os.environ,
+            'SERVER_PROFILE': self.profile,
+            'WEB_CONCURRENCY': str(self.workers),
+            'DATABASE_URL': f"sqlite:///{os.path.abspath(self.database['NAME'])}",
+            'DEBUG': 'False',
+            'ALLOWED_HOSTS': '127.0.0.1',
+        }
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+             '--bind', f'127.0.0.1:{port}', '--access-logfile', os.devnull, '--log-level', 'warning'],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise CommandError(f'gunicorn ({self.profile}) exited with status {self.process.returncode}.')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return '127.0.0.1', port
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.__exit__(None, None, None)
+                    raise CommandError(f'gunicorn ({self.profile}) did not start.')
+                time.sleep(0.1)
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
@@ -0,0 +1,51 @@
+import numpy as np
+
+from routes.routing import _Tour, distance_matrix, order_stops, route_length
+
+from ._benchmark import BenchmarkCommand, summarize, time_calls
+
+# Synthetic batches: stops spread over a ~20 km square around San Francisco
+CENTER = (37.7749, -122.4194)
+SPREAD_DEGREES = 0.18
+STOP_COUNTS = (10, 30, 60, 100)
+
+
+def synthetic_stops(count, rng):
+    """Return (points, pairs, origin) for ``count`` stops (count // 2 parcels)."""
+    points = np.column_stack([
+        CENTER[0] + (rng.random(count) - 0.5) * SPREAD_DEGREES,
+        CENTER[1] + (rng.random(count) - 0.5) * SPREAD_DEGREES,
+    ]).tolist()
+    pairs = [(2 * parcel, 2 * parcel + 1) for parcel in range(count // 2)]
+    return points, pairs, CENTER
+
+
+class Command(BenchmarkCommand):
+    help = 'Benchmark multi-stop route ordering (nearest neighbour + 2-opt/or-opt) on synthetic stop sets.'
+
+    default_iterations = 50
+    uses_database = False
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def run_benchmarks(self, iterations, seed, **options):
+        rng = np.random.default_rng(seed)
+        results = {}
+        for count in STOP_COUNTS:
+            points, pairs, origin = synthetic_stops(count, rng)
+            stats = summarize(time_calls(lambda: order_stops(points, pairs, origin), iterations))
+
+            coordinates = np.vstack([origin, points])
+            distances = distance_matrix(coordinates[:, 0], coordinates[:, 1])
+            tour = _Tour(distances, [p + 1 for p, _d in pairs], [d + 1 for _p, d in pairs])
+            optimized = [0] + [index + 1 for index in order_stops(points, pairs, origin)]
+            stats['greedy_km'] = route_length(distances, tour.nearest_neighbour())
+            stats['optimized_km'] = route_length(distances, optimized)
+            results[f'order_stops ({count} stops)'] = stats
+            self.stderr.write(
+                f"{count} stops: nearest neighbour {stats['greedy_km']:.1f} km, "
+                f"optimized {stats['optimized_km']:.1f} km"
+            )
+        return results
@@ -0,0 +1,41 @@
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory
+
+from routes.models import DropOffLocation, NavigationSession, PickUpLocation
+from routes.state_machine import NAVIGATE, RESET, SELECT_PICKUP, advance, apply_transition, resolve
+
+from ._benchmark import BenchmarkCommand, summarize, time_calls
+
+
+class Command(BenchmarkCommand):
+    help = 'Micro-benchmark navigation state transitions (table lookup and conditional UPDATE).'
+
+    def run_benchmarks(self, iterations, **options):
+        pickup = PickUpLocation.objects.create(name='Bench Pickup', latitude=37.7749, longitude=-122.4194)
+        dropoff = DropOffLocation.objects.create(name='Bench Dropoff', latitude=37.7849, longitude=-122.4094)
+        session = SessionStore()
+        session.create()
+        request = RequestFactory().post('/')
+        request.session = session
+        nav_session = NavigationSession.objects.create(
+            session_key=session.session_key, pickup=pickup, dropoff=dropoff, state='pickup_selected'
+        )
+
+        def in_memory():
+            nav_session.state = 'pickup_selected'
+            advance(nav_session, NAVIGATE)
+
+        def persisted():
+            # One load and three conditional UPDATEs per call
+            request._navigation_session = None
+            apply_transition(request, SELECT_PICKUP, pickup=pickup)
+            apply_transition(request, NAVIGATE)
+            apply_transition(request, RESET)
+
+        return {
+            'resolve (table lookup)': summarize(time_calls(
+                lambda: resolve('navigated_to_pickup', NAVIGATE, True), iterations
+            )),
+            'advance (in memory)': summarize(time_calls(in_memory, iterations)),
+            'apply_transition x3 (database)': summarize(time_calls(persisted, iterations)),
+        }
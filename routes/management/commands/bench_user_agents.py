@@ -0,0 +1,89 @@
+import re
+
+from routes.devices import _classify, classify_user_agent, clear_cache
+
+from ._benchmark import BenchmarkCommand, summarize, time_calls
+
+# Representative User-Agents seen from drivers' phones and dispatch desktops
+USER_AGENTS = [
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/124.0.6367.82 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 13; SM-A536B) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/123.0.6312.118 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 12; Redmi Note 11) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/120.0.6099.230 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 13; SM-G991B; wv) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Version/4.0 Chrome/124.0.6367.82 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 14; SM-S918B Build/UP1A.231005.007; wv) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Version/4.0 Chrome/124.0.6367.82 Mobile Safari/537.36 '
+    '[FB_IAB/FB4A;FBAV/460.0.0.48.109;]',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4_1 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) Version/17.4.1 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) CriOS/124.0.6367.88 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) Mobile/15E148 Instagram 327.0.0.29.90',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_3 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/124.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/124.0.0.0 Safari/537.36 Edg/124.0.2478.67',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/17.4.1 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0',
+    'Mozilla/5.0 (Windows Phone 10.0; Android 6.0.1; Microsoft; Lumia 950) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/52.0.2743.116 Mobile Safari/537.36 Edge/15.15063',
+    'Opera/9.80 (J2ME/MIDP; Opera Mini/9.80 (S60; SymbOS; Opera Mobi/23.348; U; en) Presto/2.5.25 Version/10.54',
+    'Mozilla/5.0 (BlackBerry; U; BlackBerry 9900; en) AppleWebKit/534.11+ (KHTML, like Gecko) '
+    'Version/7.1.0.346 Mobile Safari/534.11+',
+    'curl/8.5.0',
+    '',
+]
+
+_LEGACY_PATTERNS = [
+    r'mobile', r'android', r'iphone', r'ipad', r'ipod',
+    r'blackberry', r'windows phone', r'opera mini'
+]
+
+
+def legacy_is_mobile(user_agent):
+    """The previous per-request detector: lowercase plus up to eight re.search calls."""
+    user_agent = user_agent.lower()
+    return any(re.search(pattern, user_agent) for pattern in _LEGACY_PATTERNS)
+
+
+class Command(BenchmarkCommand):
+    help = 'Benchmark User-Agent classification over a corpus of real User-Agent strings.'
+    uses_database = False
+    default_iterations = 2000
+
+    def run_benchmarks(self, iterations, **options):
+        def cycle(func):
+            position = 0
+
+            def call():
+                nonlocal position
+                func(USER_AGENTS[position % len(USER_AGENTS)])
+                position += 1
+            return call
+
+        def cold():
+            # Every User-Agent is new: a cache miss, plus storing the result
+            unseen = iter([
+                f'{USER_AGENTS[position % len(USER_AGENTS)]} build/{position}' for position in range(iterations)
+            ])
+            return lambda: classify_user_agent(next(unseen))
+
+        clear_cache()
+        results = {
+            'legacy re.search loop': summarize(time_calls(cycle(legacy_is_mobile), iterations)),
+            'token lookup (uncached)': summarize(time_calls(cycle(_classify), iterations)),
+            'token lookup (cold LRU cache)': summarize(time_calls(cold(), iterations)),
+        }
+        clear_cache()
+        classify_user_agent('')
+        results['token lookup (warm LRU cache)'] = summarize(time_calls(cycle(classify_user_agent), iterations))
+        return results
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from routes.cleanup import BATCH_PAUSE, BATCH_SIZE, compact, delete_stale_sessions, stale_condition
+from routes.models import NavigationSession
+
+
+class Command(BaseCommand):
+    help = ('Delete orphaned, completed and idle navigation sessions (with their route stops) '
+            'in small batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Sessions deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=BATCH_PAUSE,
+                            help='Seconds to wait between batches.')
+        parser.add_argument('--max-batches', type=int,
+                            help='Stop after this many batches (default: until none are left).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the stale sessions.')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='Compact the database afterwards (SQLite VACUUM locks it meanwhile).')
+
+    def handle(self, **options):
+        if options['dry_run']:
+            count = NavigationSession.objects.filter(stale_condition()).count()
+            self.stdout.write(f'{count} stale navigation sessions.')
+            return
+
+        result = delete_stale_sessions(options['batch_size'], options['pause'], options['max_batches'])
+        reclaimed = 'unknown' if result.bytes_reclaimed is None else f'{result.bytes_reclaimed} bytes'
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {result.sessions} navigation sessions and {result.route_stops} route stops; '
+            f'reclaimed {reclaimed}.'
+        ))
+        if options['vacuum']:
+            compact()
+            self.stdout.write('Database compacted.')
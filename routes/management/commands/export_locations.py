@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from routes.bulk import CSV, FORMATS, iter_export
+from routes.models import LOCATION_MODELS
+
+
+class Command(BaseCommand):
+    help = 'Stream pickup or dropoff locations as CSV or GeoJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('location_type', choices=sorted(LOCATION_MODELS))
+        parser.add_argument('--format', choices=FORMATS, default=CSV)
+        parser.add_argument('--output', '-o', help='Write to this file instead of standard output.')
+
+    def handle(self, location_type, **options):
+        chunks = iter_export(LOCATION_MODELS[location_type].objects.all(), options['format'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as fh:
+                fh.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
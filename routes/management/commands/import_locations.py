@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from routes.bulk import BATCH_SIZE, FORMATS, ImportFileError, detect_format, import_locations, iter_rows
+from routes.models import LOCATION_MODELS
+
+
+class Command(BaseCommand):
+    help = 'Bulk import pickup or dropoff locations from a CSV or GeoJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('location_type', choices=sorted(LOCATION_MODELS))
+        parser.add_argument('path', help="File to import, or '-' for standard input.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Input format (default: guessed from the file name).')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Rows inserted per bulk_create.')
+
+    def handle(self, location_type, path, **options):
+        model = LOCATION_MODELS[location_type]
+        file_format = options['format'] or detect_format(path)
+
+        try:
+            if path == '-':
+                result = import_locations(model, iter_rows(sys.stdin, file_format), options['batch_size'])
+            else:
+                try:
+                    fh = open(path, encoding='utf-8-sig', newline='')
+                except OSError as exc:
+                    raise CommandError(f'Cannot read {path}: {exc}')
+                with fh:
+                    result = import_locations(model, iter_rows(fh, file_format), options['batch_size'])
+        except ImportFileError as exc:
+            raise CommandError(f'{exc} Imported {exc.result.created} {location_type} locations before the error.')
+
+        for row, error in result.errors:
+            self.stderr.write(f'Row {row}: {error}')
+        if result.failed > len(result.errors):
+            self.stderr.write(f'... and {result.failed - len(result.errors)} more invalid rows.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.created} {location_type} locations; skipped {result.failed}.'
+        ))
@@ -0,0 +1,34 @@
+import argparse
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from routes.eventlog import BATCH_SIZE, rollup
+
+
+def _moment(value):
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid date and time {value!r}; use ISO 8601, e.g. 2024-05-01T13:00.')
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class Command(BaseCommand):
+    help = ('Roll up navigation events into per-hour, per-pickup duration histograms '
+            '(default: from the last rolled-up hour to the last complete hour).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=_moment,
+                            help='First hour to roll up (ISO 8601); earlier hours are left as they are.')
+        parser.add_argument('--until', type=_moment,
+                            help='Roll up the hours before this one (ISO 8601, default: the current hour).')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Rollup rows inserted per query.')
+
+    def handle(self, **options):
+        result = rollup(options['since'], options['until'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {result.hours} hours: {result.events} events read, {result.rollups} rollups written.'
+        ))
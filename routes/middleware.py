@@ -0,0 +1,157 @@
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.sessions import middleware as sessions
+from django.core.exceptions import MiddlewareNotUsed
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import instrumentation
+from .cleanup import start_periodic_cleanup
+from .instrumentation import measure
+from .stores import get_navigation_store
+from .utils import asave_navigation_session, navigation_cookie, save_navigation_session, set_navigate_urls_cookie
+
+
+class NavigationSessionMiddleware:
+    """
+    Flush the request's NavigationSession once, after the view has run.
+
+    Must be placed after SessionMiddleware. Changes made by a view that
+    crashed (5xx) are discarded. With a stateless navigation store the state
+    is sent back in its signed cookie instead; otherwise Maps URLs waiting to
+    be opened are sent in their own short-lived cookie. Supports both sync
+    and async requests. Starts the periodic stale-session cleanup, if
+    configured, in processes that serve requests.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        start_periodic_cleanup()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if response.status_code < 500:
+            with measure('session'):
+                save_navigation_session(request)
+            self.set_cookie(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if response.status_code < 500:
+            with measure('session'):
+                await asave_navigation_session(request)
+            self.set_cookie(request, response)
+        return response
+
+    @staticmethod
+    def set_cookie(request, response):
+        store = get_navigation_store()
+        if not store.stateless:
+            set_navigate_urls_cookie(request, response)
+            return
+        value = navigation_cookie(request)
+        if value is not None:
+            response.set_cookie(
+                store.cookie_name, value,
+                max_age=store.max_age,
+                path=settings.SESSION_COOKIE_PATH,
+                domain=settings.SESSION_COOKIE_DOMAIN,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+
+
+class SessionMiddleware(sessions.SessionMiddleware):
+    """Django's SessionMiddleware, with the session save timed for instrumentation."""
+
+    def process_response(self, request, response):
+        with measure('session'):
+            return super().process_response(request, response)
+
+
+class InstrumentationMiddleware:
+    """
+    Time a sample of requests; see routes.instrumentation.
+
+    Enabled by ``ROUTES_INSTRUMENTATION_SAMPLE_RATE`` (0-1); with the default
+    of 0 Django drops the middleware. Place it first, so the timings cover the
+    whole middleware stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.sample_rate = float(getattr(settings, 'ROUTES_INSTRUMENTATION_SAMPLE_RATE', 0))
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        instrumentation.install()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        with instrumentation.sampled() as metrics:
+            response = self.get_response(request)
+        return self.report(request, response, metrics)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        with instrumentation.sampled() as metrics:
+            response = await self.get_response(request)
+        return self.report(request, response, metrics)
+
+    @staticmethod
+    def report(request, response, metrics):
+        timings = metrics.finish()
+        match = request.resolver_match
+        view_name = match.view_name if match else None
+        response['Server-Timing'] = instrumentation.server_timing(timings, metrics.queries)
+        instrumentation.log_request(request, view_name, response.status_code, timings, metrics.queries)
+        # Histograms cover the app's own URLs, so their number stays bounded
+        if match and match.app_name == 'routes':
+            instrumentation.histograms.record(view_name, timings, metrics.queries)
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise middleware that also supports async requests.
+
+    WhiteNoise's own middleware is sync-only, which makes Django run every
+    request under ASGI (not only static files) through a worker thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:45
+
+from django.db import migrations, models
+
+from routes.geo import encode_geohash
+
+
+def backfill_geohash(apps, schema_editor):
+    for model_name in ('PickUpLocation', 'DropOffLocation'):
+        model = apps.get_model('routes', model_name)
+        batch = []
+        for location in model.objects.only('latitude', 'longitude').iterator():
+            location.geohash = encode_geohash(location.latitude, location.longitude)
+            batch.append(location)
+            if len(batch) >= 500:
+                model.objects.bulk_update(batch, ['geohash'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dropofflocation',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='pickuplocation',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
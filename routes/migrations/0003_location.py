@@ -0,0 +1,182 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:58
+
+import django.db.models.deletion
+from django.core.management.color import no_style
+from django.db import migrations, models
+
+PICKUP = 1
+DROPOFF = 2
+BATCH_SIZE = 500
+
+
+def _copy(Location, rows):
+    # auto_now_add overwrites created_at on insert, so restore it afterwards
+    created = [row.created_at for row in rows]
+    Location.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    for row, created_at in zip(rows, created):
+        row.created_at = created_at
+    Location.objects.bulk_update(rows, ['created_at'], batch_size=BATCH_SIZE)
+
+
+def merge_locations(apps, schema_editor):
+    """
+    Copy both location tables into routes_location.
+
+    Pickups keep their ids. Dropoffs get new ids after the last pickup,
+    except dropoffs identical to a pickup (same name and coordinates),
+    which become that row with both role bits set.
+    """
+    PickUpLocation = apps.get_model('routes', 'PickUpLocation')
+    DropOffLocation = apps.get_model('routes', 'DropOffLocation')
+    Location = apps.get_model('routes', 'Location')
+    NavigationSession = apps.get_model('routes', 'NavigationSession')
+
+    locations = {}
+    by_point = {}
+    for pickup in PickUpLocation.objects.order_by('id').iterator():
+        location = Location(
+            id=pickup.id, name=pickup.name, latitude=pickup.latitude, longitude=pickup.longitude,
+            geohash=pickup.geohash, role=PICKUP, created_at=pickup.created_at,
+        )
+        locations[location.id] = location
+        by_point.setdefault((pickup.name, pickup.latitude, pickup.longitude), location)
+
+    next_id = max(locations, default=0) + 1
+    dropoff_ids = {}
+    for dropoff in DropOffLocation.objects.order_by('id').iterator():
+        location = by_point.get((dropoff.name, dropoff.latitude, dropoff.longitude))
+        if location is not None and not location.role & DROPOFF:
+            location.role |= DROPOFF
+        else:
+            location = Location(
+                id=next_id, name=dropoff.name, latitude=dropoff.latitude, longitude=dropoff.longitude,
+                geohash=dropoff.geohash, role=DROPOFF, created_at=dropoff.created_at,
+            )
+            locations[location.id] = location
+            next_id += 1
+        dropoff_ids[dropoff.id] = location.id
+
+    _copy(Location, list(locations.values()))
+
+    # Explicit ids do not advance sequences (PostgreSQL); reset them
+    with schema_editor.connection.cursor() as cursor:
+        for sql in schema_editor.connection.ops.sequence_reset_sql(no_style(), [Location]):
+            cursor.execute(sql)
+
+    sessions = []
+    for nav_session in NavigationSession.objects.only('pickup_id', 'dropoff_id').iterator():
+        nav_session.pickup_location_id = nav_session.pickup_id
+        nav_session.dropoff_location_id = dropoff_ids.get(nav_session.dropoff_id)
+        sessions.append(nav_session)
+    NavigationSession.objects.bulk_update(
+        sessions, ['pickup_location', 'dropoff_location'], batch_size=BATCH_SIZE
+    )
+
+    # PostgreSQL foreign keys are DEFERRABLE INITIALLY DEFERRED, so the UPDATEs
+    # leave trigger events pending until commit, and the ALTER TABLEs below
+    # would fail on them. Checking the constraints now clears them.
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0002_location_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('geohash', models.CharField(default='', editable=False, max_length=12)),
+                ('role', models.PositiveSmallIntegerField(choices=[(1, 'Pickup'), (2, 'Dropoff'), (3, 'Pickup and dropoff')], default=3)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Location',
+                'verbose_name_plural': 'Locations',
+                'ordering': ['-created_at'],
+                'indexes': [
+                    models.Index(fields=['role', 'created_at'], name='routes_location_role_created'),
+                    models.Index(fields=['role', 'geohash'], name='routes_location_role_geohash'),
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name='navigationsession',
+            name='pickup_location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='routes.location'),
+        ),
+        migrations.AddField(
+            model_name='navigationsession',
+            name='dropoff_location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='routes.location'),
+        ),
+        migrations.RunPython(merge_locations, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='navigationsession',
+            name='pickup',
+        ),
+        migrations.RemoveField(
+            model_name='navigationsession',
+            name='dropoff',
+        ),
+        migrations.DeleteModel(
+            name='PickUpLocation',
+        ),
+        migrations.DeleteModel(
+            name='DropOffLocation',
+        ),
+        migrations.CreateModel(
+            name='PickUpLocation',
+            fields=[],
+            options={
+                'verbose_name': 'Pickup Location',
+                'verbose_name_plural': 'Pickup Locations',
+                'ordering': ['-created_at'],
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('routes.location',),
+        ),
+        migrations.CreateModel(
+            name='DropOffLocation',
+            fields=[],
+            options={
+                'verbose_name': 'Dropoff Location',
+                'verbose_name_plural': 'Dropoff Locations',
+                'ordering': ['-created_at'],
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('routes.location',),
+        ),
+        migrations.RenameField(
+            model_name='navigationsession',
+            old_name='pickup_location',
+            new_name='pickup',
+        ),
+        migrations.RenameField(
+            model_name='navigationsession',
+            old_name='dropoff_location',
+            new_name='dropoff',
+        ),
+        migrations.AlterField(
+            model_name='navigationsession',
+            name='pickup',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pickup_sessions', to='routes.pickuplocation'),
+        ),
+        migrations.AlterField(
+            model_name='navigationsession',
+            name='dropoff',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dropoff_sessions', to='routes.dropofflocation'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0003_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteStop',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40)),
+                ('position', models.PositiveIntegerField()),
+                ('parcel', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('pickup', 'Pickup'), ('dropoff', 'Dropoff')], max_length=10)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_stops', to='routes.location')),
+            ],
+            options={
+                'verbose_name': 'Route Stop',
+                'verbose_name_plural': 'Route Stops',
+                'ordering': ['session_key', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('session_key', 'position'), name='routes_routestop_unique_position')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0004_routestop'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NavigationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40)),
+                ('event', models.PositiveSmallIntegerField(choices=[(0, 'Select pickup'), (1, 'Select dropoff'), (2, 'Navigate'), (3, 'View'), (4, 'Reset'), (5, 'Dispatch')])),
+                ('state', models.PositiveSmallIntegerField(choices=[(0, 'No Selection'), (1, 'Pickup Selected'), (2, 'Navigated to Pickup'), (3, 'Dropoff Selected'), (4, 'Navigated to Dropoff'), (5, 'Completed')])),
+                ('at', models.DateTimeField()),
+                ('dropoff', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='routes.location')),
+                ('pickup', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='routes.location')),
+            ],
+            options={
+                'verbose_name': 'Navigation Event',
+                'verbose_name_plural': 'Navigation Events',
+                'indexes': [models.Index(fields=['at'], name='routes_navevent_at'), models.Index(fields=['session_key', 'at'], name='routes_navevent_session_at')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TransitionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('from_state', models.PositiveSmallIntegerField(choices=[(0, 'No Selection'), (1, 'Pickup Selected'), (2, 'Navigated to Pickup'), (3, 'Dropoff Selected'), (4, 'Navigated to Dropoff'), (5, 'Completed')])),
+                ('to_state', models.PositiveSmallIntegerField(choices=[(0, 'No Selection'), (1, 'Pickup Selected'), (2, 'Navigated to Pickup'), (3, 'Dropoff Selected'), (4, 'Navigated to Dropoff'), (5, 'Completed')])),
+                ('count', models.PositiveIntegerField()),
+                ('total_seconds', models.FloatField()),
+                ('max_seconds', models.FloatField()),
+                ('histogram', models.JSONField()),
+                ('pickup', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='routes.location')),
+            ],
+            options={
+                'verbose_name': 'Transition Rollup',
+                'verbose_name_plural': 'Transition Rollups',
+                'ordering': ['hour'],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'pickup', 'from_state', 'to_state'), name='routes_rollup_unique_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0005_navigationevent_transitionrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='navigationsession',
+            index=models.Index(fields=['created_at'], name='routes_navsession_created'),
+        ),
+        migrations.AddIndex(
+            model_name='navigationsession',
+            index=models.Index(fields=['updated_at'], name='routes_navsession_updated'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:35
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def drop_duplicate_sessions(apps, schema_editor):
+    """
+    Keep one NavigationSession per session key, the most recently updated.
+
+    Concurrent first requests could create duplicates before session_key
+    was unique.
+    """
+    NavigationSession = apps.get_model('routes', 'NavigationSession')
+    duplicated = (
+        NavigationSession.objects.values('session_key')
+        .annotate(rows=Count('id')).filter(rows__gt=1).values_list('session_key', flat=True)
+    )
+    for session_key in duplicated.iterator():
+        rows = NavigationSession.objects.filter(session_key=session_key).order_by('-updated_at', '-id')
+        NavigationSession.objects.filter(pk__in=list(rows.values_list('pk', flat=True)[1:])).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0006_navigationsession_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_sessions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='navigationsession',
+            name='session_key',
+            field=models.CharField(max_length=40, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['created_at'], name='routes_location_created'),
+        ),
+        migrations.AddIndex(
+            model_name='navigationsession',
+            index=models.Index(fields=['state', 'updated_at'], name='routes_navsession_state_upd'),
+        ),
+    ]
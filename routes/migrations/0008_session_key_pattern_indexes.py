@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# (table, index) pairs; navigation sessions already get one, Django creates
+# a "_like" index for every indexed CharField on PostgreSQL
+PATTERN_INDEXES = [
+    ('routes_routestop', 'routes_routestop_key_like'),
+    ('routes_navigationevent', 'routes_navevent_key_like'),
+]
+
+
+def create_pattern_indexes(apps, schema_editor):
+    """
+    Index session keys for ``LIKE 'prefix%'`` on PostgreSQL.
+
+    Locale collations do not order strings by code point, so the admin's
+    prefix search is a LIKE there, which only a pattern_ops index answers.
+    Other databases search by range on their existing indexes.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    quote = schema_editor.quote_name
+    for table, index in PATTERN_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX {quote(index)} ON {quote(table)} ({quote("session_key")} varchar_pattern_ops)'
+        )
+
+
+def drop_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _table, index in PATTERN_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(index)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0007_session_key_unique_and_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pattern_indexes, drop_pattern_indexes),
+    ]
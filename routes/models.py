@@ -1,37 +1,162 @@
-from django.db import models
+from django.db import models, transaction
 
+from .geo import encode_geohash
+
+
+class Location(models.Model):
+    """
+    A point that can be used as a pickup, a dropoff or both.
+
+    ``role`` is a bitmask of PICKUP and DROPOFF. ``PickUpLocation`` and
+    ``DropOffLocation`` are proxies whose managers only return locations
+    with their role bit set.
+    """
+    PICKUP = 1
+    DROPOFF = 2
+    ROLE_CHOICES = [
+        (PICKUP, 'Pickup'),
+        (DROPOFF, 'Dropoff'),
+        (PICKUP | DROPOFF, 'Pickup and dropoff'),
+    ]
 
-class PickUpLocation(models.Model):
-    """Model for storing pickup locations."""
     name = models.CharField(max_length=200)
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    geohash = models.CharField(max_length=12, editable=False, default='')
+    role = models.PositiveSmallIntegerField(choices=ROLE_CHOICES, default=PICKUP | DROPOFF)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Role bit given to new instances of a proxy; None keeps the field default
+    default_role = None
+
     class Meta:
         ordering = ['-created_at']
-        verbose_name = 'Pickup Location'
-        verbose_name_plural = 'Pickup Locations'
+        verbose_name = 'Location'
+        verbose_name_plural = 'Locations'
+        indexes = [
+            # Keyset pages per role: WHERE role IN (...) ORDER BY created_at, id
+            models.Index(fields=['role', 'created_at'], name='routes_location_role_created'),
+            # Nearest search per role: WHERE role IN (...) AND geohash range
+            models.Index(fields=['role', 'geohash'], name='routes_location_role_geohash'),
+            # Admin and other lists of every role: ORDER BY created_at
+            models.Index(fields=['created_at'], name='routes_location_created'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        # Rows loaded from the database pass positional values; only new
+        # instances get the proxy's role (this also covers bulk_create)
+        if self.default_role is not None and not args and 'role' not in kwargs:
+            kwargs['role'] = self.default_role
+        super().__init__(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
 
-class DropOffLocation(models.Model):
-    """Model for storing dropoff locations."""
-    name = models.CharField(max_length=200)
-    latitude = models.DecimalField(max_digits=9, decimal_places=6)
-    longitude = models.DecimalField(max_digits=9, decimal_places=6)
-    created_at = models.DateTimeField(auto_now_add=True)
+    def delete(self, *args, **kwargs):
+        # Deleting through a role proxy only drops that role from a shared point
+        if self.default_role is not None and self.role & ~self.default_role:
+            with transaction.atomic():
+                type(self).objects.filter(pk=self.pk)._clear_sessions()
+                self.role &= ~self.default_role
+                self.save(update_fields=['role'])
+            return 0, {}
+        return super().delete(*args, **kwargs)
+
+    @property
+    def is_pickup(self):
+        return bool(self.role & self.PICKUP)
+
+    @property
+    def is_dropoff(self):
+        return bool(self.role & self.DROPOFF)
+
+
+def roles_with(bit):
+    """Return every role value that includes ``bit``."""
+    return [value for value, _label in Location.ROLE_CHOICES if value & bit]
+
+
+class LocationRoleQuerySet(models.QuerySet):
+    """
+    QuerySet of a role proxy.
+
+    ``delete()`` only drops the proxy's role from locations that have the
+    other one too, like ``Location.delete``, and deletes the rest.
+    Navigation sessions lose their reference to every matched location in
+    that role either way, as SET_NULL would.
+    """
+
+    def _clear_sessions(self):
+        field = self.model.session_field
+        return NavigationSession.objects.filter(**{f'{field}__in': self.values('pk')}).update(**{field: None})
+
+    def delete(self):
+        role = self.model.default_role
+        both = Location.PICKUP | Location.DROPOFF
+        with transaction.atomic(using=self.db):
+            self._clear_sessions()
+            deleted = Location._base_manager.using(self.db).filter(pk__in=self.values('pk'), role=role).delete()
+            dropped = (
+                Location._base_manager.using(self.db).filter(pk__in=self.values('pk'), role=both)
+                .update(role=both & ~role)
+            )
+        if dropped:
+            # update() sends no signals, so the location caches are told here.
+            # Imported here: routes.distances imports this module
+            from .distances import locations_changed
+            locations_changed()
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class LocationRoleManager(models.Manager.from_queryset(LocationRoleQuerySet)):
+    """Manager limited to locations that have a role bit set."""
+
+    def __init__(self, role):
+        super().__init__()
+        self.role = role
+
+    def get_queryset(self):
+        return super().get_queryset().filter(role__in=roles_with(self.role))
+
+
+class PickUpLocation(Location):
+    """Locations usable as a pickup."""
+    default_role = Location.PICKUP
+    # NavigationSession field referencing locations in this role
+    session_field = 'pickup'
+
+    objects = LocationRoleManager(Location.PICKUP)
+
+    class Meta:
+        proxy = True
+        ordering = ['-created_at']
+        verbose_name = 'Pickup Location'
+        verbose_name_plural = 'Pickup Locations'
+
+
+class DropOffLocation(Location):
+    """Locations usable as a dropoff."""
+    default_role = Location.DROPOFF
+    session_field = 'dropoff'
+
+    objects = LocationRoleManager(Location.DROPOFF)
 
     class Meta:
+        proxy = True
         ordering = ['-created_at']
         verbose_name = 'Dropoff Location'
         verbose_name_plural = 'Dropoff Locations'
 
-    def __str__(self):
-        return self.name
-
 
 class NavigationSession(models.Model):
     """Model for tracking navigation state and selections per session."""
@@ -44,18 +169,20 @@ class NavigationSession(models.Model):
         ('completed', 'Completed'),
     ]
 
-    session_key = models.CharField(max_length=40, db_index=True)
+    session_key = models.CharField(max_length=40, unique=True)
     pickup = models.ForeignKey(
         PickUpLocation,
         on_delete=models.SET_NULL,
         null=True,
-        blank=True
+        blank=True,
+        related_name='pickup_sessions'
     )
     dropoff = models.ForeignKey(
         DropOffLocation,
         on_delete=models.SET_NULL,
         null=True,
-        blank=True
+        blank=True,
+        related_name='dropoff_sessions'
     )
     state = models.CharField(
         max_length=20,
@@ -65,10 +192,168 @@ class NavigationSession(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Fields whose changes are written back by save_navigation_session()
+    TRACKED_FIELDS = ('pickup', 'dropoff', 'state')
+
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Navigation Session'
         verbose_name_plural = 'Navigation Sessions'
+        indexes = [
+            # Admin changelist order and date hierarchy
+            models.Index(fields=['created_at'], name='routes_navsession_created'),
+            # Idle session cleanup and the live dashboard
+            models.Index(fields=['updated_at'], name='routes_navsession_updated'),
+            # Completed session cleanup: WHERE state IN (...) AND updated_at < ...
+            models.Index(fields=['state', 'updated_at'], name='routes_navsession_state_upd'),
+        ]
 
     def __str__(self):
         return f"Session {self.session_key[:8]}... - {self.get_state_display()}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.mark_clean()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.mark_clean()
+
+    def mark_clean(self):
+        """Record the current tracked values as persisted."""
+        self._loaded_values = self._tracked_values()
+
+    @property
+    def loaded_state(self):
+        """State as last loaded from or written to storage."""
+        loaded = getattr(self, '_loaded_values', None)
+        return loaded['state'] if loaded else None
+
+    def _tracked_values(self):
+        return {
+            name: getattr(self, self._meta.get_field(name).attname)
+            for name in self.TRACKED_FIELDS
+        }
+
+    def changed_fields(self):
+        """Return the tracked fields modified since the row was loaded or saved."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return list(self.TRACKED_FIELDS)
+        current = self._tracked_values()
+        return [name for name in self.TRACKED_FIELDS if current[name] != loaded[name]]
+
+
+class RouteStop(models.Model):
+    """
+    One stop of a multi-stop route, in visiting order.
+
+    Stops of the same ``parcel`` form a pickup/dropoff pair; the pickup is
+    always ordered before the dropoff. Routes are keyed by session key, like
+    NavigationSession, so they work with every navigation store.
+    """
+    PICKUP = 'pickup'
+    DROPOFF = 'dropoff'
+    KIND_CHOICES = [
+        (PICKUP, 'Pickup'),
+        (DROPOFF, 'Dropoff'),
+    ]
+
+    session_key = models.CharField(max_length=40)
+    position = models.PositiveIntegerField()
+    parcel = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='route_stops')
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['session_key', 'position']
+        verbose_name = 'Route Stop'
+        verbose_name_plural = 'Route Stops'
+        constraints = [
+            models.UniqueConstraint(fields=['session_key', 'position'], name='routes_routestop_unique_position'),
+        ]
+
+    def __str__(self):
+        return f"Stop {self.position + 1}: {self.get_kind_display()} {self.location}"
+
+
+class NavigationEvent(models.Model):
+    """
+    One applied state transition; rows are only ever inserted (routes.eventlog).
+
+    States and events are stored as small integer codes, the index in
+    ``STATES`` and ``EVENTS``, to keep the rows narrow. New names must be
+    appended so existing codes keep their meaning. Locations are referenced
+    without a foreign key constraint, so deleting one leaves its events alone.
+    """
+    STATES = tuple(state for state, _label in NavigationSession.STATE_CHOICES)
+    EVENTS = ('select_pickup', 'select_dropoff', 'navigate', 'view', 'reset', 'dispatch')
+    STATE_CHOICES = [(code, label) for code, (_state, label) in enumerate(NavigationSession.STATE_CHOICES)]
+    EVENT_CHOICES = [(code, event.replace('_', ' ').capitalize()) for code, event in enumerate(EVENTS)]
+
+    session_key = models.CharField(max_length=40)
+    event = models.PositiveSmallIntegerField(choices=EVENT_CHOICES)
+    state = models.PositiveSmallIntegerField(choices=STATE_CHOICES)
+    pickup = models.ForeignKey(
+        Location, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    dropoff = models.ForeignKey(
+        Location, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Navigation Event'
+        verbose_name_plural = 'Navigation Events'
+        indexes = [
+            # Rollups read a time range
+            models.Index(fields=['at'], name='routes_navevent_at'),
+            # One session's history, in order
+            models.Index(fields=['session_key', 'at'], name='routes_navevent_session_at'),
+        ]
+
+    def __str__(self):
+        return f"Session {self.session_key[:8]}... - {self.get_event_display()} -> {self.get_state_display()}"
+
+
+class TransitionRollup(models.Model):
+    """
+    Durations between two navigation states, per hour and pickup location.
+
+    Built from NavigationEvent rows by ``routes.eventlog.rollup``. ``hour`` is
+    the hour the end state was entered; ``histogram`` holds counts per
+    ``routes.eventlog.DURATION_BUCKETS`` bucket, plus one for longer durations.
+    """
+    hour = models.DateTimeField()
+    pickup = models.ForeignKey(
+        Location, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    from_state = models.PositiveSmallIntegerField(choices=NavigationEvent.STATE_CHOICES)
+    to_state = models.PositiveSmallIntegerField(choices=NavigationEvent.STATE_CHOICES)
+    count = models.PositiveIntegerField()
+    total_seconds = models.FloatField()
+    max_seconds = models.FloatField()
+    histogram = models.JSONField()
+
+    class Meta:
+        ordering = ['hour']
+        verbose_name = 'Transition Rollup'
+        verbose_name_plural = 'Transition Rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'pickup', 'from_state', 'to_state'], name='routes_rollup_unique_bucket'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.get_from_state_display()} -> {self.get_to_state_display()}"
+
+
+# Location models by the location_type used in URLs and templates
+LOCATION_MODELS = {
+    'pickup': PickUpLocation,
+    'dropoff': DropOffLocation,
+}
@@ -0,0 +1,194 @@
+"""
+Fragment caching and conditional GET for the location and navigate pages.
+
+Rendered location-card pages are cached in the Django cache alias from
+``ROUTES_PAGE_CACHE`` (default ``'default'``) for ``ROUTES_PAGE_CACHE_TIMEOUT``
+seconds. Their keys include the shared ``locations`` version
+(routes.versions), so a location save or delete makes every cached page
+unreachable at once; nothing is deleted key by key.
+
+Both depend on the version reaching every worker: when the version cache is
+not shared (``routes.versions.is_shared()``), cards are rendered on every
+request and pages get no validators.
+
+Full pages are not cached on the server: each navigate page belongs to one
+session, so the browser's copy is the useful one. Instead the views send an
+ETag (and Last-Modified) built from everything the page depends on, and a
+repeat load answers ``304 Not Modified`` without rendering.
+"""
+import hashlib
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .pagination import paginate_keyset
+from .state_machine import VIEW, resolve
+from .utils import (
+    aget_or_create_navigation_session, detect_platform, get_or_create_navigation_session, has_navigate_urls,
+)
+from .versions import LOCATIONS, get_changed_at, get_version, is_shared
+
+DEFAULT_TIMEOUT = 600
+CARDS_TEMPLATE = 'routes/location_cards.html'
+KEY_PREFIX = 'routes:page:'
+
+
+def _template_files():
+    app = Path(__file__).resolve().parent
+    return sorted(
+        path for directory in (app / 'templates', app / 'static')
+        for path in directory.rglob('*') if path.is_file()
+    )
+
+
+def _digest_templates():
+    # A deploy that changes templates or assets must not be answered with
+    # pages (or 304s) rendered by the previous release
+    digest = hashlib.sha1()
+    modified = 0.0
+    for path in _template_files():
+        digest.update(str(path).encode())
+        digest.update(path.read_bytes())
+        modified = max(modified, path.stat().st_mtime)
+    return digest.hexdigest()[:12], datetime.fromtimestamp(modified, tz=dt_timezone.utc)
+
+
+TEMPLATE_DIGEST, TEMPLATES_MODIFIED = _digest_templates()
+
+# One page of location cards: the rows, the cursor of the next page and the HTML
+CardsPage = namedtuple('CardsPage', ['locations', 'next_cursor', 'html'])
+
+
+def _cache():
+    return caches[getattr(settings, 'ROUTES_PAGE_CACHE', 'default')]
+
+
+def _hash(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def render_cards(locations, location_type, current_selection, compact=False, origin=None):
+    """Render location cards to HTML."""
+    return render_to_string(CARDS_TEMPLATE, {
+        'locations': locations,
+        'location_type': location_type,
+        'current_selection': current_selection,
+        'compact': compact,
+        'origin': origin,
+    })
+
+
+def cards_page(queryset, location_type, cursor, current_selection, compact=False):
+    """
+    Return one keyset page of cards for ``queryset``, from the cache if possible.
+
+    The key covers everything the HTML depends on: the page, the selected
+    card, the layout, the locations version and the template digest.
+    """
+    if not is_shared():
+        # Another worker's location changes would never reach this cache
+        locations, next_cursor = paginate_keyset(queryset, cursor)
+        return CardsPage(locations, next_cursor, render_cards(locations, location_type, current_selection, compact))
+    key = KEY_PREFIX + 'cards:' + _hash(
+        location_type, cursor or '', current_selection, compact, get_version(LOCATIONS), TEMPLATE_DIGEST
+    )
+    page = _cache().get(key)
+    if page is None:
+        locations, next_cursor = paginate_keyset(queryset, cursor)
+        page = CardsPage(
+            locations, next_cursor, render_cards(locations, location_type, current_selection, compact)
+        )
+        _cache().set(key, page, getattr(settings, 'ROUTES_PAGE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return page
+
+
+def _cacheable(request):
+    # Pages showing flash messages, or rendered with a fresh CSRF token,
+    # differ from any earlier copy
+    return not len(messages.get_messages(request)) and 'CSRF_COOKIE' in request.META
+
+
+def page_etag(request, *args, **kwargs):
+    """ETag of a page that shows the request's selections and the location lists."""
+    if not _cacheable(request) or not is_shared():
+        return None
+    nav_session = get_or_create_navigation_session(request)
+    return '"%s"' % _hash(
+        TEMPLATE_DIGEST,
+        get_version(LOCATIONS),
+        nav_session.state,
+        nav_session.pickup_id,
+        nav_session.dropoff_id,
+        detect_platform(request),
+        request.get_full_path(),
+        # Pages embed a token masked from this secret; a new secret needs a new page
+        _hash(request.META['CSRF_COOKIE']),
+    )
+
+
+def navigate_etag(request, *args, **kwargs):
+    """ETag of the navigate page, or None when it must be rendered."""
+    if has_navigate_urls(request):
+        # A Maps link is waiting to be opened by this page
+        return None
+    nav_session = get_or_create_navigation_session(request)
+    if nav_session.pickup_id is None:
+        return None
+    if resolve(nav_session.state, VIEW, nav_session.dropoff_id is not None).next_state != nav_session.state:
+        # Rendering repairs the state and flashes a warning
+        return None
+    return page_etag(request)
+
+
+def page_last_modified(request):
+    """When the page's selections or locations last changed, or None if unknown."""
+    changed_at = get_changed_at(LOCATIONS)
+    updated_at = get_or_create_navigation_session(request).updated_at
+    if changed_at is None or updated_at is None:
+        return None
+    return max(changed_at, updated_at, TEMPLATES_MODIFIED)
+
+
+def conditional_page(etag_func):
+    """
+    Decorate a view with ETag/Last-Modified validation.
+
+    GET and HEAD requests whose validators match get a 304. Responses are
+    marked ``private, no-cache`` so browsers keep them but revalidate on
+    every load. The validators are sync; for async views the sessions they
+    read are loaded first.
+    """
+    def last_modified_func(request, *args, **kwargs):
+        # Only pages that have an ETag may be validated by date either
+        if etag_func(request, *args, **kwargs) is None:
+            return None
+        return page_last_modified(request)
+
+    def decorator(view_func):
+        view_func = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view_func)
+
+        def finish(request, response):
+            if request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def wrapper(request, *args, **kwargs):
+                await aget_or_create_navigation_session(request)
+                return finish(request, await view_func(request, *args, **kwargs))
+        else:
+            @wraps(view_func)
+            def wrapper(request, *args, **kwargs):
+                return finish(request, view_func(request, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,58 @@
+"""
+Keyset (cursor) pagination over ``(created_at, id)``.
+
+Locations are listed newest first, matching ``Meta.ordering``. The cursor
+encodes the last row of a page, so fetching the next page is a range scan
+that costs the same no matter how deep into the table the driver scrolls.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+PAGE_SIZE = 25
+
+
+def encode_cursor(obj):
+    """Encode the ordering key of ``obj`` as an opaque URL-safe cursor."""
+    raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by ``encode_cursor``.
+
+    Returns a (created_at, id) pair, or None for a missing or malformed cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def paginate_keyset(queryset, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return one page of ``queryset`` ordered by ``(-created_at, -id)``.
+
+    Returns:
+        tuple: (list of objects, cursor for the next page or None)
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    position = decode_cursor(cursor)
+    if position:
+        created_at, pk = position
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+
+    # Fetch one extra row to learn whether another page exists
+    rows = list(queryset[:page_size + 1])
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
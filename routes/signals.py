@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+
+from .distances import location_changed
+from .models import DropOffLocation, Location, PickUpLocation
+
+# Saves through a proxy are sent with the proxy as sender
+LOCATION_SENDERS = (Location, PickUpLocation, DropOffLocation)
+
+
+def update_location_snapshot(sender, instance, signal, **kwargs):
+    """Apply the change to the distance snapshot once it commits."""
+    location_changed(instance, deleted=signal is post_delete)
+
+
+for _sender in LOCATION_SENDERS:
+    for _signal in (post_save, post_delete):
+        _signal.connect(update_location_snapshot, sender=_sender)
@@ -0,0 +1,248 @@
+"""
+Declarative navigation state machine.
+
+Transitions of ``NavigationSession.state`` are declared once in ``RULES`` and
+expanded at import time into ``TRANSITIONS``, a flat table keyed by
+``(state, event, has_dropoff)``. Resolving a transition is a single dict
+lookup; applying it writes the changed fields with a conditional
+``UPDATE ... WHERE state = <old state>`` so that two concurrent taps from the
+same session cannot both advance it.
+"""
+from collections import namedtuple
+
+from .eventlog import record
+from .events import publish
+from .models import NavigationSession
+from .stores import get_navigation_store
+from .utils import aget_or_create_navigation_session, generate_maps_url, get_or_create_navigation_session
+
+# Events
+SELECT_PICKUP = 'select_pickup'
+SELECT_DROPOFF = 'select_dropoff'
+NAVIGATE = 'navigate'
+VIEW = 'view'
+RESET = 'reset'
+EVENTS = (SELECT_PICKUP, SELECT_DROPOFF, NAVIGATE, VIEW, RESET)
+
+# Navigation targets
+PICKUP = 'pickup'
+DROPOFF = 'dropoff'
+
+BUTTON_LABELS = {
+    PICKUP: 'Navigate to Pickup',
+    DROPOFF: 'Navigate to Dropoff',
+}
+
+STATES = tuple(code for code, _label in NavigationSession.STATE_CHOICES)
+
+ANY = '*'
+SAME = None
+
+# Number of times a transition is re-resolved after losing a race
+MAX_ATTEMPTS = 3
+# Events that are not replayed after losing a race: the winner was the same
+# tap (e.g. a double-tap), and replaying it would advance the flow twice
+NOT_REPLAYED = (NAVIGATE,)
+
+# (state, event, dropoff selected?) -> (next state, maps target, fields cleared)
+# First matching rule wins; ANY / None match everything. Unmatched events
+# leave the session unchanged.
+RULES = [
+    # Navigate button: open Maps for the target and advance
+    ('pickup_selected', NAVIGATE, None, 'navigated_to_pickup', PICKUP, ()),
+    ('navigated_to_pickup', NAVIGATE, True, 'navigated_to_dropoff', DROPOFF, ()),
+    ('dropoff_selected', NAVIGATE, True, 'navigated_to_dropoff', DROPOFF, ()),
+    ('navigated_to_dropoff', NAVIGATE, True, 'navigated_to_dropoff', DROPOFF, ()),
+    (ANY, NAVIGATE, None, 'navigated_to_pickup', PICKUP, ()),
+
+    # Rendering the navigate page: repair dropoff states whose dropoff was cleared
+    ('dropoff_selected', VIEW, False, 'navigated_to_pickup', SAME, ()),
+    ('navigated_to_dropoff', VIEW, False, 'navigated_to_pickup', SAME, ()),
+
+    # Selections: changing the pickup after the dropoff phase restarts the route
+    ('dropoff_selected', SELECT_PICKUP, None, 'pickup_selected', None, ('dropoff',)),
+    ('navigated_to_dropoff', SELECT_PICKUP, None, 'pickup_selected', None, ('dropoff',)),
+    ('no_selection', SELECT_PICKUP, None, 'pickup_selected', None, ()),
+    ('navigated_to_pickup', SELECT_DROPOFF, None, 'dropoff_selected', None, ()),
+
+    (ANY, RESET, None, 'no_selection', None, ('pickup', 'dropoff')),
+]
+
+Transition = namedtuple('Transition', ['next_state', 'target', 'button_label', 'clears'])
+
+
+class TransitionConflict(Exception):
+    """Raised when a transition keeps losing the race against concurrent writers."""
+
+
+def _match(state, event, has_dropoff):
+    for rule_state, rule_event, rule_dropoff, next_state, target, clears in RULES:
+        if rule_event != event or rule_state not in (ANY, state):
+            continue
+        if rule_dropoff is not None and rule_dropoff != has_dropoff:
+            continue
+        return (next_state or state), target, clears
+    return state, None, ()
+
+
+def _build_table():
+    keys = [(state, event, has_dropoff)
+            for state in STATES for event in EVENTS for has_dropoff in (False, True)]
+    matched = {key: _match(*key) for key in keys}
+
+    table = {}
+    for (state, event, has_dropoff), (next_state, target, clears) in matched.items():
+        dropoff_after = has_dropoff and 'dropoff' not in clears
+        # What the navigate button does once this transition has been applied
+        upcoming = matched[(next_state, NAVIGATE, dropoff_after)][1]
+        if event == VIEW:
+            target = upcoming
+        table[(state, event, has_dropoff)] = Transition(
+            next_state, target, BUTTON_LABELS[upcoming], clears
+        )
+    return table
+
+
+TRANSITIONS = _build_table()
+
+
+def resolve(state, event, has_dropoff):
+    """Look up the transition for ``event`` in ``state``."""
+    try:
+        return TRANSITIONS[(state, event, has_dropoff)]
+    except KeyError:
+        # Unknown (legacy or corrupt) state: treat as a fresh session
+        return TRANSITIONS[('no_selection', event, has_dropoff)]
+
+
+def advance(nav_session, event):
+    """Apply ``event`` to ``nav_session`` in memory and return the transition."""
+    transition = resolve(nav_session.state, event, nav_session.dropoff_id is not None)
+    for name in transition.clears:
+        setattr(nav_session, name, None)
+    nav_session.state = transition.next_state
+    return transition
+
+
+def transition_target(nav_session, transition):
+    """Return the location the transition's Maps target refers to."""
+    if transition.target == PICKUP:
+        return nav_session.pickup
+    if transition.target == DROPOFF:
+        return nav_session.dropoff
+    return None
+
+
+def navigate_plan(nav_session, platform):
+    """
+    Every navigate tap left in the session, worked out in advance.
+
+    Each step gives the state it starts from, the state it leads to and the
+    Maps links it opens, so a client can keep navigating without a
+    connection. The last step either completes the route or repeats itself.
+
+    Returns:
+        list: one dict per step
+    """
+    state_labels = dict(NavigationSession.STATE_CHOICES)
+    has_dropoff = nav_session.dropoff_id is not None
+    state = resolve(nav_session.state, VIEW, has_dropoff).next_state
+    steps = []
+    if nav_session.pickup_id is None:
+        return steps
+    while True:
+        transition = resolve(state, NAVIGATE, has_dropoff)
+        urls = generate_maps_url(transition_target(nav_session, transition), platform=platform)
+        steps.append({
+            'state': state,
+            'label': BUTTON_LABELS[transition.target],
+            'target': transition.target,
+            'open_url': urls['deep_link'],
+            'web_fallback': urls['web_fallback'],
+            'next_state': transition.next_state,
+            'next_state_display': state_labels.get(transition.next_state, transition.next_state),
+        })
+        if transition.next_state in (state, 'navigated_to_dropoff'):
+            return steps
+        state = transition.next_state
+
+
+def _replay(nav_session, steps):
+    transition = None
+    for event, changes in steps:
+        for name, value in changes.items():
+            setattr(nav_session, name, value)
+        transition = advance(nav_session, event)
+    return transition
+
+
+def _not_replayed(steps):
+    return any(event in NOT_REPLAYED for event, _changes in steps)
+
+
+def apply_transitions(request, steps):
+    """
+    Apply ``(event, field changes)`` steps to the request's NavigationSession.
+
+    Field changes of each step (e.g. ``{'pickup': location}``) are assigned
+    before its event is resolved. All changed fields are then written at once,
+    conditional on the stored state still being the state the steps were
+    resolved from. On conflict the session is reloaded; selection, view and
+    reset steps are replayed against it, but steps with a ``NOT_REPLAYED``
+    event are not: the reloaded session is returned with the transition that
+    was resolved, as the concurrent writer already applied it. Applied
+    changes are published as live events (routes.events) and appended to the
+    event log (routes.eventlog).
+
+    Returns:
+        tuple: (NavigationSession, last Transition applied)
+    """
+    store = get_navigation_store()
+    for _attempt in range(MAX_ATTEMPTS):
+        nav_session = get_or_create_navigation_session(request)
+        transition = _replay(nav_session, steps)
+
+        changed = nav_session.changed_fields()
+        if not changed:
+            return nav_session, transition
+        if store.save(nav_session, changed, expected_state=nav_session.loaded_state):
+            publish(nav_session, steps[-1][0])
+            record(nav_session, steps[-1][0])
+            return nav_session, transition
+
+        # Lost the race: drop the memoized copy and replay against fresh state
+        request._navigation_session = None
+        if _not_replayed(steps):
+            return get_or_create_navigation_session(request), transition
+    raise TransitionConflict('Navigation session changed concurrently; please retry.')
+
+
+def apply_transition(request, event, **changes):
+    """Apply a single event; see ``apply_transitions``."""
+    return apply_transitions(request, [(event, changes)])
+
+
+async def aapply_transitions(request, steps):
+    """Async version of ``apply_transitions``."""
+    store = get_navigation_store()
+    for _attempt in range(MAX_ATTEMPTS):
+        nav_session = await aget_or_create_navigation_session(request)
+        transition = _replay(nav_session, steps)
+
+        changed = nav_session.changed_fields()
+        if not changed:
+            return nav_session, transition
+        if await store.asave(nav_session, changed, expected_state=nav_session.loaded_state):
+            publish(nav_session, steps[-1][0])
+            record(nav_session, steps[-1][0])
+            return nav_session, transition
+
+        request._navigation_session = None
+        if _not_replayed(steps):
+            return await aget_or_create_navigation_session(request), transition
+    raise TransitionConflict('Navigation session changed concurrently; please retry.')
+
+
+async def aapply_transition(request, event, **changes):
+    """Async version of ``apply_transition``."""
+    return await aapply_transitions(request, [(event, changes)])
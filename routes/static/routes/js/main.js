@@ -14,37 +14,230 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     // Enhance location card selection with visual feedback
-    const locationCards = document.querySelectorAll('.location-card');
-    locationCards.forEach(function(card) {
-        card.addEventListener('click', function(e) {
-            // If clicking on the card but not the radio button, trigger the radio
-            if (e.target !== card.querySelector('input[type="radio"]')) {
-                const radio = card.querySelector('input[type="radio"]');
-                if (radio) {
-                    radio.checked = true;
-                    // Remove selected class from siblings
-                    const siblings = card.parentElement.querySelectorAll('.location-card');
-                    siblings.forEach(function(sibling) {
-                        sibling.classList.remove('selected');
-                    });
-                    card.classList.add('selected');
-                }
+    // (delegated so cards loaded by infinite scroll behave the same)
+    document.addEventListener('click', function(e) {
+        const card = e.target.closest('.location-card');
+        if (!card) {
+            return;
+        }
+        // If clicking on the card but not the radio button, trigger the radio
+        const radio = card.querySelector('input[type="radio"]');
+        if (radio && e.target !== radio) {
+            radio.checked = true;
+            // Remove selected class from siblings
+            const siblings = card.parentElement.querySelectorAll('.location-card');
+            siblings.forEach(function(sibling) {
+                sibling.classList.remove('selected');
+            });
+            card.classList.add('selected');
+        }
+    });
+
+    // Lazy-load further keyset pages of location cards as the list scrolls into view
+    const loadMoreLinks = document.querySelectorAll('.load-more[data-cursor]');
+    loadMoreLinks.forEach(function(link) {
+        const list = link.previousElementSibling;
+        if (!list || !list.dataset.pageUrl || !window.fetch || !window.IntersectionObserver) {
+            return;
+        }
+        let loading = false;
+
+        function loadNextPage() {
+            if (loading || !link.dataset.cursor) {
+                return;
             }
+            loading = true;
+            const url = new URL(list.dataset.pageUrl, window.location.href);
+            url.searchParams.set('cursor', link.dataset.cursor);
+            fetch(url.toString(), {headers: {'Accept': 'application/json'}})
+                .then(function(response) { return response.json(); })
+                .then(function(data) {
+                    list.insertAdjacentHTML('beforeend', data.html);
+                    if (data.next_cursor) {
+                        link.dataset.cursor = data.next_cursor;
+                    } else {
+                        observer.disconnect();
+                        link.remove();
+                    }
+                })
+                .finally(function() { loading = false; });
+        }
+
+        const observer = new IntersectionObserver(function(entries) {
+            if (entries.some(function(entry) { return entry.isIntersecting; })) {
+                loadNextPage();
+            }
+        }, {rootMargin: '200px'});
+        observer.observe(link);
+
+        link.addEventListener('click', function(e) {
+            e.preventDefault();
+            loadNextPage();
+        });
+    });
+
+    // "Nearest to me" links: reload the list sorted by distance from the device
+    const nearMeLinks = document.querySelectorAll('[data-near-me]');
+    nearMeLinks.forEach(function(link) {
+        if (!navigator.geolocation) {
+            link.style.display = 'none';
+            return;
+        }
+        link.addEventListener('click', function(e) {
+            e.preventDefault();
+            navigator.geolocation.getCurrentPosition(function(position) {
+                const url = new URL(link.href, window.location.href);
+                url.searchParams.set('lat', position.coords.latitude.toFixed(6));
+                url.searchParams.set('lng', position.coords.longitude.toFixed(6));
+                window.location.href = url.toString();
+            });
         });
     });
 
-    // Handle deep link fallback for mobile navigation
-    const navigateForm = document.querySelector('form[action*="navigate_action"]');
-    if (navigateForm) {
+    // Navigate button: open Maps straight away and record the tap with one JSON
+    // request; the response carries the next button label and link.
+    // Without a connection the button follows the plan of taps embedded in the
+    // page, and the service worker replays the taps once back online.
+    // Without fetch the form posts as before; if the request fails otherwise,
+    // the form posts the tap marked as already opened, so Maps is not opened twice.
+    const navigateForm = document.getElementById('navigate-form');
+    const planScript = document.getElementById('navigate-plan');
+    const plan = planScript ? JSON.parse(planScript.textContent) : [];
+    if (navigateForm && navigateForm.dataset.apiUrl && navigateForm.dataset.openUrl && window.fetch) {
         navigateForm.addEventListener('submit', function(e) {
-            // On mobile, try to open deep link before form submission
-            const deepLink = document.getElementById('deep-link');
-            if (deepLink && /Android|iPhone|iPad|iPod|BlackBerry|IEMobile|Opera Mini/i.test(navigator.userAgent)) {
-                // Small delay to let form submit, then try deep link
-                setTimeout(function() {
-                    window.location.href = deepLink.href;
-                }, 100);
+            e.preventDefault();
+            openMaps(navigateForm.dataset.openUrl);
+
+            const csrfInput = navigateForm.querySelector('input[name="csrfmiddlewaretoken"]');
+            const csrfToken = csrfInput ? csrfInput.value : '';
+            fetch(navigateForm.dataset.apiUrl, {
+                method: 'POST',
+                headers: {'X-CSRFToken': csrfToken, 'Accept': 'application/json'},
+                credentials: 'same-origin',
+                keepalive: true
+            })
+                .catch(function(error) {
+                    // No connection: the tap is applied locally and replayed later
+                    if (queueOfflineTap(navigateForm, csrfToken)) {
+                        return null;
+                    }
+                    throw error;
+                })
+                .then(function(response) {
+                    if (response === null) {
+                        return null;
+                    }
+                    if (!response.ok) {
+                        throw new Error('Navigate request failed: ' + response.status);
+                    }
+                    return response.json();
+                })
+                .then(function(data) {
+                    if (data === null) {
+                        followPlan(navigateForm, plan);
+                        return;
+                    }
+                    navigateForm.dataset.state = data.state;
+                    if (data.state === 'navigated_to_dropoff' || !data.button) {
+                        // Final leg: let the server render the completed page
+                        window.location.reload();
+                        return;
+                    }
+                    navigateForm.dataset.openUrl = data.button.open_url;
+                    showNavigateStep(data.button.label, data.state_display);
+                })
+                .catch(function() {
+                    // Maps is already open: post the tap without opening it again
+                    submitOpenedTap(navigateForm);
+                });
+        });
+    }
+
+    // Service worker: cached page shell and replay of offline taps
+    const serviceWorkerUrl = document.body.dataset.serviceWorker;
+    if (serviceWorkerUrl && 'serviceWorker' in navigator) {
+        navigator.serviceWorker.register(serviceWorkerUrl).catch(function() {});
+        window.addEventListener('online', function() {
+            if (navigator.serviceWorker.controller) {
+                navigator.serviceWorker.controller.postMessage({type: 'replay'});
             }
         });
     }
 });
+
+// Hand a tap made offline to the service worker; false if there is none to replay it
+function queueOfflineTap(form, csrfToken) {
+    if (!('serviceWorker' in navigator) || !navigator.serviceWorker.controller || !form.dataset.state) {
+        return false;
+    }
+    navigator.serviceWorker.controller.postMessage({
+        type: 'navigate-tap',
+        tap: {url: form.action, csrf_token: csrfToken, expected_state: form.dataset.state}
+    });
+    return true;
+}
+
+// Post the navigate form for a tap whose link was already opened on the device
+function submitOpenedTap(form) {
+    const fields = {opened: '1', expected_state: form.dataset.state};
+    Object.keys(fields).forEach(function(name) {
+        if (!fields[name] || form.querySelector('input[name="' + name + '"]')) {
+            return;
+        }
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = name;
+        input.value = fields[name];
+        form.appendChild(input);
+    });
+    form.submit();
+}
+
+// Advance the navigate button along the precomputed plan after an offline tap
+function followPlan(form, plan) {
+    const step = plan.find(function(candidate) { return candidate.state === form.dataset.state; });
+    if (!step) {
+        return;
+    }
+    form.dataset.state = step.next_state;
+    const next = plan.find(function(candidate) { return candidate.state === step.next_state; });
+    if (!next) {
+        // Route completed: nothing left to navigate to
+        form.style.display = 'none';
+        showNavigateStep(null, step.next_state_display);
+        return;
+    }
+    form.dataset.openUrl = next.open_url;
+    showNavigateStep(next.label, step.next_state_display);
+}
+
+function showNavigateStep(label, stateDisplay) {
+    const button = document.getElementById('navigate-button');
+    if (button && label) {
+        button.textContent = label;
+    }
+    const status = document.getElementById('navigation-status');
+    if (status) {
+        status.textContent = stateDisplay;
+    }
+}
+
+// Open a Google Maps URL in a separate window/tab, keeping this page open.
+// App deep links (google.navigation:, comgooglemaps://) go through a hidden link.
+function openMaps(url) {
+    const isDeepLink = !/^https?:/i.test(url);
+    if (isDeepLink) {
+        const link = document.createElement('a');
+        link.href = url;
+        link.target = '_blank';
+        link.rel = 'noopener noreferrer';
+        link.style.display = 'none';
+        document.body.appendChild(link);
+        link.click();
+        setTimeout(function() {
+            link.remove();
+        }, 100);
+    } else {
+        window.open(url, '_blank', 'noopener,noreferrer');
+    }
+}
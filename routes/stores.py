@@ -0,0 +1,470 @@
+"""
+Storage backends for NavigationSession state.
+
+The backend is chosen with the ``ROUTES_NAVIGATION_STORE`` setting:
+
+- ``routes.stores.DatabaseNavigationStore`` (default): one database row per
+  session, updated in place.
+- ``routes.stores.CacheNavigationStore``: state lives in a Django cache
+  (locmem, filesystem, Redis, ...). The database is never written.
+- ``routes.stores.WriteBehindNavigationStore``: state lives in the cache and
+  changed sessions are flushed to the database in batches by a background
+  thread, so state transitions never wait on a database write.
+- ``routes.stores.SignedCookieNavigationStore``: state travels with the
+  visitor in a signed cookie; the database only gets a copy, written in
+  batches like the write-behind store. No Django session is created.
+
+Cache-backed sessions fall back to reading the persisted row on a cache miss.
+
+Async views use ``aload``/``asave``. The database store implements them with
+the async ORM; other stores run their sync methods in a worker thread.
+"""
+import functools
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+
+from .batching import BatchedWriter
+from .models import Location, NavigationSession
+
+DEFAULT_NAVIGATION_STORE = 'routes.stores.DatabaseNavigationStore'
+
+
+def _set_location(nav_session, field, location):
+    # A location deleted, or no longer in this role, since the state was
+    # saved is dropped, as SET_NULL would
+    if location is None:
+        setattr(nav_session, field.attname, None)
+    field.set_cached_value(nav_session, location)
+
+
+async def _aload_locations(nav_session):
+    # Async code cannot lazy-load related objects, so fetch them up front
+    for name in ('pickup', 'dropoff'):
+        field = nav_session._meta.get_field(name)
+        location_id = getattr(nav_session, field.attname)
+        if location_id is not None and not field.is_cached(nav_session):
+            # The proxy's manager only returns locations that have its role
+            location = await field.related_model.objects.filter(pk=location_id).afirst()
+            _set_location(nav_session, field, location)
+
+
+def _load_locations(nav_session):
+    for name in ('pickup', 'dropoff'):
+        field = nav_session._meta.get_field(name)
+        location_id = getattr(nav_session, field.attname)
+        if location_id is not None and not field.is_cached(nav_session):
+            _set_location(nav_session, field, field.related_model.objects.filter(pk=location_id).first())
+
+
+def _to_dict(nav_session):
+    return {
+        'id': nav_session.pk,
+        'pickup_id': nav_session.pickup_id,
+        'dropoff_id': nav_session.dropoff_id,
+        'state': nav_session.state,
+        'created_at': nav_session.created_at,
+        'updated_at': nav_session.updated_at,
+    }
+
+
+def _from_dict(session_key, data):
+    nav_session = NavigationSession(session_key=session_key, **data)
+    nav_session.mark_clean()
+    return nav_session
+
+
+def persist_states(states, batch_size=100):
+    """
+    Create or update NavigationSession rows from state dicts keyed by session key.
+
+    Returns:
+        int: number of sessions written
+    """
+    if not states:
+        return 0
+
+    # Locations deleted since the state was saved become NULL, as SET_NULL would
+    location_ids = {data[field] for data in states.values() for field in ('pickup_id', 'dropoff_id')}
+    roles = dict(Location.objects.filter(id__in=location_ids - {None}).values_list('id', 'role'))
+    pickup_ids = {pk for pk, role in roles.items() if role & Location.PICKUP}
+    dropoff_ids = {pk for pk, role in roles.items() if role & Location.DROPOFF}
+
+    existing = {
+        nav_session.session_key: nav_session
+        for nav_session in NavigationSession.objects.filter(session_key__in=list(states))
+    }
+    to_update, to_create = [], []
+    for session_key, data in states.items():
+        nav_session = existing.get(session_key) or NavigationSession(
+            session_key=session_key, created_at=data['created_at']
+        )
+        nav_session.pickup_id = data['pickup_id'] if data['pickup_id'] in pickup_ids else None
+        nav_session.dropoff_id = data['dropoff_id'] if data['dropoff_id'] in dropoff_ids else None
+        nav_session.state = data['state']
+        nav_session.updated_at = data['updated_at']
+        (to_update if nav_session.pk else to_create).append(nav_session)
+
+    fields = ['pickup', 'dropoff', 'state', 'updated_at']
+    with transaction.atomic():
+        NavigationSession.objects.bulk_update(to_update, fields, batch_size=batch_size)
+        # Another process may have created one of the rows since they were read
+        NavigationSession.objects.bulk_create(
+            to_create, batch_size=batch_size,
+            update_conflicts=True, unique_fields=['session_key'], update_fields=fields,
+        )
+    return len(states)
+
+
+class BaseNavigationStore:
+    """Interface for loading and persisting NavigationSession state."""
+
+    # True if the state travels with each request instead of being looked up
+    # by Django session key (see SignedCookieNavigationStore)
+    stateless = False
+
+    def load(self, session_key):
+        """Return the NavigationSession for ``session_key``, creating it if needed."""
+        raise NotImplementedError
+
+    def save(self, nav_session, fields, expected_state=None):
+        """
+        Persist the listed ``fields`` of ``nav_session``.
+
+        With ``expected_state`` the write is conditional: it only happens if
+        the stored state still equals ``expected_state``.
+
+        Returns:
+            bool: False if the conditional write lost a race
+        """
+        raise NotImplementedError
+
+    async def aload(self, session_key):
+        """Async version of ``load``; the pickup and dropoff are loaded too."""
+        nav_session = await sync_to_async(self.load)(session_key)
+        await _aload_locations(nav_session)
+        return nav_session
+
+    async def asave(self, nav_session, fields, expected_state=None):
+        """Async version of ``save``."""
+        return await sync_to_async(self.save)(nav_session, fields, expected_state)
+
+    def invalidate(self, session_keys):
+        """Forget copies of these sessions kept outside the database; their rows were rewritten."""
+
+
+class DatabaseNavigationStore(BaseNavigationStore):
+    """Store each session as a NavigationSession row (one write per change)."""
+
+    def load(self, session_key):
+        try:
+            return NavigationSession.objects.select_related('pickup', 'dropoff').get(
+                session_key=session_key
+            )
+        except NavigationSession.DoesNotExist:
+            return self._create(session_key)
+
+    def _create(self, session_key):
+        try:
+            # The savepoint keeps a lost race from breaking an outer transaction
+            with transaction.atomic():
+                return NavigationSession.objects.create(
+                    session_key=session_key,
+                    state='no_selection'
+                )
+        except IntegrityError:
+            # A concurrent first request created the row; session_key is unique
+            return NavigationSession.objects.select_related('pickup', 'dropoff').get(
+                session_key=session_key
+            )
+
+    def save(self, nav_session, fields, expected_state=None):
+        if expected_state is None:
+            nav_session.save(update_fields=[*fields, 'updated_at'])
+            return True
+
+        # UPDATE ... WHERE state = <expected>: concurrent taps cannot both apply
+        nav_session.updated_at = timezone.now()
+        attnames = [nav_session._meta.get_field(name).attname for name in fields]
+        values = {attname: getattr(nav_session, attname) for attname in attnames}
+        updated = NavigationSession.objects.filter(pk=nav_session.pk, state=expected_state).update(
+            updated_at=nav_session.updated_at, **values
+        )
+        if updated:
+            nav_session.mark_clean()
+        return bool(updated)
+
+    async def aload(self, session_key):
+        try:
+            return await NavigationSession.objects.select_related('pickup', 'dropoff').aget(
+                session_key=session_key
+            )
+        except NavigationSession.DoesNotExist:
+            return await sync_to_async(self._create)(session_key)
+
+    async def asave(self, nav_session, fields, expected_state=None):
+        if expected_state is None:
+            await nav_session.asave(update_fields=[*fields, 'updated_at'])
+            return True
+
+        nav_session.updated_at = timezone.now()
+        attnames = [nav_session._meta.get_field(name).attname for name in fields]
+        values = {attname: getattr(nav_session, attname) for attname in attnames}
+        updated = await NavigationSession.objects.filter(pk=nav_session.pk, state=expected_state).aupdate(
+            updated_at=nav_session.updated_at, **values
+        )
+        if updated:
+            nav_session.mark_clean()
+        return bool(updated)
+
+
+class CacheNavigationStore(BaseNavigationStore):
+    """
+    Store session state as a small dict in a Django cache.
+
+    Uses the cache alias from ``ROUTES_NAVIGATION_CACHE`` (default
+    ``'default'``) and expires entries with the Django session cookie.
+    """
+    key_prefix = 'routes:navsession:'
+    lock_timeout = 5
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'ROUTES_NAVIGATION_CACHE', 'default')]
+        self.timeout = settings.SESSION_COOKIE_AGE
+
+    def cache_key(self, session_key):
+        return self.key_prefix + session_key
+
+    def load(self, session_key):
+        data = self.cache.get(self.cache_key(session_key))
+        if data is not None:
+            nav_session = _from_dict(session_key, data)
+            # Lazy loading would also return locations that lost their role
+            _load_locations(nav_session)
+            return nav_session
+
+        nav_session = (
+            NavigationSession.objects.select_related('pickup', 'dropoff')
+            .filter(session_key=session_key).first()
+        )
+        if nav_session is None:
+            now = timezone.now()
+            nav_session = NavigationSession(
+                session_key=session_key,
+                state='no_selection',
+                created_at=now,
+                updated_at=now
+            )
+            nav_session.mark_clean()
+        self.cache.set(self.cache_key(session_key), _to_dict(nav_session), self.timeout)
+        return nav_session
+
+    def save(self, nav_session, fields, expected_state=None):
+        key = self.cache_key(nav_session.session_key)
+        if expected_state is None:
+            self._set(key, nav_session)
+            return True
+
+        # Caches have no compare-and-set, so serialize writers with a short add() lock
+        lock_key = key + ':lock'
+        if not self.cache.add(lock_key, 1, self.lock_timeout):
+            return False
+        try:
+            current = self.cache.get(key)
+            if current is not None and current['state'] != expected_state:
+                return False
+            self._set(key, nav_session)
+            return True
+        finally:
+            self.cache.delete(lock_key)
+
+    def invalidate(self, session_keys):
+        self.cache.delete_many([self.cache_key(key) for key in session_keys])
+
+    def _set(self, key, nav_session):
+        nav_session.updated_at = timezone.now()
+        self.cache.set(key, _to_dict(nav_session), self.timeout)
+        nav_session.mark_clean()
+
+
+class _StateWriter(BatchedWriter):
+    """Writes queued session states, keyed by session key."""
+    thread_name = 'navigation-write-behind'
+
+    def write(self, batch):
+        return persist_states(batch, self.batch_size)
+
+
+class BatchedWriteMixin:
+    """
+    Queue saved sessions and persist them to the database in batches.
+
+    A daemon thread flushes the queue every ``ROUTES_WRITE_BEHIND_INTERVAL``
+    seconds (default 5), or as soon as ``ROUTES_WRITE_BEHIND_BATCH_SIZE``
+    sessions (default 100) are pending, and once more at interpreter exit
+    (routes.batching). Only the last state queued for a session is written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.writer = _StateWriter(
+            batch_size=getattr(settings, 'ROUTES_WRITE_BEHIND_BATCH_SIZE', 100),
+            interval=getattr(settings, 'ROUTES_WRITE_BEHIND_INTERVAL', 5.0),
+        )
+
+    def queue(self, nav_session):
+        """Queue the session's current state for the next flush."""
+        self.writer.add(nav_session.session_key, _to_dict(nav_session))
+
+    def invalidate(self, session_keys):
+        self.writer.discard(session_keys)
+        super().invalidate(session_keys)
+
+    def flush(self):
+        """
+        Write every pending session to the database.
+
+        Returns:
+            int: number of sessions written
+        """
+        return self.writer.flush()
+
+
+class WriteBehindNavigationStore(BatchedWriteMixin, CacheNavigationStore):
+    """Cache-backed store that also persists sessions to the database in batches."""
+
+    def save(self, nav_session, fields, expected_state=None):
+        if not super().save(nav_session, fields, expected_state):
+            return False
+        self.queue(nav_session)
+        return True
+
+
+class SignedCookieNavigationStore(BatchedWriteMixin, BaseNavigationStore):
+    """
+    Keep session state in a signed cookie and only copy it to the database.
+
+    NavigationSessionMiddleware sends the state in the cookie named by
+    ``ROUTES_NAVIGATION_COOKIE`` (default ``'navstate'``), signed with
+    SECRET_KEY and expiring with the Django session cookie. A tampered or
+    expired cookie is ignored, which starts the visitor over. Saves are only
+    queued for the batched database copy, so requests do no database writes.
+
+    Each browser is the single copy of its state: there is no compare-and-set,
+    and of two concurrent taps the cookie set last wins.
+    """
+    stateless = True
+    salt = 'routes.stores.SignedCookieNavigationStore'
+    key_length = 32
+
+    def __init__(self):
+        super().__init__()
+        self.cookie_name = getattr(settings, 'ROUTES_NAVIGATION_COOKIE', 'navstate')
+        self.max_age = settings.SESSION_COOKIE_AGE
+
+    def load(self, session_key=None):
+        """Return a new session; ``session_key`` defaults to a random one."""
+        now = timezone.now()
+        nav_session = NavigationSession(
+            session_key=session_key or get_random_string(self.key_length),
+            state='no_selection',
+            created_at=now,
+            updated_at=now
+        )
+        nav_session.mark_clean()
+        return nav_session
+
+    async def aload(self, session_key=None):
+        return self.load(session_key)
+
+    def save(self, nav_session, fields, expected_state=None):
+        nav_session.updated_at = timezone.now()
+        nav_session.mark_clean()
+        self.queue(nav_session)
+        return True
+
+    async def asave(self, nav_session, fields, expected_state=None):
+        return self.save(nav_session, fields, expected_state)
+
+    @staticmethod
+    def payload(nav_session, navigate_urls=None):
+        """The session (and Maps URLs waiting to be opened) as a compact list."""
+        return [
+            nav_session.session_key,
+            nav_session.pickup_id,
+            nav_session.dropoff_id,
+            nav_session.state,
+            int(nav_session.created_at.timestamp()),
+            int(nav_session.updated_at.timestamp()),
+            list(navigate_urls) if navigate_urls else None,
+        ]
+
+    def encode(self, payload):
+        """Sign a payload as a cookie value."""
+        return signing.dumps(payload, salt=self.salt, compress=True)
+
+    def decode(self, value):
+        """Return the payload of a cookie value, or None if it is missing, expired or tampered with."""
+        if not value:
+            return None
+        try:
+            payload = signing.loads(value, salt=self.salt, max_age=self.max_age)
+        except signing.BadSignature:
+            return None
+        if not isinstance(payload, list) or len(payload) != 7:
+            return None
+        return payload
+
+    def from_payload(self, payload):
+        """
+        Rebuild ``(NavigationSession, navigate_urls)`` from a payload.
+
+        Without a payload a new session is returned. The pickup and dropoff
+        are not loaded yet; see ``load_locations``.
+        """
+        if payload is None:
+            return self.load(), None
+        session_key, pickup_id, dropoff_id, state, created, updated, navigate_urls = payload
+        nav_session = NavigationSession(
+            session_key=session_key,
+            pickup_id=pickup_id,
+            dropoff_id=dropoff_id,
+            state=state,
+            created_at=datetime.fromtimestamp(created, tz=dt_timezone.utc),
+            updated_at=datetime.fromtimestamp(updated, tz=dt_timezone.utc),
+        )
+        nav_session.mark_clean()
+        return nav_session, tuple(navigate_urls) if navigate_urls else None
+
+    @staticmethod
+    def load_locations(nav_session):
+        """Load the pickup and dropoff, dropping references to deleted locations."""
+        _load_locations(nav_session)
+
+    @staticmethod
+    async def aload_locations(nav_session):
+        """Async version of ``load_locations``."""
+        await _aload_locations(nav_session)
+
+
+@functools.lru_cache(maxsize=None)
+def get_navigation_store():
+    """Return the configured navigation store instance (one per process)."""
+    path = getattr(settings, 'ROUTES_NAVIGATION_STORE', DEFAULT_NAVIGATION_STORE)
+    return import_string(path)()
+
+
+def _reset_navigation_store(*, setting, **kwargs):
+    if setting in ('ROUTES_NAVIGATION_STORE', 'ROUTES_NAVIGATION_CACHE', 'CACHES'):
+        get_navigation_store.cache_clear()
+
+
+setting_changed.connect(_reset_navigation_store)
@@ -0,0 +1,191 @@
+// Service worker: serves the page shell from cache when the network is slow or
+// gone, and replays navigate taps made offline once the connection returns.
+// Rendered by routes.views.service_worker.
+'use strict';
+
+const CACHE_PREFIX = 'route-handoff-';
+const CACHE = CACHE_PREFIX + '{{ cache_version }}';
+const PRECACHE = {{ precache|safe }};
+const NAVIGATE_URL = {{ navigate_url|safe }};
+const ADMIN_URL = {{ admin_url|safe }};
+
+// Pages are fetched from the network first; after this long the cached copy is shown
+const NETWORK_TIMEOUT_MS = 3000;
+
+const QUEUE_DB = 'route-handoff';
+const QUEUE_STORE = 'navigate-taps';
+const SYNC_TAG = 'replay-navigate-taps';
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then(function(cache) { return cache.addAll(PRECACHE); })
+            .then(function() { return self.skipWaiting(); })
+    );
+});
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(
+        caches.keys()
+            .then(function(keys) {
+                return Promise.all(keys.filter(function(key) {
+                    return key.startsWith(CACHE_PREFIX) && key !== CACHE;
+                }).map(function(key) {
+                    return caches.delete(key);
+                }));
+            })
+            .then(function() { return self.clients.claim(); })
+            .then(function() { return replayTaps().catch(function() {}); })
+    );
+});
+
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin || url.pathname.startsWith(ADMIN_URL)) {
+        return;
+    }
+    if (request.mode === 'navigate') {
+        event.respondWith(networkFirst(request));
+    } else if (PRECACHE.indexOf(url.pathname) !== -1) {
+        event.respondWith(caches.match(request).then(function(cached) {
+            return cached || fetch(request);
+        }));
+    }
+});
+
+self.addEventListener('sync', function(event) {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(replayTaps());
+    }
+});
+
+// Messages from main.js: a tap made offline, or "the connection is back"
+self.addEventListener('message', function(event) {
+    const data = event.data || {};
+    if (data.type === 'navigate-tap') {
+        event.waitUntil(queueTap(data.tap));
+    } else if (data.type === 'replay') {
+        event.waitUntil(replayTaps().catch(function() {}));
+    }
+});
+
+function networkFirst(request) {
+    const network = fetch(request).then(function(response) {
+        // Redirects cannot be replayed to a navigation, so only final pages are kept;
+        // pages that open Maps on load are marked no-store and never kept
+        if (response.ok && response.type === 'basic' && !response.redirected && !isNoStore(response)) {
+            const copy = response.clone();
+            caches.open(CACHE).then(function(cache) { return cache.put(request, copy); });
+        }
+        return response;
+    });
+    const timeout = new Promise(function(resolve) {
+        setTimeout(resolve, NETWORK_TIMEOUT_MS);
+    });
+    return Promise.race([network.catch(function() {}), timeout]).then(function(response) {
+        if (response) {
+            return response;
+        }
+        return caches.match(request).then(function(cached) {
+            return cached || network.catch(function() { return offlineFallback(request); });
+        });
+    });
+}
+
+function isNoStore(response) {
+    return /(^|,)\s*no-store\s*(,|$)/i.test(response.headers.get('Cache-Control') || '');
+}
+
+function offlineFallback(request) {
+    const url = new URL(request.url);
+    const fallback = url.pathname === NAVIGATE_URL ? null : caches.match(NAVIGATE_URL, {ignoreSearch: true});
+    return Promise.resolve(fallback).then(function(cached) {
+        return cached || new Response('You are offline. This page will load once the connection is back.', {
+            status: 503,
+            headers: {'Content-Type': 'text/plain; charset=utf-8'}
+        });
+    });
+}
+
+// Offline taps are kept in IndexedDB, oldest first
+
+function openQueue() {
+    return new Promise(function(resolve, reject) {
+        const open = indexedDB.open(QUEUE_DB, 1);
+        open.onupgradeneeded = function() {
+            open.result.createObjectStore(QUEUE_STORE, {autoIncrement: true});
+        };
+        open.onsuccess = function() { resolve(open.result); };
+        open.onerror = function() { reject(open.error); };
+    });
+}
+
+function withQueue(mode, operation) {
+    return openQueue().then(function(db) {
+        return new Promise(function(resolve, reject) {
+            const transaction = db.transaction(QUEUE_STORE, mode);
+            const request = operation(transaction.objectStore(QUEUE_STORE));
+            transaction.oncomplete = function() {
+                db.close();
+                resolve(request.result);
+            };
+            transaction.onerror = function() {
+                db.close();
+                reject(transaction.error);
+            };
+        });
+    });
+}
+
+function queueTap(tap) {
+    return withQueue('readwrite', function(store) { return store.add(tap); }).then(function() {
+        if (self.registration.sync) {
+            return self.registration.sync.register(SYNC_TAG);
+        }
+    });
+}
+
+let replaying = null;
+
+function replayTaps() {
+    // One replay at a time, so no tap is sent twice
+    if (!replaying) {
+        replaying = replayQueued().finally(function() { replaying = null; });
+    }
+    return replaying;
+}
+
+function replayQueued() {
+    return Promise.all([
+        withQueue('readonly', function(store) { return store.getAllKeys(); }),
+        withQueue('readonly', function(store) { return store.getAll(); })
+    ]).then(function(results) {
+        const keys = results[0];
+        const taps = results[1];
+        return taps.reduce(function(previous, tap, index) {
+            return previous.then(function() {
+                return sendTap(tap).then(function() {
+                    return withQueue('readwrite', function(store) { return store.delete(keys[index]); });
+                });
+            });
+        }, Promise.resolve());
+    });
+}
+
+function sendTap(tap) {
+    const body = new URLSearchParams({expected_state: tap.expected_state, opened: '1'});
+    return fetch(tap.url, {
+        method: 'POST',
+        credentials: 'same-origin',
+        redirect: 'manual',
+        headers: {'X-CSRFToken': tap.csrf_token},
+        body: body
+    }).then(function(response) {
+        // Server errors are retried with the next sync; anything else is done
+        // (a 4xx tap, e.g. an expired CSRF token, would fail every time)
+        if (response.status >= 500) {
+            throw new Error('Navigate replay failed: ' + response.status);
+        }
+    });
+}
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'routes'
 
@@ -9,9 +9,25 @@ urlpatterns = [
     path('locations/dropoff/add/', views.DropOffCreateView.as_view(), name='dropoff_add'),
     path('locations/pickup/list/', views.PickUpListView.as_view(), name='pickup_list'),
     path('locations/dropoff/list/', views.DropOffListView.as_view(), name='dropoff_list'),
+    path('locations/<str:location_type>/page/', views.location_page, name='location_page'),
+    path('locations/<str:location_type>/import/', views.location_import, name='location_import'),
+    path('locations/<str:location_type>/export/', views.location_export, name='location_export'),
     path('select/', views.select_locations, name='select_locations'),
     path('navigate/', views.navigate_view, name='navigate_view'),
     path('navigate/action/', views.navigate_action, name='navigate_action'),
     path('start-over/', views.start_over, name='start_over'),
     path('state/', views.state_view, name='state_view'),
+    path('sw.js', views.service_worker, name='service_worker'),
+    path('drive/<str:token>/', views.driver_link, name='driver_link'),
+    path('dashboard/', views.dashboard, name='dashboard'),
+    path('api/state/', api.state, name='api_state'),
+    path('api/select/', api.select, name='api_select'),
+    path('api/navigate/', api.navigate, name='api_navigate'),
+    path('api/reset/', api.reset, name='api_reset'),
+    path('api/route/', api.route, name='api_route'),
+    path('api/route/next/', api.route_next, name='api_route_next'),
+    path('api/distances/', api.distances, name='api_distances'),
+    path('api/dispatch/', api.dispatch, name='api_dispatch'),
+    path('api/events/', api.events, name='api_events'),
+    path('api/metrics/', api.metrics, name='api_metrics'),
 ]
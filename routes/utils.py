@@ -1,66 +1,264 @@
-import re
-from .models import NavigationSession
+from django.conf import settings
+from django.core import signing
+
+from .deeplinks import ANDROID, DEFAULT_TRAVEL_MODE, DESKTOP, build_links
+from .devices import classify_request
+from .dispatch import DRIVER_COOKIE, DRIVER_COOKIE_SALT, driver_session_key
+from .stores import get_navigation_store
+
+# Maps URLs waiting to be opened by the next navigate page, with a database
+# navigation store (the stateless store keeps them in its state cookie). A
+# cookie, so a navigate tap writes only the NavigationSession row.
+NAVIGATE_URLS_COOKIE = 'routes_open'
+NAVIGATE_URLS_COOKIE_SALT = 'routes.utils.navigate_urls'
+NAVIGATE_URLS_MAX_AGE = 300
+
+
+def _from_cookie(request, store):
+    payload = store.decode(request.COOKIES.get(store.cookie_name))
+    nav_session, request._navigate_urls = store.from_payload(payload)
+    # Compared with the final state to tell whether the cookie must be sent
+    request._navigation_cookie_payload = payload
+    request._navigation_session = nav_session
+    return nav_session
+
+
+def _driver_session_key(request):
+    # Set by the /drive/<token>/ link of a dispatched driver (routes.dispatch)
+    token = request.get_signed_cookie(DRIVER_COOKIE, default=None, salt=DRIVER_COOKIE_SALT)
+    if token is None:
+        return None
+    try:
+        return driver_session_key(token)
+    except ValueError:
+        return None
+
+
+def bind_driver(request, response, token, nav_session):
+    """Make ``nav_session``, a dispatched driver's session, the browser's session from now on."""
+    store = get_navigation_store()
+    if store.stateless:
+        # The state cookie set by NavigationSessionMiddleware carries the key
+        request._navigation_session = nav_session
+        request._navigate_urls = None
+        request._navigation_cookie_payload = None
+        return
+    response.set_signed_cookie(
+        DRIVER_COOKIE, token, salt=DRIVER_COOKIE_SALT,
+        max_age=settings.SESSION_COOKIE_AGE,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite=settings.SESSION_COOKIE_SAMESITE,
+    )
 
 
 def get_or_create_navigation_session(request):
-    """Get or create NavigationSession linked to current session key."""
-    session_key = request.session.session_key
+    """
+    Get or create NavigationSession linked to current session key.
+
+    A browser bound to a dispatched driver (routes.dispatch) gets that
+    driver's session instead.
+
+    The session is loaded once per request from the configured navigation
+    store (see routes.stores), then memoized on the request. Views modify it
+    in place and NavigationSessionMiddleware writes the changes back once.
+    """
+    nav_session = getattr(request, '_navigation_session', None)
+    if nav_session is not None:
+        return nav_session
+
+    store = get_navigation_store()
+    if store.stateless:
+        # State comes from the request's cookie; no Django session is needed
+        nav_session = _from_cookie(request, store)
+        store.load_locations(nav_session)
+        return nav_session
+
+    session_key = _driver_session_key(request) or request.session.session_key
     if not session_key:
         # Ensure session is created
         request.session.create()
         session_key = request.session.session_key
 
-    nav_session, created = NavigationSession.objects.get_or_create(
-        session_key=session_key,
-        defaults={'state': 'no_selection'}
-    )
+    nav_session = store.load(session_key)
+    request._navigation_session = nav_session
     return nav_session
 
 
+async def aget_or_create_navigation_session(request):
+    """
+    Async version of ``get_or_create_navigation_session``.
+
+    Also loads the Django session data, so code that reads it synchronously
+    later in the request (messages, templates) does not query the database.
+    """
+    nav_session = getattr(request, '_navigation_session', None)
+    if nav_session is not None:
+        return nav_session
+
+    store = get_navigation_store()
+    if store.stateless:
+        nav_session = _from_cookie(request, store)
+        await store.aload_locations(nav_session)
+        return nav_session
+
+    session_key = _driver_session_key(request)
+    if request.session.session_key:
+        await request.session.akeys()
+    elif session_key is None:
+        await request.session.acreate()
+
+    nav_session = await store.aload(session_key or request.session.session_key)
+    request._navigation_session = nav_session
+    return nav_session
+
+
+def save_navigation_session(request):
+    """
+    Write back the request's NavigationSession if any tracked field changed.
+
+    Only the changed fields are passed to the configured navigation store.
+
+    Returns:
+        bool: True if a row was updated
+    """
+    nav_session = getattr(request, '_navigation_session', None)
+    if nav_session is None:
+        return False
+    changed = nav_session.changed_fields()
+    if not changed:
+        return False
+    get_navigation_store().save(nav_session, changed)
+    return True
+
+
+async def asave_navigation_session(request):
+    """Async version of ``save_navigation_session``."""
+    nav_session = getattr(request, '_navigation_session', None)
+    if nav_session is None:
+        return False
+    changed = nav_session.changed_fields()
+    if not changed:
+        return False
+    await get_navigation_store().asave(nav_session, changed)
+    return True
+
+
+def _decode_navigate_urls(value):
+    if not value:
+        return None
+    try:
+        urls = signing.loads(value, salt=NAVIGATE_URLS_COOKIE_SALT, max_age=NAVIGATE_URLS_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if not isinstance(urls, list) or len(urls) != 2:
+        return None
+    return tuple(urls)
+
+
+def _navigate_urls(request):
+    # The stateless store reads them with the session; otherwise the cookie is read once
+    get_or_create_navigation_session(request)
+    if not hasattr(request, '_navigate_urls'):
+        urls = _decode_navigate_urls(request.COOKIES.get(NAVIGATE_URLS_COOKIE))
+        request._navigate_urls = request._navigate_urls_cookie = urls
+    return request._navigate_urls
+
+
+def set_navigate_urls(request, urls):
+    """Remember Maps URLs for the next navigate page to open in a new window."""
+    _navigate_urls(request)
+    request._navigate_urls = (urls['deep_link'], urls['web_fallback'])
+
+
+def has_navigate_urls(request):
+    """Return True if Maps URLs are waiting to be opened."""
+    return bool(_navigate_urls(request))
+
+
+def pop_navigate_urls(request):
+    """
+    Return and forget the Maps URLs waiting to be opened.
+
+    Returns:
+        tuple: (deep link, web fallback), both None if nothing is waiting
+    """
+    urls = _navigate_urls(request)
+    request._navigate_urls = None
+    return urls or (None, None)
+
+
+def set_navigate_urls_cookie(request, response):
+    """
+    Set or clear the Maps URLs cookie if the view changed the URLs waiting.
+
+    Only used with a database navigation store.
+    """
+    if not hasattr(request, '_navigate_urls_cookie'):
+        return
+    urls = request._navigate_urls
+    if urls == request._navigate_urls_cookie:
+        return
+    if urls:
+        response.set_cookie(
+            NAVIGATE_URLS_COOKIE, signing.dumps(list(urls), salt=NAVIGATE_URLS_COOKIE_SALT),
+            max_age=NAVIGATE_URLS_MAX_AGE,
+            path=settings.SESSION_COOKIE_PATH,
+            domain=settings.SESSION_COOKIE_DOMAIN,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
+    else:
+        response.delete_cookie(
+            NAVIGATE_URLS_COOKIE,
+            path=settings.SESSION_COOKIE_PATH,
+            domain=settings.SESSION_COOKIE_DOMAIN,
+            samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
+
+
+def navigation_cookie(request):
+    """
+    Return the signed state cookie to send, or None if it would not change.
+
+    Only used with a stateless navigation store.
+    """
+    nav_session = getattr(request, '_navigation_session', None)
+    if nav_session is None:
+        return None
+    store = get_navigation_store()
+    payload = store.payload(nav_session, request._navigate_urls)
+    if payload == request._navigation_cookie_payload:
+        return None
+    if request._navigation_cookie_payload is None and nav_session.state == 'no_selection' \
+            and not request._navigate_urls:
+        # A fresh session is no different from having no cookie
+        return None
+    return store.encode(payload)
+
+
 def is_mobile_device(request):
     """Detect if request is from mobile device based on User-Agent."""
-    user_agent = request.META.get('HTTP_USER_AGENT', '').lower()
-    mobile_patterns = [
-        r'mobile', r'android', r'iphone', r'ipad', r'ipod',
-        r'blackberry', r'windows phone', r'opera mini'
-    ]
-    return any(re.search(pattern, user_agent) for pattern in mobile_patterns)
+    return classify_request(request).is_mobile
+
 
+def detect_platform(request):
+    """Return the deep-link platform (android, ios or desktop) for the request."""
+    return classify_request(request).platform
 
-def generate_maps_url(location, is_mobile=False):
+
+def generate_maps_url(location, is_mobile=False, platform=None, travel_mode=DEFAULT_TRAVEL_MODE):
     """
     Generate Google Maps deep link and web fallback URL for a location.
     Origin is always current GPS location (not specified, so Google Maps uses current location).
-    
+
+    ``platform`` selects the deep-link variant (see routes.deeplinks); when
+    omitted, mobile requests get the Android link and others the web URL.
+
     Returns:
-        dict: {'deep_link': str, 'web_fallback': str}
+        dict: {'deep_link': str, 'web_fallback': str, 'android': str, 'ios': str}
     """
-    lat = str(location.latitude)
-    lng = str(location.longitude)
-    
-    # Web fallback URL (works on all devices)
-    # Not specifying origin makes Google Maps use current GPS location
-    # travelmode=driving ensures driving directions
-    web_fallback = f"https://www.google.com/maps/dir/?api=1&destination={lat},{lng}&travelmode=driving"
-    
-    # Mobile deep links
-    if is_mobile:
-        # Android: google.navigation scheme always uses current location as origin
-        # This will recalculate from current GPS every time
-        android_deep_link = f"google.navigation:q={lat},{lng}"
-        
-        # iOS: comgooglemaps scheme uses current location if origin not specified
-        # Not specifying saddr (source address) makes it use current location
-        ios_deep_link = f"comgooglemaps://?daddr={lat},{lng}&directionsmode=driving"
-        
-        # Default to Android format (iOS will fallback if app not installed)
-        # In practice, you might want to detect OS specifically
-        deep_link = android_deep_link
-    else:
-        # Desktop: use web fallback
-        deep_link = web_fallback
-    
-    return {
-        'deep_link': deep_link,
-        'web_fallback': web_fallback,
-    }
+    if platform is None:
+        platform = ANDROID if is_mobile else DESKTOP
+    return build_links(location, platform, travel_mode)
@@ -0,0 +1,79 @@
+"""
+Shared version counters for cached data.
+
+Each named counter lives in the Django cache alias from
+``ROUTES_VERSION_CACHE`` (default ``'default'``) and is bumped whenever the
+data it covers changes. Per-process caches compare their version with the
+shared counter to notice changes made by other workers.
+
+That needs a cache every process sees (``CACHE_URL``, see
+route_handoff_project/cache.py). A LocMemCache only counts as shared when
+``ROUTES_SINGLE_PROCESS`` is set; otherwise ``is_shared()`` is False and
+callers must not trust the counters (routes.page_cache, routes.distances).
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils import timezone
+
+LOCATIONS = 'locations'
+
+KEY_PREFIX = 'routes:version:'
+
+
+def _cache():
+    return caches[getattr(settings, 'ROUTES_VERSION_CACHE', 'default')]
+
+
+def is_shared():
+    """Return whether every process serving the site sees the same counters."""
+    cache = _cache()
+    if isinstance(cache, DummyCache):
+        # Keeps no bumps at all
+        return False
+    if isinstance(cache, LocMemCache):
+        return getattr(settings, 'ROUTES_SINGLE_PROCESS', False)
+    return True
+
+
+def get_version(name):
+    """Return the current version of ``name`` (starting at 1)."""
+    key = KEY_PREFIX + name
+    version = _cache().get(key)
+    if version is None:
+        _cache().add(key, 1, timeout=None)
+        version = _cache().get(key, 1)
+    return version
+
+
+def get_changed_at(name):
+    """Return when ``name`` was last bumped, or None if unknown."""
+    return _cache().get(KEY_PREFIX + name + ':changed_at')
+
+
+def bump_version(name):
+    """Increment the version of ``name`` and return the new value."""
+    key = KEY_PREFIX + name
+    _cache().set(key + ':changed_at', timezone.now(), timeout=None)
+    try:
+        return _cache().incr(key)
+    except ValueError:
+        # Counter missing or evicted: recreate it; readers compare versions
+        # for equality, so any change makes them reload
+        get_version(name)
+        return _cache().incr(key)
+
+
+def bump_version_on_commit(name, callback=None):
+    """
+    Bump ``name`` once the current transaction commits.
+
+    ``callback`` (if given) is called with the new version.
+    """
+    def bump():
+        version = bump_version(name)
+        if callback is not None:
+            callback(version)
+    transaction.on_commit(bump)
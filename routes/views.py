@@ -1,10 +1,38 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, redirect
+from django.templatetags.static import static
+from django.utils.cache import patch_cache_control
 from django.views.generic import CreateView, ListView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib import messages
-from .models import PickUpLocation, DropOffLocation, NavigationSession
-from .forms import PickUpLocationForm, DropOffLocationForm
-from .utils import get_or_create_navigation_session
+from django.utils.decorators import method_decorator
+from .models import LOCATION_MODELS, PickUpLocation, DropOffLocation, NavigationSession
+from .bulk import (
+    CSV, FORMATS, GEOJSON, ImportFileError, aiter_export, detect_format, import_locations, iter_export, iter_rows,
+)
+from .distances import with_etas
+from .forms import LocationImportForm, PickUpLocationForm, DropOffLocationForm
+from .geo import nearest_locations, parse_coordinates
+from .page_cache import TEMPLATE_DIGEST, cards_page, conditional_page, navigate_etag, page_etag, render_cards
+from .state_machine import (
+    NAVIGATE, RESET, SELECT_DROPOFF, SELECT_PICKUP, VIEW,
+    aapply_transition, aapply_transitions, apply_transition, navigate_plan, transition_target,
+)
+from .dispatch import driver_session_key
+from .events import session_label
+from .utils import (
+    aget_or_create_navigation_session, bind_driver, detect_platform, generate_maps_url,
+    get_or_create_navigation_session, pop_navigate_urls, set_navigate_urls,
+)
+
+# Sessions listed on the live dashboard; later ones appear as events arrive
+DASHBOARD_SESSIONS = 100
 
 
 class PickUpCreateView(CreateView):
@@ -33,32 +61,113 @@ class DropOffCreateView(CreateView):
         return context
 
 
-class PickUpListView(ListView):
-    """View for listing pickup locations."""
-    model = PickUpLocation
+@method_decorator(conditional_page(page_etag), name='dispatch')
+class LocationListView(ListView):
+    """Base view for listing pickup or dropoff locations one keyset page at a time."""
     template_name = 'routes/location_list.html'
     context_object_name = 'locations'
+    location_type = None
+
+    def get_queryset(self):
+        # With ?lat=&lng= only the nearest locations are listed
+        self.origin = parse_coordinates(self.request.GET)
+        self.next_cursor = None
+        nav_session = get_or_create_navigation_session(self.request)
+        self.current_selection = getattr(nav_session, f'{self.location_type}_id')
+        queryset = super().get_queryset()
+        if self.origin:
+            locations = with_etas(nearest_locations(queryset, *self.origin))
+            self.cards_html = render_cards(locations, self.location_type, self.current_selection, origin=self.origin)
+            return locations
+        # Keyset pages are cached with their rendered cards
+        page = cards_page(queryset, self.location_type, self.request.GET.get('cursor'), self.current_selection)
+        self.next_cursor = page.next_cursor
+        self.cards_html = page.html
+        return page.locations
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['location_type'] = 'pickup'
-        nav_session = get_or_create_navigation_session(self.request)
-        context['current_selection'] = nav_session.pickup_id if nav_session.pickup else None
+        context['location_type'] = self.location_type
+        context['origin'] = self.origin
+        context['next_cursor'] = self.next_cursor
+        context['current_selection'] = self.current_selection
+        context['cards_html'] = self.cards_html
         return context
 
 
-class DropOffListView(ListView):
+class PickUpListView(LocationListView):
+    """View for listing pickup locations."""
+    model = PickUpLocation
+    location_type = 'pickup'
+
+
+class DropOffListView(LocationListView):
     """View for listing dropoff locations."""
     model = DropOffLocation
-    template_name = 'routes/location_list.html'
-    context_object_name = 'locations'
+    location_type = 'dropoff'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['location_type'] = 'dropoff'
-        nav_session = get_or_create_navigation_session(self.request)
-        context['current_selection'] = nav_session.dropoff_id if nav_session.dropoff else None
-        return context
+
+def _location_model(location_type):
+    model = LOCATION_MODELS.get(location_type)
+    if model is None:
+        raise Http404('Unknown location type.')
+    return model
+
+
+def location_page(request, location_type):
+    """Return the next keyset page of location cards as a JSON fragment."""
+    model = _location_model(location_type)
+    nav_session = get_or_create_navigation_session(request)
+    page = cards_page(
+        model.objects.all(), location_type, request.GET.get('cursor'),
+        getattr(nav_session, f'{location_type}_id'), compact=request.GET.get('compact') == '1',
+    )
+    return JsonResponse({'html': page.html, 'next_cursor': page.next_cursor})
+
+
+def location_import(request, location_type):
+    """Upload a CSV or GeoJSON file of locations and insert them in batches."""
+    model = _location_model(location_type)
+
+    if request.method == 'POST':
+        form = LocationImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            file_format = form.cleaned_data['format'] or detect_format(upload.name)
+            lines = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            try:
+                result = import_locations(model, iter_rows(lines, file_format))
+            except ImportFileError as exc:
+                form.add_error('file', f'{exc} Imported {exc.result.created} {location_type} locations '
+                                       f'before the error.')
+            else:
+                messages.success(request, f'Imported {result.created} {location_type} locations.')
+                if result.failed:
+                    details = '; '.join(f'row {row}: {error}' for row, error in result.errors)
+                    messages.warning(request, f'Skipped {result.failed} invalid rows ({details}).')
+                return redirect(f'routes:{location_type}_list')
+    else:
+        form = LocationImportForm()
+
+    return render(request, 'routes/location_import.html', {
+        'form': form,
+        'location_type': location_type,
+    })
+
+
+def location_export(request, location_type):
+    """Stream every location of a type as CSV (default) or GeoJSON."""
+    model = _location_model(location_type)
+    file_format = request.GET.get('format', CSV)
+    if file_format not in FORMATS:
+        raise Http404('Unknown export format.')
+
+    content_type = 'application/geo+json' if file_format == GEOJSON else 'text/csv'
+    # The ASGI handler would buffer a sync iterator; give it an async one
+    export = aiter_export if isinstance(request, ASGIRequest) else iter_export
+    response = StreamingHttpResponse(export(model.objects.all(), file_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{location_type}_locations.{file_format}"'
+    return response
 
 
 def home(request):
@@ -69,52 +178,61 @@ def home(request):
     return redirect('routes:navigate_view')
 
 
-def select_locations(request):
+@sync_to_async
+def _selection_lists(nav_session, origin):
+    """Context of both location lists: nearest to ``origin``, or the first keyset page."""
+    context = {}
+    for location_type, model in (('pickup', PickUpLocation), ('dropoff', DropOffLocation)):
+        current_selection = getattr(nav_session, f'{location_type}_id')
+        if origin:
+            locations = with_etas(nearest_locations(model.objects.all(), *origin))
+            cursor = None
+            html = render_cards(locations, location_type, current_selection, compact=True, origin=origin)
+        else:
+            locations, cursor, html = cards_page(
+                model.objects.all(), location_type, None, current_selection, compact=True
+            )
+        context[f'{location_type}s'] = locations
+        context[f'{location_type}s_cursor'] = cursor
+        context[f'{location_type}s_html'] = html
+    return context
+
+
+@conditional_page(page_etag)
+async def select_locations(request):
     """View for selecting pickup and dropoff locations."""
-    nav_session = get_or_create_navigation_session(request)
+    nav_session = await aget_or_create_navigation_session(request)
 
     if request.method == 'POST':
         pickup_id = request.POST.get('pickup_id')
         dropoff_id = request.POST.get('dropoff_id')
 
-        # Update pickup selection
+        # Pickup is applied before dropoff; both are written in one conditional UPDATE
+        steps = []
         if pickup_id:
-            pickup = get_object_or_404(PickUpLocation, id=pickup_id)
-            nav_session.pickup = pickup
-            # If pickup is changed after dropoff was selected, reset dropoff if state allows
-            if nav_session.state in ['dropoff_selected', 'navigated_to_dropoff']:
-                nav_session.dropoff = None
-                nav_session.state = 'pickup_selected'
-            elif nav_session.state == 'no_selection':
-                nav_session.state = 'pickup_selected'
-            nav_session.save()
-
-        # Update dropoff selection
+            pickup = await aget_object_or_404(PickUpLocation, id=pickup_id)
+            steps.append((SELECT_PICKUP, {'pickup': pickup}))
         if dropoff_id:
-            dropoff = get_object_or_404(DropOffLocation, id=dropoff_id)
-            nav_session.dropoff = dropoff
-            if nav_session.state == 'navigated_to_pickup':
-                nav_session.state = 'dropoff_selected'
-            nav_session.save()
+            dropoff = await aget_object_or_404(DropOffLocation, id=dropoff_id)
+            steps.append((SELECT_DROPOFF, {'dropoff': dropoff}))
+        if steps:
+            await aapply_transitions(request, steps)
 
         messages.success(request, 'Locations selected successfully.')
         return redirect('routes:navigate_view')
 
-    # GET: Display selection form
-    pickups = PickUpLocation.objects.all()
-    dropoffs = DropOffLocation.objects.all()
-    
-    context = {
-        'pickups': pickups,
-        'dropoffs': dropoffs,
-        'nav_session': nav_session,
-    }
+    # GET: Display selection form, nearest first when ?lat=&lng= are given,
+    # otherwise the first keyset page of each list (more are fetched on scroll)
+    origin = parse_coordinates(request.GET)
+    context = {'nav_session': nav_session, 'origin': origin}
+    context.update(await _selection_lists(nav_session, origin))
     return render(request, 'routes/select_locations.html', context)
 
 
-def navigate_view(request):
+@conditional_page(navigate_etag)
+async def navigate_view(request):
     """View for displaying navigate page with button."""
-    nav_session = get_or_create_navigation_session(request)
+    nav_session = await aget_or_create_navigation_session(request)
 
     # Validate state - ensure pickup is selected
     if not nav_session.pickup:
@@ -122,43 +240,24 @@ def navigate_view(request):
         return redirect('routes:select_locations')
 
     # State consistency check - if state says dropoff is selected but no dropoff, reset
-    if nav_session.state in ['dropoff_selected', 'navigated_to_dropoff'] and not nav_session.dropoff:
-        nav_session.state = 'navigated_to_pickup'
-        nav_session.save()
+    previous_state = nav_session.state
+    nav_session, transition = await aapply_transition(request, VIEW)
+    if nav_session.state != previous_state:
         messages.warning(request, 'Dropoff location was cleared. Please select a dropoff location.')
 
-    from .utils import generate_maps_url, is_mobile_device
-    is_mobile = is_mobile_device(request)
+    platform = detect_platform(request)
 
-    # Determine target location based on state
+    # The transition table gives the target and label of the navigate button
     # First navigate: Origin = current GPS, Destination = pickup
     # Second navigate: Origin = current GPS, Destination = dropoff
-    if nav_session.state == 'pickup_selected':
-        # First navigation: go to pickup from current location
-        target_location = nav_session.pickup
-        button_label = 'Navigate to Pickup'
-    elif nav_session.state == 'navigated_to_pickup' and nav_session.dropoff:
-        # After reaching pickup, next navigation goes to dropoff from current location
-        target_location = nav_session.dropoff
-        button_label = 'Navigate to Dropoff'
-    elif nav_session.state in ['dropoff_selected', 'navigated_to_dropoff']:
-        # Dropoff navigation
-        if not nav_session.dropoff:
-            messages.error(request, 'Please select a dropoff location first.')
-            return redirect('routes:select_locations')
-        target_location = nav_session.dropoff
-        button_label = 'Navigate to Dropoff'
-    else:
-        # Default: navigate to pickup (first navigation)
-        target_location = nav_session.pickup
-        button_label = 'Navigate to Pickup'
+    target_location = transition_target(nav_session, transition)
+    button_label = transition.button_label
 
-    urls = generate_maps_url(target_location, is_mobile)
+    urls = generate_maps_url(target_location, platform=platform)
 
-    # Check if there's a navigate URL in session (from navigate_action)
+    # Check if there's a navigate URL waiting (from navigate_action)
     # This means we just updated state and should open maps in new window
-    navigate_url = request.session.pop('navigate_url', None)
-    navigate_url_web_fallback = request.session.pop('navigate_url_web_fallback', None)
+    navigate_url, navigate_url_web_fallback = pop_navigate_urls(request)
 
     context = {
         'navigation_session': nav_session,
@@ -168,77 +267,116 @@ def navigate_view(request):
         'target_location': target_location,
         'auto_navigate_url': navigate_url,  # URL to auto-open in new window
         'auto_navigate_url_web_fallback': navigate_url_web_fallback,
+        # Taps left, with their links, so the button keeps working offline
+        'navigate_plan': navigate_plan(nav_session, platform),
     }
-    return render(request, 'routes/navigate.html', context)
-
-
-def navigate_action(request):
-    """Process navigate button click - generate deep link and update state."""
+    response = render(request, 'routes/navigate.html', context)
+    if navigate_url:
+        # Opens Maps on load: never stored, so neither the browser nor the
+        # service worker can replay it
+        patch_cache_control(response, no_store=True)
+    return response
+
+
+async def navigate_action(request):
+    """
+    Process navigate button click - generate deep link and update state.
+
+    Taps made offline are replayed by the service worker with
+    ``expected_state`` (the state the tap was made in; a tap that no longer
+    matches was already applied and is skipped) and ``opened=1`` (Maps was
+    already opened on the device).
+    """
     if request.method != 'POST':
         return redirect('routes:navigate_view')
 
-    nav_session = get_or_create_navigation_session(request)
+    nav_session = await aget_or_create_navigation_session(request)
 
     # Validate state and selections
     if not nav_session.pickup:
         messages.error(request, 'Please select a pickup location first.')
         return redirect('routes:select_locations')
 
-    # Determine next state and target location
+    expected_state = request.POST.get('expected_state')
+    if expected_state and expected_state != nav_session.state:
+        return redirect('routes:navigate_view')
+
+    # Advance the state and determine the target location
     # Origin is always current GPS location (handled by generate_maps_url)
-    if nav_session.state == 'pickup_selected':
-        # First navigation: go to pickup from current location
-        nav_session.state = 'navigated_to_pickup'
-        nav_session.save()
-        target_location = nav_session.pickup
-    elif nav_session.state == 'navigated_to_pickup' and nav_session.dropoff:
-        # After reaching pickup, next navigation goes to dropoff from current location
-        nav_session.state = 'navigated_to_dropoff'
-        nav_session.save()
-        target_location = nav_session.dropoff
-    elif nav_session.state == 'dropoff_selected':
-        # Navigate to dropoff from current location
-        nav_session.state = 'navigated_to_dropoff'
-        nav_session.save()
-        target_location = nav_session.dropoff
-    elif nav_session.state == 'navigated_to_dropoff':
-        # Re-navigating to dropoff from current location
-        target_location = nav_session.dropoff
-    else:
-        # Default: navigate to pickup from current location
-        nav_session.state = 'navigated_to_pickup'
-        nav_session.save()
-        target_location = nav_session.pickup
+    nav_session, transition = await aapply_transition(request, NAVIGATE)
+    if request.POST.get('opened'):
+        return redirect('routes:navigate_view')
+    target_location = transition_target(nav_session, transition)
 
-    # Generate maps URLs and store in session for JavaScript to open in new window
-    from .utils import generate_maps_url, is_mobile_device
-    is_mobile = is_mobile_device(request)
-    urls = generate_maps_url(target_location, is_mobile)
+    # Generate maps URLs for JavaScript to open in new window
+    urls = generate_maps_url(target_location, platform=detect_platform(request))
 
-    # Store the URL in session so JavaScript can open it in a new window
+    # Keep the URL (in a signed cookie, or the state cookie) so JavaScript can open it in a new window
     # This keeps the user on the app page so they can navigate again
-    request.session['navigate_url'] = urls['deep_link'] if is_mobile else urls['web_fallback']
-    request.session['navigate_url_web_fallback'] = urls['web_fallback']
+    # (deep_link is already the web URL on desktop)
+    set_navigate_urls(request, urls)
     
     # Redirect back to navigate view - JavaScript will open maps in new window
     return redirect('routes:navigate_view')
 
 
-def state_view(request):
+async def state_view(request):
     """Display current navigation session state (for debugging/info)."""
-    nav_session = get_or_create_navigation_session(request)
+    nav_session = await aget_or_create_navigation_session(request)
     context = {
         'nav_session': nav_session,
     }
     return render(request, 'routes/navigation_state.html', context)
 
 
+def driver_link(request, token):
+    """Open a dispatched driver's session (see routes.dispatch) straight on the navigate page."""
+    try:
+        session_key = driver_session_key(token)
+    except ValueError:
+        raise Http404('Unknown driver.')
+    nav_session = (
+        NavigationSession.objects.select_related('pickup', 'dropoff')
+        .filter(session_key=session_key).first()
+    )
+    if nav_session is None:
+        raise Http404('Unknown driver.')
+    response = redirect('routes:navigate_view')
+    bind_driver(request, response, token, nav_session)
+    return response
+
+
+def service_worker(request):
+    """
+    Serve the service worker (routes/sw.js) from the site root, so it controls every page.
+
+    Its cache name changes with the templates and static files, so a deploy
+    replaces the cached page shell.
+    """
+    precache = [static('routes/css/style.css'), static('routes/js/main.js')]
+    response = render(request, 'routes/sw.js', {
+        'cache_version': TEMPLATE_DIGEST,
+        'precache': json.dumps(precache),
+        'navigate_url': json.dumps(reverse('routes:navigate_view')),
+        'admin_url': json.dumps(reverse('admin:index')),
+    }, content_type='text/javascript')
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@staff_member_required
+def dashboard(request):
+    """Live view of recently active navigation sessions, updated from api/events/."""
+    nav_sessions = list(
+        NavigationSession.objects.select_related('pickup', 'dropoff').order_by('-updated_at')[:DASHBOARD_SESSIONS]
+    )
+    for nav_session in nav_sessions:
+        nav_session.label = session_label(nav_session.session_key)
+    return render(request, 'routes/dashboard.html', {'nav_sessions': nav_sessions})
+
+
 def start_over(request):
     """Reset navigation session to initial state."""
-    nav_session = get_or_create_navigation_session(request)
-    nav_session.pickup = None
-    nav_session.dropoff = None
-    nav_session.state = 'no_selection'
-    nav_session.save()
+    apply_transition(request, RESET)
     messages.info(request, 'Navigation session reset. Please select locations again.')
     return redirect('routes:select_locations')